@@ -0,0 +1,90 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+
+from common import LoggerFactory
+from sqlalchemy import MetaData
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.config import ConfigClass
+
+_logger = LoggerFactory('database').get_logger()
+
+
+class Database:
+    """Keep one pooled async engine and the reflected tables per process."""
+
+    def __init__(self) -> None:
+        self._engine = None
+        self._metadata = None
+
+    def get_engine(self) -> AsyncEngine:
+        '''
+        Summary:
+            the function will return the engine of current process. The
+            engine is created at first call so the connection pool will
+            be reused by all the requests
+
+        Return:
+            - AsyncEngine: the pooled engine
+        '''
+
+        if self._engine is None:
+            self._engine = create_async_engine(
+                ConfigClass.RDS_DB_URI,
+                pool_size=ConfigClass.RDS_POOL_SIZE,
+                max_overflow=ConfigClass.RDS_MAX_OVERFLOW,
+                pool_pre_ping=True,
+            )
+
+        return self._engine
+
+    async def get_metadata(self) -> MetaData:
+        '''
+        Summary:
+            the function will reflect the approval_entity table once and
+            return the cached metadata afterwards. The failed reflection
+            is not cached so it will be retried in next call
+
+        Return:
+            - MetaData: the metadata with approval_entity table
+        '''
+
+        if self._metadata is None:
+            metadata = MetaData(schema=ConfigClass.RDS_SCHEMA_DEFAULT)
+            async with self.get_engine().connect() as conn:
+                await conn.run_sync(metadata.reflect, only=['approval_entity'])
+            self._metadata = metadata
+
+        return self._metadata
+
+    async def dispose(self) -> None:
+        '''
+        Summary:
+            the function will close all the connections in the pool. The
+            engine will be created again if it is used afterwards
+        '''
+
+        engine: Optional[AsyncEngine] = self._engine
+        self._engine = None
+        self._metadata = None
+        if engine is not None:
+            _logger.info('Dispose the database engine')
+            await engine.dispose()
+
+
+database = Database()
@@ -0,0 +1,518 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from common import LoggerFactory
+
+from app.commons.data_providers.redis import SrvRedisSingleton, hash_tag
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+_logger = LoggerFactory('JobStatusStore').get_logger()
+
+# the hash field of the rendered response
+RESPONSE_FIELD = '_response'
+# the fields to check the owner and the ttl of job status
+SUMMARY_FIELDS = ('action', 'project_code', 'operator', 'status', 'update_timestamp')
+# the success response of APIResponse before the job status
+_RESPONSE_PREFIX = b'{"code":200,"error_msg":"","page":0,"total":1,"num_of_pages":1,"result":'
+
+_keyspace_size = metrics.gauge('redis_keyspace_size', 'Number of keys in redis database')
+_purged = metrics.counter('job_status_purged', 'Job status keys removed by retention')
+_coalesced = metrics.counter('job_status_coalesced', 'Job status updates replaced by later update')
+_pipelines = metrics.counter('job_status_pipelines', 'Pipelines of job status updates')
+_missing = metrics.counter('job_status_missing', 'Partial job status updates written again as job hash was missing')
+
+
+class JobStatusStore:
+    """Keep the status of download jobs as one redis hash per job.
+
+    The job is identified by session id and job id which are both in the download token, so the status is
+    read with one HGETALL. Every field is kept as json value. The jobs are also indexed by session with redis
+    sets of job members formatted as <session_id>:<job_id>.
+
+    Every update is published to the channel of the job, so the waiting clients are notified without
+    polling. Each job expires by the ttl of its status. The finished jobs are kept for a short time and the others
+    are kept until the download token expires, which is also the ttl of indexes.
+    """
+
+    prefix = 'download:'
+    legacy_prefix = 'dataaction:'
+
+    def __init__(self) -> None:
+        self.redis = SrvRedisSingleton()
+
+    @classmethod
+    def get_job_key(cls, session_id: str, job_id: str) -> str:
+        # the job keys share the slot with the session index in redis cluster
+        return f'{cls.prefix}job:{hash_tag(session_id)}:{job_id}'
+
+    @classmethod
+    def get_channel(cls, session_id: str, job_id: str) -> str:
+        return f'{cls.prefix}status:{session_id}:{job_id}'
+
+    @classmethod
+    def get_session_key(cls, session_id: str) -> str:
+        return f'{cls.prefix}session:{hash_tag(session_id)}'
+
+    @staticmethod
+    def get_ttl(status: Optional[str]) -> int:
+        '''
+        Summary:
+            the function will return the ttl in seconds of job status
+
+        Parameter:
+            - status(str): the name of EDataDownloadStatus. None for index
+
+        Return:
+            - int: the ttl in seconds
+        '''
+
+        if status == 'SUCCEED':
+            return ConfigClass.JOB_STATUS_SUCCEED_TTL
+        if status == 'CANCELLED':
+            return ConfigClass.JOB_STATUS_CANCELLED_TTL
+
+        # the status cannot be read after the download token expires
+        return ConfigClass.DOWNLOAD_TOKEN_EXPIRE_AT * 60
+
+    @staticmethod
+    def encode(record: dict) -> Dict[str, bytes]:
+        return {field: orjson.dumps(value) for field, value in record.items()}
+
+    @staticmethod
+    def decode(mapping: Dict[bytes, bytes]) -> Optional[dict]:
+        if not mapping:
+            return None
+
+        return {
+            field.decode(): orjson.loads(value) for field, value in mapping.items() if field != RESPONSE_FIELD.encode()
+        }
+
+    @staticmethod
+    def get_summary(record: dict) -> dict:
+        return {field: record[field] for field in SUMMARY_FIELDS if field in record}
+
+    @staticmethod
+    def render_response(data: bytes) -> bytes:
+        '''
+        Summary:
+            the function will render the success response of the job status
+            in same format as APIResponse.json_response()
+
+        Parameter:
+            - data(bytes): the job status encoded as json
+
+        Return:
+            - bytes: the response body
+        '''
+
+        return _RESPONSE_PREFIX + data + b'}'
+
+    async def set(self, record: dict) -> None:
+        '''
+        Summary:
+            the function will save the whole job status, add the job into
+            the session index and publish the job status in one round trip
+
+        Parameter:
+            - record(dict): the job status with session_id and job_id
+        '''
+
+        await self.write_many([(record, record, True)])
+
+    async def write_many(self, writes: List[Tuple[dict, dict, bool]]) -> List[dict]:
+        '''
+        Summary:
+            the function will save the status of many jobs in one pipeline.
+            Only the changed fields are written into the job hash together
+            with the rendered response, and the full job status is published.
+            The partial write checks the job hash exists in same pipeline
+
+        Parameter:
+            - writes(list): the tuples of job status, the changed fields and
+                whether it is the full write which also adds the job into
+                indexes
+
+        Return:
+            - list: the job status of partial writes whose job hash was
+                missing, so they need to be fully written
+        '''
+
+        index_ttl = self.get_ttl(None)
+        partial = []
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for record, fields, full in writes:
+                session_id, job_id = record['session_id'], record['job_id']
+                job_key = self.get_job_key(session_id, job_id)
+                data = orjson.dumps(record)
+                mapping = self.encode(fields)
+                mapping[RESPONSE_FIELD] = self.render_response(data)
+                if not full:
+                    partial.append((len(pipe), record))
+                    pipe.exists(job_key)
+                pipe.hset(job_key, mapping=mapping)
+                pipe.expire(job_key, self.get_ttl(record.get('status')))
+                if full:
+                    member = f'{session_id}:{job_id}'
+                    pipe.sadd(self.get_session_key(session_id), member)
+                    pipe.expire(self.get_session_key(session_id), index_ttl)
+                # the pipeline of redis cluster blocks publish() but sends the
+                # raw PUBLISH command to the default node
+                pipe.execute_command('PUBLISH', self.get_channel(session_id, job_id), data)
+            results = await pipe.execute()
+
+        return [record for position, record in partial if not results[position]]
+
+    async def get(self, session_id: str, job_id: str) -> Optional[dict]:
+        '''
+        Summary:
+            the function will return the job status
+
+        Parameter:
+            - session_id(str): the session id for current user
+            - job_id(str): the job identifier
+
+        Return:
+            - dict: the job status. None if job does not exist
+        '''
+
+        return self.decode(await self.redis.REDIS.hgetall(self.get_job_key(session_id, job_id)))
+
+    async def get_response(self, session_id: str, job_id: str) -> Optional[Tuple[dict, bytes]]:
+        '''
+        Summary:
+            the function will return the rendered response of the job status
+            without decoding the whole job status
+
+        Parameter:
+            - session_id(str): the session id for current user
+            - job_id(str): the job identifier
+
+        Return:
+            - dict: the fields to check the owner and the ttl of job status
+            - bytes: the response body
+            None if job does not exist
+        '''
+
+        job_key = self.get_job_key(session_id, job_id)
+        *values, body = await self.redis.REDIS.hmget(job_key, *SUMMARY_FIELDS, RESPONSE_FIELD)
+        if body is None:
+            # the job status saved before the response is rendered
+            record = await self.get(session_id, job_id)
+            if record is None:
+                return None
+            return self.get_summary(record), self.render_response(orjson.dumps(record))
+
+        summary = {field: orjson.loads(value) for field, value in zip(SUMMARY_FIELDS, values) if value is not None}
+        return summary, body
+
+    async def get_many(self, jobs: List[Tuple[str, str]]) -> List[Optional[dict]]:
+        '''
+        Summary:
+            the function will return the status of jobs in one round trip
+
+        Parameter:
+            - jobs(list): the pairs of session id and job id
+
+        Return:
+            - list: the job status in same order. None if job does not exist
+        '''
+
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for session_id, job_id in jobs:
+                pipe.hgetall(self.get_job_key(session_id, job_id))
+            mappings = await pipe.execute()
+
+        return [self.decode(mapping) for mapping in mappings]
+
+    async def _get_members(self, index_key: str) -> List[dict]:
+        members = sorted(await self.redis.get_set_members(index_key))
+        jobs = [tuple(member.decode().split(':', 1)) for member in members]
+
+        records, expired = [], []
+        for member, record in zip(members, await self.get_many(jobs)):
+            if record is None:
+                expired.append(member)
+            else:
+                records.append(record)
+
+        # the expired jobs are removed from index lazily
+        if expired:
+            await self.redis.REDIS.srem(index_key, *expired)
+
+        return records
+
+    async def list_by_session(self, session_id: str) -> List[dict]:
+        '''
+        Summary:
+            the function will return the status of all jobs in the session
+
+        Parameter:
+            - session_id(str): the session id for current user
+
+        Return:
+            - list: the job status
+        '''
+
+        return await self._get_members(self.get_session_key(session_id))
+
+    async def migrate_legacy(self) -> int:
+        '''
+        Summary:
+            the function will move the job status saved as legacy
+            dataaction:* keys into the job hashes. The keys are found by
+            SCAN so redis is not blocked. If there are several legacy keys
+            for one job, the latest one is kept. Only one worker process
+            will run the migration at the same time
+
+        Return:
+            - int: the number of migrated keys
+        '''
+
+        lock_key = self.prefix + 'migration'
+        if not await self.redis.REDIS.set(lock_key, 1, ex=ConfigClass.JOB_STATUS_MIGRATION_LOCK_TTL, nx=True):
+            return 0
+
+        migrated = 0
+        try:
+            keys = []
+            async for key in self.redis.REDIS.scan_iter(match=self.legacy_prefix + '*', count=1000):
+                keys.append(key)
+                if len(keys) >= 1000:
+                    migrated += await self._migrate_keys(keys)
+                    keys = []
+            if keys:
+                migrated += await self._migrate_keys(keys)
+        finally:
+            await self.redis.REDIS.delete(lock_key)
+
+        _logger.info(f'Migrated {migrated} legacy job status keys')
+        return migrated
+
+    async def _migrate_keys(self, keys: List[bytes]) -> int:
+        records = {}
+        for value in await self.redis.mget_by_keys(keys):
+            if value is None:
+                continue
+            record = orjson.loads(value)
+            job_key = self.get_job_key(record['session_id'], record['job_id'])
+            if job_key not in records or int(records[job_key]['update_timestamp']) < int(record['update_timestamp']):
+                records[job_key] = record
+
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for job_key in records:
+                pipe.hget(job_key, 'update_timestamp')
+            current_timestamps = await pipe.execute()
+
+        now = int(time.time())
+        for record, current in zip(records.values(), current_timestamps):
+            # the job over the ttl of its status is dropped
+            if int(record['update_timestamp']) + self.get_ttl(record.get('status')) <= now:
+                continue
+            if current is None or int(orjson.loads(current)) < int(record['update_timestamp']):
+                await self.set(record)
+
+        await self.redis.unlink_by_keys(keys)
+        return len(keys)
+
+    async def apply_retention(self) -> int:
+        '''
+        Summary:
+            the function will apply the retention policy on the job status
+            saved without ttl. The keys are found by SCAN and the jobs over
+            the ttl of their status are removed by pipelined UNLINK. The
+            others will get the remaining ttl. The lease is kept until it
+            expires, so only one worker process will run the retention
+            in every JOB_STATUS_RETENTION_INTERVAL
+
+        Return:
+            - int: the number of removed jobs
+        '''
+
+        lease_key = self.prefix + 'retention'
+        if not await self.redis.REDIS.set(lease_key, 1, ex=ConfigClass.JOB_STATUS_RETENTION_INTERVAL, nx=True):
+            return 0
+
+        now = int(time.time())
+        purged = 0
+        keys = []
+        async for key in self.redis.REDIS.scan_iter(match=self.prefix + '*', count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                purged += await self._apply_retention_keys(keys, now)
+                keys = []
+        if keys:
+            purged += await self._apply_retention_keys(keys, now)
+
+        _purged.inc(purged)
+        _logger.info(f'Purged {purged} expired job status')
+        return purged
+
+    async def _apply_retention_keys(self, keys: List[bytes], now: int) -> int:
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+            ttls = await pipe.execute()
+
+        # only the keys without expiry need the policy
+        keys = [key for key, ttl in zip(keys, ttls) if ttl == -1]
+        job_keys = [key for key in keys if key.decode().startswith(self.prefix + 'job:')]
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for key in job_keys:
+                pipe.hmget(key, 'status', 'update_timestamp')
+            fields = await pipe.execute()
+
+        expired = []
+        async with self.redis.REDIS.pipeline(transaction=False) as pipe:
+            for key, (status, update_timestamp) in zip(job_keys, fields):
+                status = orjson.loads(status) if status else None
+                update_timestamp = int(orjson.loads(update_timestamp)) if update_timestamp else 0
+                remaining = update_timestamp + self.get_ttl(status) - now
+                if remaining > 0:
+                    pipe.expire(key, remaining)
+                else:
+                    expired.append(key)
+            for key in set(keys) - set(job_keys):
+                pipe.expire(key, self.get_ttl(None))
+            await pipe.execute()
+
+        if expired:
+            await self.redis.unlink_by_keys(expired)
+
+        return len(expired)
+
+    async def update_metrics(self) -> None:
+        '''
+        Summary:
+            the function will update the keyspace size of redis by DBSIZE
+        '''
+
+        _keyspace_size.set(await self.redis.get_keyspace_size())
+
+
+class JobStatusWriter:
+    """Coalesce the job status updates and write them into redis by pipeline.
+
+    The updates in STATUS_WRITE_WINDOW are written together in one pipeline and only the last update of same job
+    is written. The writer remembers the last written status of recent jobs, so the following updates only write
+    the changed fields and skip the indexes. The job is fully written again if its hash is missing when the
+    changed fields are written. The caller waits until its update is written.
+    """
+
+    def __init__(self, store: JobStatusStore, cache_size: int = 10000) -> None:
+        self.store = store
+        self.cache_size = cache_size
+        self._pending = {}
+        self._written = OrderedDict()
+        self._flush_task = None
+
+    def clear(self) -> None:
+        '''
+        Summary:
+            the function will forget the written job status, so the next
+            update of each job is fully written
+        '''
+
+        self._written.clear()
+
+    async def write(self, record: dict) -> None:
+        '''
+        Summary:
+            the function will queue the job status and wait until it is
+            written. The queued status of same job is replaced
+
+        Parameter:
+            - record(dict): the job status with session_id and job_id
+        '''
+
+        job_key = self.store.get_job_key(record['session_id'], record['job_id'])
+        if job_key in self._pending:
+            _, future = self._pending[job_key]
+            _coalesced.inc()
+        else:
+            future = asyncio.get_event_loop().create_future()
+        self._pending[job_key] = (record, future)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+        await asyncio.shield(future)
+
+    async def _flush(self) -> None:
+        # only one flush runs at the same time so the updates of same job
+        # are written in order
+        try:
+            while self._pending:
+                await asyncio.sleep(ConfigClass.STATUS_WRITE_WINDOW)
+                pending, self._pending = self._pending, {}
+                await self._write(pending)
+        finally:
+            self._flush_task = None
+
+    async def _write(self, pending: Dict[str, Tuple[dict, asyncio.Future]]) -> None:
+        writes = []
+        # the key may expire if the job is not updated for a long time, so
+        # the old cache entry is not used for partial write
+        stale_at = time.time() - self.store.get_ttl(None) / 2
+        for job_key, (record, _) in pending.items():
+            written, written_at = self._written.get(job_key, (None, 0))
+            if written is None or written_at < stale_at:
+                writes.append((record, record, True))
+            else:
+                fields = {field: value for field, value in record.items() if written.get(field) != value}
+                writes.append((record, fields, False))
+
+        try:
+            missing = await self.store.write_many(writes)
+            # the job hash has expired or been removed, so the partial write
+            # only has the changed fields and the full status is written again
+            if missing:
+                _missing.inc(len(missing))
+                await self.store.write_many([(record, record, True) for record in missing])
+        except Exception as e:
+            _logger.error(f'Fail to write job status: {e}')
+            for job_key, (_, future) in pending.items():
+                self._written.pop(job_key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        _pipelines.inc()
+        for job_key, (record, future) in pending.items():
+            self._remember(job_key, record)
+            if not future.done():
+                future.set_result(None)
+
+    def _remember(self, job_key: str, record: dict) -> None:
+        # the finished job will not be updated again
+        if record.get('status') in ('SUCCEED', 'CANCELLED'):
+            self._written.pop(job_key, None)
+            return
+
+        self._written[job_key] = (record, time.time())
+        self._written.move_to_end(job_key)
+        while len(self._written) > self.cache_size:
+            self._written.popitem(last=False)
+
+
+job_status_store = JobStatusStore()
+job_status_writer = JobStatusWriter(job_status_store)
@@ -0,0 +1,170 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import orjson
+
+from app.commons.data_providers.job_status import JobStatusStore, job_status_store
+from app.commons.data_providers.job_status_listener import (
+    JobStatusListener,
+    job_status_listener,
+)
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+_hits = metrics.counter('job_status_cache_hits', 'Job status reads served by in process cache')
+_misses = metrics.counter('job_status_cache_misses', 'Job status reads sent to redis')
+
+
+class JobStatusCache:
+    """Cache the job status in process.
+
+    The entry keeps the rendered response of job status, so the response can be sent without encoding. Every
+    write of job status is published with the full record on the status channel of the job, so the cached entry
+    is replaced by the published one. Each gunicorn worker keeps its own cache up to date by its
+    own subscription. The cache is bypassed and dropped while the subscription is broken.
+    """
+
+    def __init__(self, store: JobStatusStore, listener: JobStatusListener) -> None:
+        self.store = store
+        self.listener = listener
+        self._local = OrderedDict()
+        # the sequence of the last message of recent channels. The read from
+        # redis is only cached if no message arrived during the read
+        self._sequence = 0
+        self._changed = OrderedDict()
+        self._forgotten = 0
+        listener.add_handler(self.update)
+
+    def clear(self) -> None:
+        '''
+        Summary:
+            the function will drop all the cached job status
+        '''
+
+        self._local.clear()
+        self._changed.clear()
+        self._forgotten = self._sequence
+
+    def update(self, channel: Optional[str], data: Optional[bytes]) -> None:
+        '''
+        Summary:
+            the function will replace the cached job status by the published
+            one. All the cached job status is dropped if the messages may
+            have been missed
+
+        Parameter:
+            - channel(str): the status channel of the job
+            - data(bytes): the published job status
+        '''
+
+        if channel is None:
+            self.clear()
+            return
+
+        self._sequence += 1
+        self._changed[channel] = self._sequence
+        self._changed.move_to_end(channel)
+        while len(self._changed) > ConfigClass.STATUS_CACHE_SIZE:
+            _, self._forgotten = self._changed.popitem(last=False)
+
+        if channel in self._local:
+            self._set_local(channel, self.store.get_summary(orjson.loads(data)), self.store.render_response(data))
+
+    def _set_local(self, channel: str, summary: dict, body: bytes) -> None:
+        # the job status is not kept longer than it is in redis
+        expire_at = min(
+            time.time() + ConfigClass.STATUS_CACHE_TTL,
+            int(summary.get('update_timestamp') or 0) + self.store.get_ttl(summary.get('status')),
+        )
+        self._local[channel] = (expire_at, summary, body)
+        self._local.move_to_end(channel)
+        while len(self._local) > ConfigClass.STATUS_CACHE_SIZE:
+            self._local.popitem(last=False)
+
+    def _get_local(self, channel: str) -> Optional[Tuple[dict, bytes]]:
+        entry = self._local.get(channel)
+        if entry is None:
+            return None
+
+        expire_at, summary, body = entry
+        if expire_at < time.time():
+            del self._local[channel]
+            return None
+
+        self._local.move_to_end(channel)
+        return summary, body
+
+    async def get_response(self, session_id: str, job_id: str) -> Optional[Tuple[dict, bytes]]:
+        '''
+        Summary:
+            the function will read the rendered response of job status from
+            the cache and then from redis. The cache is only used while the
+            status channels are subscribed
+
+        Parameter:
+            - session_id(str): the session id for current user
+            - job_id(str): the job identifier
+
+        Return:
+            - dict: the fields to check the owner of job status
+            - bytes: the response body
+            None if the job does not exist
+        '''
+
+        if not ConfigClass.STATUS_CACHE_SIZE or not self.listener.is_healthy:
+            return await self.store.get_response(session_id, job_id)
+
+        channel = self.store.get_channel(session_id, job_id)
+        entry = self._get_local(channel)
+        if entry is not None:
+            _hits.inc()
+            return entry
+
+        _misses.inc()
+        sequence = self._sequence
+        entry = await self.store.get_response(session_id, job_id)
+        changed = self._changed.get(channel, self._forgotten)
+        if entry is not None and changed <= sequence and self.listener.is_healthy:
+            self._set_local(channel, *entry)
+
+        return entry
+
+    async def get(self, session_id: str, job_id: str) -> Optional[dict]:
+        '''
+        Summary:
+            the function will read the job status from the cache and then
+            from redis
+
+        Parameter:
+            - session_id(str): the session id for current user
+            - job_id(str): the job identifier
+
+        Return:
+            - dict: the job status. None if the job does not exist
+        '''
+
+        entry = await self.get_response(session_id, job_id)
+        if entry is None:
+            return None
+
+        return orjson.loads(entry[1])['result']
+
+
+job_status_cache = JobStatusCache(job_status_store, job_status_listener)
@@ -0,0 +1,194 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+
+import orjson
+from common import LoggerFactory
+
+from app.commons.data_providers.job_status import JobStatusStore
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.metrics import metrics
+
+_logger = LoggerFactory('JobStatusListener').get_logger()
+
+_waiting = metrics.gauge('job_status_waiters', 'Clients waiting for job status update')
+
+
+class JobStatusListener:
+    """Fan out the job status published in redis to the clients waiting in current process.
+
+    One pattern subscription is shared by all the waiting clients, so the number of redis connections does
+    not grow with the number of streams. The subscription starts with the first waiting client. The handlers
+    receive every message and are told when the messages may have been missed.
+    """
+
+    def __init__(self) -> None:
+        self._waiters = defaultdict(set)
+        self._handlers = []
+        self._pubsub = None
+        self._starting = None
+        self._task = None
+        self.is_healthy = False
+
+    def add_handler(self, handler: Callable[[Optional[str], Optional[bytes]], None]) -> None:
+        '''
+        Summary:
+            the function will register the handler called with the channel
+            and data of every message. The handler is called with None when
+            the subscription is broken and the messages may be missed
+
+        Parameter:
+            - handler(Callable): the function of channel and data
+        '''
+
+        self._handlers.append(handler)
+
+    def _notify(self, channel: Optional[str], data: Optional[bytes]) -> None:
+        for handler in self._handlers:
+            try:
+                handler(channel, data)
+            except Exception as e:
+                _logger.error('Fail to handle job status update: %s', str(e))
+
+    async def start(self) -> None:
+        '''
+        Summary:
+            the function will subscribe the status channels of all jobs
+            and start dispatching the messages in background. The callers
+            at the same time will wait for the same subscription
+        '''
+
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._subscribe())
+        try:
+            await asyncio.shield(self._starting)
+        except Exception:
+            self._starting = None
+            raise
+
+    async def _subscribe(self) -> None:
+        pubsub = SrvRedisSingleton().pubsub()
+        await pubsub.psubscribe(JobStatusStore.get_channel('*', '*'))
+        self._pubsub = pubsub
+        self._task = asyncio.ensure_future(self._listen())
+        self.is_healthy = True
+
+    async def stop(self) -> None:
+        '''
+        Summary:
+            the function will stop dispatching and close the subscription
+        '''
+
+        if self._task is None:
+            return
+
+        self.is_healthy = False
+        self._notify(None, None)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self._pubsub.close()
+        self._task = None
+        self._pubsub = None
+        self._starting = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.error('Fail to read job status update: %s', str(e))
+                if self.is_healthy:
+                    self.is_healthy = False
+                    self._notify(None, None)
+                await asyncio.sleep(1)
+                continue
+
+            # the subscription is made again when the connection is back
+            self.is_healthy = True
+            if message is None or message.get('type') != 'pmessage':
+                continue
+
+            channel = message['channel'].decode()
+            self._notify(channel, message['data'])
+            waiters = self._waiters.get(channel)
+            if not waiters:
+                continue
+
+            record = orjson.loads(message['data'])
+            for queue in waiters:
+                # the slow client only misses the intermediate status
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(record)
+
+    @asynccontextmanager
+    async def subscribe(self, session_id: str, job_id: str) -> AsyncIterator[asyncio.Queue]:
+        '''
+        Summary:
+            the function will register a queue receiving the status updates
+            of the job until the context exits
+
+        Parameter:
+            - session_id(str): the session id for current user
+            - job_id(str): the job identifier
+
+        Return:
+            - asyncio.Queue: the queue of job status
+        '''
+
+        await self.start()
+
+        channel = JobStatusStore.get_channel(session_id, job_id)
+        queue = asyncio.Queue(maxsize=10)
+        self._waiters[channel].add(queue)
+        _waiting.inc()
+        try:
+            yield queue
+        finally:
+            _waiting.dec()
+            self._waiters[channel].discard(queue)
+            if not self._waiters[channel]:
+                del self._waiters[channel]
+
+    async def wait(self, queue: asyncio.Queue, timeout: float) -> Optional[dict]:
+        '''
+        Summary:
+            the function will wait for next status update in the queue
+
+        Parameter:
+            - queue(asyncio.Queue): the queue from subscribe
+            - timeout(float): the seconds to wait
+
+        Return:
+            - dict: the job status. None if there is no update in time
+        '''
+
+        try:
+            return await asyncio.wait_for(queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+job_status_listener = JobStatusListener()
@@ -0,0 +1,422 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from aiokafka import AIOKafkaConsumer
+from common import LoggerFactory
+from fastavro import parse_schema, schema, schemaless_reader
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+_logger = LoggerFactory('MetadataCache').get_logger()
+
+ITEM_MESSAGE_SCHEMA = 'metadata_items_activity.avsc'
+
+
+class MetadataCache:
+    """Cache the responses of metadata service in process and in redis.
+
+    The cached value is kept as json string and decoded for each caller, so the
+    caller can modify the returned object safely. Identical lookups in flight
+    are coalesced into one call to metadata service.
+    """
+
+    # the redis value keeps the container code together with the object
+    # since v2, so the process reading it can invalidate it by container
+    prefix = 'metadata:v2:'
+
+    def __init__(self) -> None:
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._container_keys = defaultdict(set)
+        self._inflight = {}
+        self.redis = SrvRedisSingleton()
+
+        self.local_hits = metrics.counter('metadata_cache_local_hits', 'Lookups served by in process cache')
+        self.redis_hits = metrics.counter('metadata_cache_redis_hits', 'Lookups served by redis cache')
+        self.coalesced = metrics.counter('metadata_cache_coalesced', 'Lookups waiting for identical call in flight')
+        self.misses = metrics.counter('metadata_cache_misses', 'Lookups sent to metadata service')
+        self.invalidations = metrics.counter('metadata_cache_invalidations', 'Invalidated item or container')
+        self.hit_ratio = metrics.gauge('metadata_cache_hit_ratio', 'Ratio of lookups served without metadata service')
+        self.local_size = metrics.gauge('metadata_cache_local_bytes', 'Size of in process cache')
+
+    def _record(self, counter) -> None:
+        counter.inc()
+        hits = self.local_hits.value + self.redis_hits.value + self.coalesced.value
+        self.hit_ratio.set(round(hits / (hits + self.misses.value), 4))
+
+    def _get_local(self, key: str) -> Optional[Union[str, bytes]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+
+        expire_at, value, _ = entry
+        if expire_at < time.monotonic():
+            self._pop_local(key)
+            return None
+
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: Union[str, bytes], container_code: Optional[str]) -> None:
+        # the value larger than whole cache is not worth to keep
+        if len(value) > ConfigClass.METADATA_CACHE_LOCAL_BYTES:
+            return
+
+        self._pop_local(key)
+        self._local[key] = (time.monotonic() + ConfigClass.METADATA_CACHE_TTL, value, container_code)
+        self._local_bytes += len(value)
+        if container_code:
+            self._container_keys[container_code].add(key)
+
+        # evict the least recently used ones
+        while self._local_bytes > ConfigClass.METADATA_CACHE_LOCAL_BYTES:
+            self._pop_local(next(iter(self._local)))
+        self.local_size.set(self._local_bytes)
+
+    def _pop_local(self, key: str) -> None:
+        entry = self._local.pop(key, None)
+        if entry is None:
+            return
+
+        _, value, container_code = entry
+        self._local_bytes -= len(value)
+        # the container without cached keys is forgotten
+        container_keys = self._container_keys.get(container_code)
+        if container_keys is not None:
+            container_keys.discard(key)
+            if not container_keys:
+                del self._container_keys[container_code]
+
+    @staticmethod
+    def _dump_redis(result: Any, container_code: Optional[str]) -> str:
+        return json.dumps([container_code, result])
+
+    def _load_redis(self, key: str, value: Union[str, bytes]) -> Any:
+        # the object from redis is also cached in process with its container
+        container_code, result = json.loads(value)
+        self._set_local(key, json.dumps(result), container_code)
+        return result
+
+    async def lookup(self, key: str) -> Optional[Any]:
+        '''
+        Summary:
+            the function will look up the key in process and then in redis
+            without calling metadata service
+
+        Parameter:
+            - key(str): the cache key
+
+        Return:
+            - the cached object. None if not cached
+        '''
+
+        value = self._get_local(key)
+        if value is not None:
+            self._record(self.local_hits)
+            return json.loads(value)
+
+        try:
+            value = await self.redis.get_by_key(self.prefix + key)
+        except Exception as e:
+            _logger.error('Fail to read metadata cache: %s', str(e))
+            value = None
+        if value is None:
+            return None
+
+        self._record(self.redis_hits)
+        return self._load_redis(key, value)
+
+    async def lookup_many(self, keys: List[str]) -> Dict[str, Any]:
+        '''
+        Summary:
+            the function will look up the keys in process and then the rest
+            of them in redis by one MGET without calling metadata service
+
+        Parameter:
+            - keys(list): the cache keys
+
+        Return:
+            - dict: the cached objects by key. The keys not cached are
+                not included
+        '''
+
+        results, missing = {}, []
+        for key in keys:
+            value = self._get_local(key)
+            if value is None:
+                missing.append(key)
+                continue
+            self._record(self.local_hits)
+            results[key] = json.loads(value)
+
+        if not missing:
+            return results
+
+        try:
+            values = await self.redis.mget_by_keys([self.prefix + key for key in missing])
+        except Exception as e:
+            _logger.error('Fail to read metadata cache: %s', str(e))
+            return results
+
+        for key, value in zip(missing, values):
+            if value is None:
+                continue
+            self._record(self.redis_hits)
+            results[key] = self._load_redis(key, value)
+
+        return results
+
+    async def store_many(self, results: Dict[str, Any]) -> None:
+        '''
+        Summary:
+            the function will save the objects in process and in redis by
+            one pipeline with short ttl
+
+        Parameter:
+            - results(dict): the json serializable objects by cache key
+        '''
+
+        for key, result in results.items():
+            self._set_local(key, json.dumps(result), None)
+        try:
+            await self.redis.set_many(
+                {self.prefix + key: self._dump_redis(result, None) for key, result in results.items()},
+                expire=ConfigClass.METADATA_CACHE_TTL,
+            )
+        except Exception as e:
+            _logger.error('Fail to write metadata cache: %s', str(e))
+
+    async def store(self, key: str, result: Any, container_code: Optional[str] = None) -> None:
+        '''
+        Summary:
+            the function will save the object in process and in redis
+            with short ttl
+
+        Parameter:
+            - key(str): the cache key
+            - result(Any): the json serializable object
+            - container_code(str): the container of the cached count. All the
+                keys of container will be invalidated together
+        '''
+
+        self._set_local(key, json.dumps(result), container_code)
+        try:
+            await self.redis.set_by_key(
+                self.prefix + key, self._dump_redis(result, container_code), expire=ConfigClass.METADATA_CACHE_TTL
+            )
+            if container_code:
+                await self.redis.add_to_set(
+                    self.prefix + 'container:' + container_code,
+                    [self.prefix + key],
+                    expire=ConfigClass.METADATA_CACHE_TTL,
+                )
+        except Exception as e:
+            _logger.error('Fail to write metadata cache: %s', str(e))
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]], container_code: Optional[str] = None) -> Any:
+        '''
+        Summary:
+            the function will return the cached object. If it is not cached,
+            the fetch will be called and the result will be cached. The
+            concurrent calls with same key share one fetch.
+
+        Parameter:
+            - key(str): the cache key
+            - fetch(coroutine function): the function to call metadata service
+            - container_code(str): the container of the cached count
+
+        Return:
+            - the object from cache or from fetch
+        '''
+
+        if not ConfigClass.METADATA_CACHE_ENABLED:
+            return await fetch()
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._record(self.coalesced)
+            return json.loads(await asyncio.shield(inflight))
+
+        result = await self.lookup(key)
+        if result is not None:
+            return result
+
+        # check again since other caller may start the fetch while we
+        # were looking up the redis
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._record(self.coalesced)
+            return json.loads(await asyncio.shield(inflight))
+
+        inflight = asyncio.get_event_loop().create_future()
+        # retrieve the exception if no one else is waiting for it
+        inflight.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self._inflight[key] = inflight
+        try:
+            self._record(self.misses)
+            result = await fetch()
+            await self.store(key, result, container_code)
+            inflight.set_result(json.dumps(result))
+        except asyncio.CancelledError:
+            inflight.cancel()
+            raise
+        except Exception as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        return result
+
+    async def invalidate(self, item_id: Optional[str] = None, container_code: Optional[str] = None) -> None:
+        '''
+        Summary:
+            the function will remove the cached item and all the cached
+            counts of the container
+
+        Parameter:
+            - item_id(str): the id of changed item
+            - container_code(str): the container of changed item
+        '''
+
+        self.invalidations.inc()
+        keys = []
+        if item_id:
+            self._pop_local('item:' + item_id)
+            keys.append(self.prefix + 'item:' + item_id)
+        if container_code:
+            for key in self._container_keys.pop(container_code, set()):
+                self._pop_local(key)
+            container_key = self.prefix + 'container:' + container_code
+            try:
+                keys.extend(await self.redis.get_set_members(container_key))
+            except Exception as e:
+                _logger.error('Fail to read metadata cache: %s', str(e))
+            keys.append(container_key)
+        self.local_size.set(self._local_bytes)
+
+        try:
+            await self.redis.delete_by_keys(keys)
+        except Exception as e:
+            _logger.error('Fail to invalidate metadata cache: %s', str(e))
+
+    def clear(self) -> None:
+        '''
+        Summary:
+            the function will drop everything cached in process
+        '''
+
+        self._local.clear()
+        self._container_keys.clear()
+        self._local_bytes = 0
+        self.local_size.set(0)
+
+
+class MetadataCacheInvalidator:
+    """Consume the item activities from kafka and invalidate the metadata cache.
+
+    Every process consumes all the events without consumer group since each of them has its own in
+    process cache.
+    """
+
+    schema_path = 'app/commons'
+
+    def __init__(self, cache: MetadataCache) -> None:
+        self.cache = cache
+        self.consumer = None
+        self.task = None
+        self.schema = None
+
+    async def start(self) -> None:
+        '''
+        Summary:
+            the function will connect to kafka and start to consume
+            the item activities in background
+        '''
+
+        if self.consumer is not None:
+            return
+
+        self.consumer = AIOKafkaConsumer(
+            ConfigClass.KAFKA_ITEM_ACTIVITY_TOPIC,
+            bootstrap_servers=ConfigClass.KAFKA_URL,
+            group_id=None,
+            auto_offset_reset='latest',
+        )
+        try:
+            await self.consumer.start()
+        except Exception as e:
+            # without the invalidation the cache is only refreshed by ttl
+            _logger.error('Fail to start metadata cache invalidator:%s' % (str(e)))
+            self.consumer = None
+            return
+
+        self.task = asyncio.ensure_future(self._consume())
+
+    async def stop(self) -> None:
+        '''
+        Summary:
+            the function will stop consuming and close the kafka connection
+        '''
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.consumer is not None:
+            await self.consumer.stop()
+            self.consumer = None
+
+    async def handle_message(self, value: bytes) -> None:
+        '''
+        Summary:
+            the function will decode the item activity and invalidate the
+            changed item. The download activity is skipped since it does
+            not change anything.
+
+        Parameter:
+            - value(bytes): the avro encoded item activity
+        '''
+
+        if self.schema is None:
+            self.schema = parse_schema(schema.load_schema(os.path.join(self.schema_path, ITEM_MESSAGE_SCHEMA)))
+
+        activity = schemaless_reader(io.BytesIO(value), self.schema)
+        if activity.get('activity_type') == 'download':
+            return
+
+        item_id = activity.get('item_id')
+        await self.cache.invalidate(str(item_id) if item_id else None, activity.get('container_code'))
+
+    async def _consume(self) -> None:
+        async for message in self.consumer:
+            try:
+                await self.handle_message(message.value)
+            except Exception as e:
+                _logger.error('Fail to handle item activity:%s' % (str(e)))
+
+
+metadata_cache = MetadataCache()
+metadata_cache_invalidator = MetadataCacheInvalidator(metadata_cache)
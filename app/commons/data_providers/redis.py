@@ -14,41 +14,160 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from aioredis import StrictRedis
 from common import LoggerFactory
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.cluster import RedisCluster
 
 from app.config import ConfigClass
 
 _logger = LoggerFactory('SrvRedisSingleton').get_logger()
 
 
+def hash_tag(value: str) -> str:
+    '''
+    Summary:
+        the function will wrap the value as redis cluster hash tag. The keys
+        with same hash tag are saved in same slot, so they can be used
+        together in one multi-key command or transaction
+
+    Parameter:
+        - value(str): the value shared by the keys
+
+    Return:
+        - str: the hash tag
+    '''
+
+    return f'{{{value}}}'
+
+
+def get_connection_kwargs() -> dict:
+    '''
+    Summary:
+        the function will return the address and credentials shared by the
+        connections of standalone redis, redis cluster and subscription
+
+    Return:
+        - dict: the keyword arguments of redis connection
+    '''
+
+    return {
+        'host': ConfigClass.REDIS_HOST,
+        'port': ConfigClass.REDIS_PORT,
+        'username': ConfigClass.REDIS_USER,
+        'password': ConfigClass.REDIS_PASSWORD,
+    }
+
+
+def create_redis():
+    '''
+    Summary:
+        the function will create the redis client. If REDIS_CLUSTER is set,
+        the client connects to redis cluster by the node of REDIS_HOST and
+        REDIS_PORT and finds the other nodes by itself
+
+    Return:
+        - Redis|RedisCluster: the redis client
+    '''
+
+    if not ConfigClass.REDIS_CLUSTER:
+        # the pool is sized explicitly. once all connections are in use, the
+        # caller waits for a free one instead of opening more connections
+        return Redis(
+            connection_pool=BlockingConnectionPool(
+                db=ConfigClass.REDIS_DB,
+                max_connections=ConfigClass.REDIS_MAX_CONNECTIONS,
+                timeout=ConfigClass.REDIS_POOL_TIMEOUT,
+                **get_connection_kwargs(),
+            )
+        )
+
+    cluster = RedisCluster(max_connections=ConfigClass.REDIS_MAX_CONNECTIONS, **get_connection_kwargs())
+    # PUBLISH has no key and the message is broadcast to all nodes, so
+    # it can be sent to any node. DBSIZE is summed over all primaries
+    cluster.command_flags['PUBLISH'] = RedisCluster.DEFAULT_NODE
+    cluster.command_flags['DBSIZE'] = RedisCluster.PRIMARIES
+    return cluster
+
+
 class SrvRedisSingleton:
 
     __instance = {}
 
-    REDIS = StrictRedis(
-        host=ConfigClass.REDIS_HOST,
-        port=ConfigClass.REDIS_PORT,
-        db=ConfigClass.REDIS_DB,
-        password=ConfigClass.REDIS_PASSWORD,
-    )
+    REDIS = create_redis()
 
-    async def set_by_key(self, key: str, content: str):
-        await self.REDIS.set(key, content)
-        _logger.debug('redis set by key: ' + key + ':  ' + content)
+    async def set_by_key(self, key: str, content: str, expire: int = None):
+        await self.REDIS.set(key, content, ex=expire)
+        _logger.debug('redis set by key: %s:  %s', key, content)
 
-    async def mget_by_prefix(self, prefix: str):
-        _logger.debug(prefix)
-        query = '{}:*'.format(prefix)
-        keys = await self.REDIS.keys(query)
+    async def get_by_key(self, key: str):
+        return await self.REDIS.get(key)
+
+    async def delete_by_keys(self, keys: list):
+        if keys:
+            await self.REDIS.delete(*keys)
+
+    async def set_many(self, mapping: dict, expire: int = None):
+        # one pipeline of SET instead of MSET, so each key has its own
+        # expiry and the keys may be in different slots of redis cluster
+        async with self.REDIS.pipeline(transaction=False) as pipe:
+            for key, content in mapping.items():
+                pipe.set(key, content, ex=expire)
+            await pipe.execute()
+
+    async def add_to_set(self, key: str, members: list, expire: int = None):
+        async with self.REDIS.pipeline(transaction=False) as pipe:
+            pipe.sadd(key, *members)
+            if expire:
+                pipe.expire(key, expire)
+            await pipe.execute()
+
+    async def get_set_members(self, key: str):
+        return await self.REDIS.smembers(key)
+
+    async def mget_by_keys(self, keys: list) -> list:
+        # the keys may be in different slots of redis cluster
+        if isinstance(self.REDIS, RedisCluster):
+            return await self.REDIS.mget_nonatomic(keys)
         return await self.REDIS.mget(keys)
 
-    async def mdelete_by_prefix(self, prefix: str):
+    async def unlink_by_keys(self, keys: list, chunk_size: int = 1000):
+        async with self.REDIS.pipeline(transaction=False) as pipe:
+            # one command of cluster pipeline only has the keys of one slot
+            if isinstance(self.REDIS, RedisCluster):
+                for key in keys:
+                    pipe.unlink(key)
+            else:
+                for start in range(0, len(keys), chunk_size):
+                    end = start + chunk_size
+                    pipe.unlink(*keys[start:end])
+            await pipe.execute()
+
+    async def mdelete_by_prefix(self, prefix: str, chunk_size: int = 1000) -> int:
         _logger.debug(prefix)
         query = '{}:*'.format(prefix)
-        keys = await self.REDIS.keys(query)
-        for key in keys:
-            await self.REDIS.delete(key)
+        deleted = 0
+        keys = []
+        async for key in self.REDIS.scan_iter(match=query, count=chunk_size):
+            keys.append(key)
+            if len(keys) >= chunk_size * 10:
+                await self.unlink_by_keys(keys, chunk_size)
+                deleted += len(keys)
+                keys = []
+        if keys:
+            await self.unlink_by_keys(keys, chunk_size)
+            deleted += len(keys)
+
+        return deleted
+
+    async def get_keyspace_size(self) -> int:
+        return await self.REDIS.dbsize()
+
+    def pubsub(self):
+        # redis cluster broadcasts the published messages to all nodes, so
+        # the subscription can be made on the configured node
+        if isinstance(self.REDIS, RedisCluster):
+            return Redis(**get_connection_kwargs()).pubsub()
+        return self.REDIS.pubsub()
 
     async def ping(self):
         return await self.REDIS.ping()
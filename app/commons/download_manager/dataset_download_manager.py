@@ -23,7 +23,8 @@ import httpx
 from common.object_storage_adaptor.boto3_client import Boto3Client
 
 from app.commons.download_manager.file_download_manager import FileDownloadClient
-from app.commons.kafka_producer import get_kafka_producer
+from app.commons.download_manager.manifest import ManifestEntry
+from app.commons.kafka_producer import kakfa_producer
 from app.config import ConfigClass
 from app.models.models_data_download import EDataDownloadStatus
 from app.resources.download_token_manager import generate_token
@@ -68,9 +69,13 @@ async def create_dataset_download_client(
         session_id=session_id,
     )
 
-    await download_client.add_files_to_list(container_code)
-    # use the private domain for dataset download
-    await download_client._set_connection(boto3_clients.get('boto3_internal'))
+    try:
+        await download_client.add_files_to_list(container_code)
+        # use the private domain for dataset download
+        await download_client._set_connection(boto3_clients.get('boto3_internal'))
+    except Exception:
+        await download_client.close()
+        raise
 
     return download_client
 
@@ -104,6 +109,22 @@ class DatasetDownloadClient(FileDownloadClient):
 
         return
 
+    def _is_immutable(self, node: ManifestEntry) -> bool:
+        '''
+        Summary:
+            The dataset files are listed from core zone and published
+            files will not be changed, so the download does not need
+            the read locks from dataops
+
+        Parameter:
+            - node(ManifestEntry): the file in files_to_zip
+
+        Return:
+            - bool: if the file can be downloaded without lock
+        '''
+
+        return ConfigClass.LOCK_SKIP_DATASET_FILES and node.zone == 1
+
     async def add_schemas(self, dataset_geid: str) -> None:
         '''
         Summary:
@@ -177,8 +198,6 @@ class DatasetDownloadClient(FileDownloadClient):
             - dict: http reponse
         '''
 
-        kp = await get_kafka_producer()
-
         message = {
             'activity_type': 'download',
             'activity_time': datetime.utcnow(),
@@ -191,7 +210,7 @@ class DatasetDownloadClient(FileDownloadClient):
             'changes': [],
         }
 
-        await kp.create_activity_log(
+        await kakfa_producer.create_activity_log(
             message,
             DATASET_MESSAGE_SCHEMA,
             ConfigClass.KAFKA_DATASET_ACTIVITY_TOPIC,
@@ -213,17 +232,17 @@ class DatasetDownloadClient(FileDownloadClient):
             - None
         '''
 
-        folder_tree = await get_files_folder_recursive(
+        folder_tree = get_files_folder_recursive(
             dataset_code,
             'dataset',
             self.operator,
             zone=1,
         )
         # only take the file for downloading
-        for x in folder_tree:
-            # flatten the storage url
-            x.update({'location': x.get('storage', {}).get('location_uri')})
-            self.files_to_zip.append(x)
+        async for x in folder_tree:
+            await self.files_to_zip.add(ManifestEntry.from_item(x))
+
+        self.total_files = len(self.files_to_zip)
 
     async def background_worker(self, hash_code: str) -> None:
         '''
@@ -14,25 +14,37 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import os
 import shutil
 import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
 
 from common import LoggerFactory
 from common.object_storage_adaptor.boto3_client import Boto3Client
 from starlette.concurrency import run_in_threadpool
 
-from app.commons.kafka_producer import get_kafka_producer
-from app.commons.locks import bulk_lock_operation
+from app.commons.download_manager.manifest import (
+    DownloadManifest,
+    ManifestEntry,
+    PathTrie,
+    get_folder_key,
+    get_folder_path,
+    is_under_folders,
+    remove_nested_selections,
+)
+from app.commons.kafka_producer import kakfa_producer
+from app.commons.locks import read_lock_manager
 from app.config import ConfigClass
 from app.models.base_models import EAPIResponseCode
 from app.models.models_data_download import EDataDownloadStatus
 from app.resources.download_token_manager import generate_token
 from app.resources.error_handler import APIException
 from app.resources.helpers import (
-    get_files_folder_by_id,
+    get_files_folder_by_ids,
+    get_files_folder_count,
     get_files_folder_recursive,
     set_status,
 )
@@ -53,10 +65,12 @@ async def create_file_download_client(
     Summary:
         The function will create the FileDownloadClient object asynchronously.
         also it will call the FileDownloadClient.add_files_to_list to prepare
-        the info for downloading.
+        the info for downloading. The selected folders are NOT listed here,
+        they will be listed by background job while the files are downloading.
 
         If there is no file to be added (some empty forlder). The function will
-        raise error.
+        raise error. To check it, only the first file of selected folders will
+        be fetched when no file is selected directly.
 
     Parameter:
         - files(list): the list of file will be added into object
@@ -82,18 +96,23 @@ async def create_file_download_client(
         file_geids_to_include=file_geids_to_include,
     )
 
-    # add files into the list. It will check if we try to
-    # download the empty project folder
-    for file in files:
-        await download_client.add_files_to_list(file['id'])
+    try:
+        # add files into the list. It will check if we try to
+        # download the empty project folder
+        await download_client.add_files_to_list([file['id'] for file in files])
+        if len(download_client.files_to_zip) < 1:
+            await download_client._prefetch_folder_file()
 
-    # set the boto3 client between public and private domain
-    await download_client._set_connection(boto3_clients)
+        # set the boto3 client between public and private domain
+        await download_client._set_connection(boto3_clients)
 
-    if len(download_client.files_to_zip) < 1 and container_type == 'project':
-        error_msg = '[Invalid file amount] must greater than 0'
-        download_client.logger.error(error_msg)
-        raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=error_msg)
+        if len(download_client.files_to_zip) < 1 and container_type == 'project':
+            error_msg = '[Invalid file amount] must greater than 0'
+            download_client.logger.error(error_msg)
+            raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=error_msg)
+    except Exception:
+        await download_client.close()
+        raise
 
     return download_client
 
@@ -108,12 +127,13 @@ class FileDownloadClient:
         session_id: str,
         file_geids_to_include: Optional[Set[str]] = None,
     ):
-        self.job_id = 'data-download-' + str(int(time.time()))
+        # the jobs of same session created in same second are kept apart
+        self.job_id = 'data-download-' + str(int(time.time())) + '-' + uuid4().hex
         self.job_status = EDataDownloadStatus.INIT
-        self.files_to_zip = []
         self.operator = operator
         self.container_code = container_code
         self.tmp_folder = ConfigClass.MINIO_TMP_PATH + container_type + container_code + '_' + str(time.time())
+        self.files_to_zip = DownloadManifest(spill_path=self.tmp_folder + '.manifest')
         self.result_file_name = ''
         # self.auth_token = auth_token
         self.session_id = session_id
@@ -125,6 +145,21 @@ class FileDownloadClient:
         # stream back the zip file
         self.folder_download = False
 
+        # the selected folders will be listed in background job and the
+        # listed files are streamed into transfer stage. The total number
+        # of files is unknown until the listing finishes
+        self.folders_to_list = []
+        self.folder_files = None
+        self.total_files = None
+        # the read locks currently held. Each lock is released once its
+        # file is downloaded, so only the files in flight are locked
+        self.locked_keys = set()
+        self.released_keys = []
+        self.release_task = None
+        # the folders locked as a whole. The files under them are not
+        # locked one by one
+        self.locked_folders = None
+
         # if number of file is 1 without any folder, the boto3_client
         # will use the instance with private domain. Otherwise, it will
         # use the public domain
@@ -185,8 +220,10 @@ class FileDownloadClient:
             - dict: detail job info
         '''
         if len(self.files_to_zip) > 0:
-            download_file = self.files_to_zip[0]
-            payload.update({'zone': download_file.get('zone')})
+            download_file = await self.files_to_zip.get(0)
+            payload.update({'zone': download_file.zone})
+        if self.total_files is not None:
+            payload.update({'total': self.total_files})
 
         return await set_status(
             self.session_id,
@@ -199,60 +236,241 @@ class FileDownloadClient:
             payload=payload,
         )
 
-    async def add_files_to_list(self, _id: str) -> None:
+    async def add_files_to_list(self, ids: List[str]) -> None:
         '''
         Summary:
-            The function will add the file/folder with input _id into list.
-            if input _id points to a folder then it will call the metadata
-            api to get ALL files under it and its subfolders
+            The function will add the files/folders with input ids into list.
+            The ids are resolved by batch. if id points to a folder then it
+            will be added into the folders_to_list. ALL files under it and
+            its subfolders will be listed by background job. The selections
+            under another selected folder are skipped so the subtree will
+            not be listed twice
 
         Parameter:
-            - _id(str): the uuid of file/folder
+            - ids(list): the uuid of files/folders
 
         Return:
             - None
         '''
-        ff_object = await get_files_folder_by_id(_id)
+        ff_objects = await get_files_folder_by_ids(ids)
 
-        file_list = []
-        if 'folder' == ff_object.get('type'):
-            self.logger.info(f'Getting folder from geid: {_id}')
+        for ff_object in remove_nested_selections(ff_objects):
+            if 'folder' == ff_object.get('type'):
+                self.logger.info(f'Getting folder from geid: {ff_object.get("id")}')
 
-            # raise the flag to True and later the zip_work will pack
-            # the file(s) anyway
-            self.folder_download = True
+                # raise the flag to True and later the zip_work will pack
+                # the file(s) anyway
+                self.folder_download = True
+                self.folders_to_list.append(ff_object)
 
-            # conner case: some of first level folder dont have any parent path(None)
-            if ff_object.get('parent_path'):
-                parent_path = ff_object.get('parent_path') + '.' + ff_object.get('name')
             else:
-                parent_path = ff_object.get('name')
-
-            folder_tree = await get_files_folder_recursive(
-                self.container_code,
-                self.container_type,
-                ff_object.get('owner'),
-                zone=ff_object.get('zone'),
-                parent_path=parent_path,
-            )
+                file = self._prepare_file(ff_object)
+                if file is not None:
+                    await self.files_to_zip.add(file)
 
-            # only take the file for downloading
-            file_list = folder_tree
+        # for approval panel, the approved files can be fetched directly
+        # instead of listing the whole folders
+        if self.folders_to_list and self.file_geids_to_include is not None:
+            if await self._should_fetch_included_files():
+                await self._add_included_files()
+                self.folders_to_list = []
 
-        else:
-            file_list = [ff_object]
+        # if there is no folder, we already know how many files in the job
+        if not self.folders_to_list:
+            self.total_files = len(self.files_to_zip)
+
+        return None
+
+    async def _should_fetch_included_files(self) -> bool:
+        '''
+        Summary:
+            The function will decide how to resolve the folders when download
+            from approval panel. The number of files under folders_to_list is
+            estimated by the search api. If it is APPROVAL_DIRECT_FETCH_RATIO
+            times more than the approved files, the approved files will be
+            fetched by ids. Otherwise the folders will be listed.
+
+        Return:
+            - bool: True if the approved files should be fetched by ids
+        '''
+
+        included = len(self.file_geids_to_include)
+        if included == 0:
+            return True
+
+        semaphore = asyncio.Semaphore(ConfigClass.METADATA_CONCURRENCY)
+
+        async def _count(folder: dict) -> int:
+            async with semaphore:
+                return await get_files_folder_count(
+                    self.container_code,
+                    self.container_type,
+                    folder.get('owner'),
+                    zone=folder.get('zone'),
+                    parent_path=get_folder_path(folder),
+                )
+
+        estimated = sum(await asyncio.gather(*[_count(folder) for folder in self.folders_to_list]))
+        direct_fetch = estimated >= included * ConfigClass.APPROVAL_DIRECT_FETCH_RATIO
+        self.logger.info(
+            f'Approved files: {included}, estimated files in folders: {estimated}, fetch by ids: {direct_fetch}'
+        )
+
+        return direct_fetch
+
+    async def _add_included_files(self) -> None:
+        '''
+        Summary:
+            The function will fetch the approved files by ids in batch and
+            add the ones under folders_to_list into files_to_zip. The files
+            not found or archived are skipped as the folder listing does
+
+        Return:
+            - None
+        '''
+
+        folder_keys = {get_folder_key(folder) for folder in self.folders_to_list}
+        items = await get_files_folder_by_ids(sorted(self.file_geids_to_include), ignore_missing=True)
+        for item in items:
+            if item.get('type') != 'file' or item.get('archived'):
+                continue
+            if not is_under_folders(item, folder_keys):
+                continue
+
+            await self.files_to_zip.add(ManifestEntry.from_item(item))
+
+        return None
+
+    def _prepare_file(self, file: dict) -> Optional[ManifestEntry]:
+        '''
+        Summary:
+            The function will convert the file object from metadata into
+            compact manifest entry. If the download is from approval panel,
+            the file not included by the approval will be skipped
+
+        Parameter:
+            - file(dict): the file object from metadata service
+
+        Return:
+            - ManifestEntry: the file to download. None if file is not included
+        '''
 
         # this is to download from approval panel
-        if self.file_geids_to_include is not None:
-            file_list = [file for file in file_list if file['id'] in self.file_geids_to_include]
+        if self.file_geids_to_include is not None and file['id'] not in self.file_geids_to_include:
+            return None
+
+        return ManifestEntry.from_item(file)
 
-        for file in file_list:
-            # flatten the storage url
-            file.update({'location': file.get('storage', {}).get('location_uri')})
-            # also make the parent path None to empty string
-            if file.get('parent_path') is None:
-                file.update({'parent_path': ''})
-            self.files_to_zip.append(file)
+    async def _list_folder(self, folder: dict) -> AsyncIterator[ManifestEntry]:
+        '''
+        Summary:
+            The function will list the files under the folder page by page
+            and yield the ones should be downloaded
+
+        Parameter:
+            - folder(dict): the folder object from metadata service
+
+        Return:
+            - async iterator: the manifest entry
+        '''
+
+        folder_tree = get_files_folder_recursive(
+            self.container_code,
+            self.container_type,
+            folder.get('owner'),
+            zone=folder.get('zone'),
+            parent_path=get_folder_path(folder),
+        )
+        async for file in folder_tree:
+            file = self._prepare_file(file)
+            if file is not None:
+                yield file
+
+    async def _iter_folder_files(self) -> AsyncIterator[ManifestEntry]:
+        '''
+        Summary:
+            The function will list all the folders_to_list in parallel with
+            bounded concurrency and yield the listed files as they come
+
+        Return:
+            - async iterator: the manifest entry
+        '''
+
+        if len(self.folders_to_list) == 1:
+            async for file in self._list_folder(self.folders_to_list[0]):
+                yield file
+            return
+
+        listed_files = asyncio.Queue(maxsize=ConfigClass.DOWNLOAD_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(ConfigClass.METADATA_CONCURRENCY)
+
+        async def _list_worker(folder: dict) -> None:
+            try:
+                async with semaphore:
+                    async for file in self._list_folder(folder):
+                        await listed_files.put(file)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await listed_files.put(e)
+                return
+            # None indicates one of folder is finished
+            await listed_files.put(None)
+
+        workers = [asyncio.ensure_future(_list_worker(folder)) for folder in self.folders_to_list]
+        try:
+            remaining = len(workers)
+            while remaining > 0:
+                file = await listed_files.get()
+                if file is None:
+                    remaining -= 1
+                elif isinstance(file, Exception):
+                    raise file
+                else:
+                    yield file
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _prefetch_folder_file(self) -> None:
+        '''
+        Summary:
+            The function will start listing the folders_to_list and add
+            the first file into files_to_zip. The rest of listing will be
+            continued by background job. This is to check if we try to
+            download the empty folder(s)
+
+        Return:
+            - None
+        '''
+
+        if not self.folders_to_list:
+            return None
+
+        self.folder_files = self._iter_folder_files()
+        try:
+            file = await self.folder_files.__anext__()
+            await self.files_to_zip.add(file)
+        except StopAsyncIteration:
+            self.total_files = 0
+
+        return None
+
+    async def close(self) -> None:
+        '''
+        Summary:
+            The function will stop the folder listing started by
+            _prefetch_folder_file and remove the spilled manifest. It is
+            called when the job fails before the background job starts
+
+        Return:
+            - None
+        '''
+
+        if self.folder_files is not None:
+            await self.folder_files.aclose()
+            self.folder_files = None
+        await self.files_to_zip.close()
 
         return None
 
@@ -272,7 +490,8 @@ class FileDownloadClient:
         else:
             # Note here if minio can be public assessible then the endpoint
             # must be domain name
-            bucket, file_path = await self._parse_object_location(self.files_to_zip[0].get('location'))
+            first_file = await self.files_to_zip.get(0)
+            bucket, file_path = await self._parse_object_location(first_file.location)
             self.result_file_name = await self.boto3_client.get_download_presigned_url(bucket, file_path)
 
         # since the file or files are from some zone/project
@@ -285,55 +504,305 @@ class FileDownloadClient:
             self.job_id,
         )
 
-    async def _file_download_worker(self, hash_code: str) -> None:
+    def _get_bucket(self, container_code: str) -> str:
+        # for project we have the bucket prefix
+        # but for dataset we dont have it
+        if self.container_type == 'project':
+            bucket_prefix = 'gr-' if ConfigClass.namespace == 'greenroom' else 'core-'
+            return bucket_prefix + container_code
+
+        return container_code
+
+    def _get_lock_key(self, node: ManifestEntry) -> str:
         '''
         Summary:
-            The function will download all the file that has been added
-            into the list to tmp folder. Before downloading the file, the
-            function will lock ALL of them. After downloading, it will
-            set the job status to finish.
+            The function will generate the lock key of the file
+
+        Parameter:
+            - node(ManifestEntry): the file in files_to_zip
+
+        Return:
+            - str: the lock key formatting as <bucket>/<parent_path>/<name>
+        '''
+
+        return '%s/%s/%s' % (self._get_bucket(node.container_code), node.parent_path, node.name)
+
+    def _is_immutable(self, node: ManifestEntry) -> bool:
+        '''
+        Summary:
+            The function is the lock policy of download. The immutable
+            file will not be changed while downloading, so it is not
+            locked. The project files are always mutable
 
         Parameter:
+            - node(ManifestEntry): the file in files_to_zip
+
+        Return:
+            - bool: if the file can be downloaded without lock
+        '''
+
+        return False
+
+    def _is_folder_locked(self, node: ManifestEntry) -> bool:
+        if self.locked_folders is None:
+            return False
+
+        parts = [self._get_bucket(node.container_code)] + node.parent_path.split('.')
+        return self.locked_folders.covers(parts)
+
+    async def _lock_folders(self) -> None:
+        '''
+        Summary:
+            The function will lock the selected folders as a whole if the
+            lock service supports folder locks. The folders are reduced to
+            the minimal set of covering prefixes, and each one is locked by
+            the key formatting as <bucket>/<folder_path>
+
+        Return:
+            - None
+        '''
+
+        if not ConfigClass.LOCK_FOLDER_PREFIX or not self.folders_to_list:
+            return None
+
+        locked_folders = PathTrie()
+        for folder in self.folders_to_list:
+            locked_folders.add([self._get_bucket(folder.get('container_code'))] + get_folder_path(folder).split('.'))
+
+        prefixes = locked_folders.get_prefixes()
+        self.logger.info(f'Lock {len(prefixes)} folders as a whole')
+        await self._lock_files([parts[0] + '/' + '.'.join(parts[1:]) for parts in prefixes])
+        self.locked_folders = locked_folders
+
+        return None
+
+    async def _list_worker(self, queue: asyncio.Queue, hash_code: str) -> None:
+        '''
+        Summary:
+            The function is the first stage of download pipeline. It will put
+            the files already in files_to_zip into the queue, then list the
+            folders_to_list and put the listed files into queue. A None will
+            be put at the end to indicate the listing is finished.
+
+            Once the listing finishes, the total number of files will be
+            updated into job status.
+
+        Parameter:
+            - queue(asyncio.Queue): the bounded queue to transfer stage
             - hash_code(str): the hashcode
 
         Return:
             - None
         '''
 
-        lock_keys = []
         try:
-            # add the file lock
-            bucket_prefix = 'gr-' if ConfigClass.namespace == 'greenroom' else 'core-'
-            for nodes in self.files_to_zip:
-                # for project we have the bucket prefix
-                # but for dataset we dont have it
-                if self.container_type == 'project':
-                    bucket = bucket_prefix + nodes.get('container_code')
-                else:
-                    bucket = nodes.get('container_code')
-                lock_keys.append('%s/%s/%s' % (bucket, nodes.get('parent_path'), nodes.get('name')))
-            await bulk_lock_operation(lock_keys, 'read')
+            async for file in self.files_to_zip:
+                await queue.put(file)
+
+            if self.folders_to_list and self.total_files is None:
+                if self.folder_files is None:
+                    self.folder_files = self._iter_folder_files()
+                async for file in self.folder_files:
+                    # the duplicated file is downloaded only once
+                    if await self.files_to_zip.add(file):
+                        await queue.put(file)
+
+                self.total_files = len(self.files_to_zip)
+                self.logger.info(f'Finish listing folders, total files: {self.total_files}')
+                await self.set_status(EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # wake up the transfer stage. The error will be raised when
+            # the download worker awaits this stage
+            await queue.put(None)
+            raise
+
+        await queue.put(None)
+
+        return None
+
+    async def _transfer_worker(self, queue: asyncio.Queue) -> None:
+        '''
+        Summary:
+            The function is the second stage of download pipeline. It will
+            take the files from queue in batch, lock them and download them
+            into tmp folder until it receives None.
+
+        Parameter:
+            - queue(asyncio.Queue): the bounded queue from listing stage
+
+        Return:
+            - None
+        '''
+
+        finished = False
+        while not finished:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < ConfigClass.DOWNLOAD_QUEUE_SIZE:
+                batch.append(queue.get_nowait())
+            # the None from listing stage will always be the last one
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if not batch:
+                continue
+
+            # the file under locked folder or immutable file does not
+            # need its own lock
+            lock_keys = [
+                None if self._is_folder_locked(node) or self._is_immutable(node) else self._get_lock_key(node)
+                for node in batch
+            ]
+            await self._lock_files([lock_key for lock_key in lock_keys if lock_key])
 
             # then download from object storage
-            for obj in self.files_to_zip:
-                bucket, obj_path = await self._parse_object_location(obj.get('location'))
+            for obj, lock_key in zip(batch, lock_keys):
+                bucket, obj_path = await self._parse_object_location(obj.location)
                 await self.boto3_client.downlaod_object(bucket, obj_path, self.tmp_folder + '/' + obj_path)
+                # the file is already in tmp folder so it can be unlocked
+                if lock_key:
+                    self._release_file(lock_key)
+
+        return None
+
+    async def _lock_files(self, lock_keys: List[str]) -> None:
+        '''
+        Summary:
+            The function will read lock the files. The locks are shared
+            with other jobs in process and sent to lock service by chunks
+            of LOCK_CHUNK_SIZE concurrently
+
+        Parameter:
+            - lock_keys(list): the lock keys of files
+
+        Return:
+            - None
+        '''
+
+        await read_lock_manager.lock(lock_keys)
+        self.locked_keys.update(lock_keys)
+
+        return None
+
+    def _release_file(self, lock_key: str) -> None:
+        '''
+        Summary:
+            The function will unlock the file in background. The files
+            released while an unlock request is running are unlocked
+            together in the next request
+
+        Parameter:
+            - lock_key(str): the lock key of downloaded file
+
+        Return:
+            - None
+        '''
+
+        self.locked_keys.discard(lock_key)
+        self.released_keys.append(lock_key)
+        if self.release_task is None:
+            self.release_task = asyncio.ensure_future(self._release_worker())
+
+        return None
+
+    async def _release_worker(self) -> None:
+        try:
+            while self.released_keys:
+                lock_keys, self.released_keys = self.released_keys, []
+                await read_lock_manager.unlock(lock_keys)
+        finally:
+            self.release_task = None
+
+    async def _unlock_files(self) -> None:
+        '''
+        Summary:
+            The function will wait for the background unlock and then
+            unlock the files still locked
+
+        Return:
+            - None
+        '''
+
+        if self.release_task is not None:
+            await self.release_task
+
+        lock_keys = sorted(self.locked_keys)
+        self.locked_keys = set()
+        await read_lock_manager.unlock(lock_keys)
+
+        return None
+
+    async def _file_download_worker(self, hash_code: str) -> None:
+        '''
+        Summary:
+            The function will download all the file that has been added
+            into the list to tmp folder. The selected folders are listed
+            at the same time and the listed files will be streamed into
+            the download through a bounded queue. Before downloading the
+            file, the function will lock them unless the lock policy marks
+            them immutable, and each file is unlocked once it is downloaded.
+            After downloading, it will set the job status to finish.
+
+        Parameter:
+            - hash_code(str): the hashcode
+
+        Return:
+            - None
+        '''
+
+        queue = asyncio.Queue(maxsize=ConfigClass.DOWNLOAD_QUEUE_SIZE)
+        list_worker = asyncio.ensure_future(self._list_worker(queue, hash_code))
+        try:
+            await self._lock_folders()
+            await self._transfer_worker(queue)
+            await list_worker
 
         except Exception as e:
             self.logger.error(
                 'Error in background job: ' + (str(e)),
             )
+            # stop the listing stage first, so its status update will not
+            # overwrite the cancelled status
+            await self._stop_list_worker(list_worker)
             payload = {'error_msg': str(e)}
             await self.set_status(EDataDownloadStatus.CANCELLED, payload=payload)
             raise Exception(str(e))
         finally:
-            self.logger.info('Start to unlock the nodes')
-            await bulk_lock_operation(lock_keys, 'read', lock=False)
+            list_worker.cancel()
+            if self.locked_keys or self.release_task is not None:
+                self.logger.info('Start to unlock the nodes')
+                await self._unlock_files()
+            await self.files_to_zip.close()
 
         self.logger.info('BACKGROUND TASK DONE')
 
         return None
 
+    async def _stop_list_worker(self, list_worker: asyncio.Future) -> None:
+        '''
+        Summary:
+            The function will cancel the listing stage and wait until it
+            stops. The error of listing stage is retrieved and logged since
+            the error of the other stage is raised instead
+
+        Parameter:
+            - list_worker(asyncio.Future): the task of listing stage
+
+        Return:
+            - None
+        '''
+
+        list_worker.cancel()
+        try:
+            await list_worker
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.logger.error(f'Error in listing stage: {e}')
+
+        return None
+
     async def update_activity_log(self) -> dict:
         '''
         Summary:
@@ -344,30 +813,31 @@ class FileDownloadClient:
             - dict: http reponse
         '''
 
-        kp = await get_kafka_producer()
-
         # generate the some basic info for log. if multiple files are
         # downloaded, hide some infomation to aviod misleading
-        source_node = self.files_to_zip[0]
+        source_node = await self.files_to_zip.get(0)
+        item_id, item_name = source_node.id, source_node.name
         if len(self.files_to_zip) != 1:
-            source_node.update({'id': None, 'name': os.path.basename(self.result_file_name)})
+            item_id, item_name = None, os.path.basename(self.result_file_name)
 
         message = {
             'activity_type': 'download',
             'activity_time': datetime.utcnow(),
-            'item_id': source_node.get('id'),
-            'item_type': source_node.get('type'),
-            'item_name': source_node.get('name'),
-            'item_parent_path': source_node.get('parent_path'),
-            'container_code': source_node.get('container_code'),
-            'container_type': source_node.get('container_type'),
-            'zone': source_node.get('zone'),
+            'item_id': item_id,
+            'item_type': 'file',
+            'item_name': item_name,
+            'item_parent_path': source_node.parent_path,
+            'container_code': source_node.container_code,
+            'container_type': self.container_type,
+            'zone': source_node.zone,
             'user': self.operator,
             'imported_from': '',
             'changes': [],
         }
 
-        await kp.create_activity_log(
+        # the log is sent in background and the job does not wait
+        # for kafka
+        await kakfa_producer.create_activity_log(
             message,
             ITEM_MESSAGE_SCHEMA,
             ConfigClass.KAFKA_ITEM_ACTIVITY_TOPIC,
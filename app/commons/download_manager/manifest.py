@@ -0,0 +1,520 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, List, Optional, Set, Tuple
+
+from common import LoggerFactory
+
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+_logger = LoggerFactory('download_manifest').get_logger()
+
+_memory_usage = metrics.gauge('download_manifest_memory_bytes', 'Estimated memory of all manifests in process')
+_spilled = metrics.counter('download_manifest_spilled', 'Manifests spilled to disk')
+
+
+class ManifestEntry:
+    """Compact record of one file to download.
+
+    Only the fields used by the download job are kept from the metadata item. The repeated strings, such as
+    the location prefix, parent path and container code, are interned so the entries share them.
+    """
+
+    __slots__ = (
+        'id',
+        'name',
+        'parent_path',
+        'container_code',
+        'zone',
+        'size',
+        'version',
+        'location_prefix',
+        'location_name',
+    )
+
+    def __init__(
+        self,
+        _id: str,
+        name: str,
+        parent_path: str,
+        container_code: str,
+        zone: int,
+        location: str,
+        size: Optional[int] = None,
+        version: Optional[str] = None,
+    ) -> None:
+        self.id = _id
+        self.name = name
+        self.parent_path = sys.intern(parent_path or '')
+        self.container_code = sys.intern(container_code or '')
+        self.zone = zone
+        self.size = size
+        self.version = version
+
+        # most of object names are same as the item name
+        prefix, _, location_name = (location or '').rpartition('/')
+        self.location_prefix = sys.intern(prefix + '/')
+        self.location_name = None if location_name == name else location_name
+
+    @classmethod
+    def from_item(cls, item: dict) -> 'ManifestEntry':
+        '''
+        Summary:
+            the function will create the entry from file object returned
+            by metadata service
+
+        Parameter:
+            - item(dict): the file object from metadata service
+
+        Return:
+            - ManifestEntry
+        '''
+
+        storage = item.get('storage') or {}
+        return cls(
+            item.get('id'),
+            item.get('name'),
+            item.get('parent_path'),
+            item.get('container_code'),
+            item.get('zone'),
+            storage.get('location_uri'),
+            size=item.get('size'),
+            version=storage.get('version'),
+        )
+
+    @classmethod
+    def from_row(cls, row: tuple) -> 'ManifestEntry':
+        '''
+        Summary:
+            the function will create the entry from the row of spilled
+            manifest
+
+        Parameter:
+            - row(tuple): the columns in same order as ManifestEntry.to_row
+
+        Return:
+            - ManifestEntry
+        '''
+
+        _id, name, parent_path, container_code, zone, location, size, version = row
+        return cls(_id, name, parent_path, container_code, zone, location, size=size, version=version)
+
+    def to_row(self) -> tuple:
+        return (
+            self.id,
+            self.name,
+            self.parent_path,
+            self.container_code,
+            self.zone,
+            self.location,
+            self.size,
+            self.version,
+        )
+
+    def get_size(self) -> int:
+        '''
+        Summary:
+            the function will estimate the memory used by the entry. The
+            interned strings are shared with other entries so they are
+            not counted
+
+        Return:
+            - int: the number of bytes
+        '''
+
+        size = sys.getsizeof(self) + sys.getsizeof(self.id) + sys.getsizeof(self.name)
+        if self.location_name is not None:
+            size += sys.getsizeof(self.location_name)
+
+        return size
+
+    @property
+    def location(self) -> str:
+        return self.location_prefix + (self.name if self.location_name is None else self.location_name)
+
+    def _get_key(self) -> Tuple[str, str]:
+        return self.id, self.location
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ManifestEntry) and self._get_key() == other._get_key()
+
+    def __hash__(self) -> int:
+        return hash(self._get_key())
+
+
+class DownloadManifest:
+    """Keep the files to download in order and collapse the duplicates.
+
+    The file is identified by its id and location, so the same object listed from overlapping selections is
+    downloaded and locked only once. Once the manifest is larger than MANIFEST_SPILL_THRESHOLD entries or its
+    estimated memory is over MANIFEST_MEMORY_LIMIT, the entries are moved into sqlite file at spill_path and
+    read back in order by chunks. The sqlite file is only accessed by one worker thread, so the disk io does
+    not block the event loop. The first entry is always kept in memory for job status and activity log.
+    """
+
+    def __init__(self, spill_path: Optional[str] = None) -> None:
+        # the dict keeps the insertion order
+        self._entries = {}
+        self._first = None
+        self._count = 0
+        self.memory_usage = 0
+        self.spill_path = spill_path
+        self._db = None
+        self._executor = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def spilled(self) -> bool:
+        return self._db is not None
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def add(self, entry: ManifestEntry) -> bool:
+        '''
+        Summary:
+            the function will add the entry into manifest if it is not
+            in the manifest yet
+
+        Parameter:
+            - entry(ManifestEntry): the file to download
+
+        Return:
+            - bool: True if the entry is added
+        '''
+
+        async with self._lock:
+            if self._db is not None:
+                cursor = await self._run(
+                    self._db.execute,
+                    'INSERT OR IGNORE INTO entries '
+                    '(id, name, parent_path, container_code, zone, location, size, version) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    entry.to_row(),
+                )
+                if cursor.rowcount < 1:
+                    return False
+
+                self._count += 1
+                return True
+
+            if entry in self._entries:
+                return False
+
+            self._entries[entry] = None
+            if self._first is None:
+                self._first = entry
+            self._count += 1
+            self._update_memory_usage(entry.get_size())
+
+            if self.spill_path and (
+                self._count > ConfigClass.MANIFEST_SPILL_THRESHOLD
+                or self.memory_usage > ConfigClass.MANIFEST_MEMORY_LIMIT
+            ):
+                await self._spill()
+
+            return True
+
+    def _update_memory_usage(self, size: int) -> None:
+        self.memory_usage += size
+        _memory_usage.inc(size)
+
+    async def _spill(self) -> None:
+        '''
+        Summary:
+            the function will move the entries in memory into sqlite file.
+            The file is only used by current job so there is no journal
+            and no sync to disk
+        '''
+
+        _logger.info(
+            f'Spill manifest with {self._count} entries and {self.memory_usage} bytes in memory to {self.spill_path}'
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._db = await self._run(self._create_db, [entry.to_row() for entry in self._entries])
+        self._entries = {}
+        self._update_memory_usage(-self.memory_usage)
+        _spilled.inc()
+
+    def _create_db(self, rows: List[tuple]) -> sqlite3.Connection:
+        # the connection is only used in the worker thread of executor
+        db = sqlite3.connect(self.spill_path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        db.execute(
+            'CREATE TABLE entries ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, name TEXT, parent_path TEXT, container_code TEXT, '
+            'zone INTEGER, location TEXT, size INTEGER, version TEXT, UNIQUE (id, location))'
+        )
+        db.executemany(
+            'INSERT INTO entries (id, name, parent_path, container_code, zone, location, size, version) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+
+        return db
+
+    def _remove_db(self) -> None:
+        self._db.close()
+        os.remove(self.spill_path)
+
+    async def close(self) -> None:
+        '''
+        Summary:
+            the function will remove the spilled file of the manifest. The
+            entries on disk are not available after closing but the number
+            of entries and the first entry are kept. The memory of entries
+            left in memory is no longer accounted as the job is finished
+        '''
+
+        self._update_memory_usage(-self.memory_usage)
+        async with self._lock:
+            if self._db is not None:
+                await self._run(self._remove_db)
+                self._db = None
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    async def __aiter__(self) -> AsyncIterator[ManifestEntry]:
+        if self._db is None:
+            for entry in self._entries:
+                yield entry
+            return
+
+        cursor = await self._run(
+            self._db.execute,
+            'SELECT id, name, parent_path, container_code, zone, location, size, version FROM entries ORDER BY seq',
+        )
+        rows = await self._run(cursor.fetchmany, ConfigClass.DOWNLOAD_QUEUE_SIZE)
+        while rows:
+            for row in rows:
+                yield ManifestEntry.from_row(row)
+            rows = await self._run(cursor.fetchmany, ConfigClass.DOWNLOAD_QUEUE_SIZE)
+
+    async def get(self, index: int) -> ManifestEntry:
+        '''
+        Summary:
+            the function will return the entry at the index. The first
+            entry is read from memory
+
+        Parameter:
+            - index(int): the position of entry, negative from the end
+
+        Return:
+            - ManifestEntry
+        '''
+
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('manifest index out of range')
+
+        if index == 0:
+            return self._first
+
+        if self._db is not None:
+            cursor = await self._run(
+                self._db.execute,
+                'SELECT id, name, parent_path, container_code, zone, location, size, version FROM entries '
+                'ORDER BY seq LIMIT 1 OFFSET ?',
+                (index,),
+            )
+            return ManifestEntry.from_row(await self._run(cursor.fetchone))
+
+        for position, entry in enumerate(self._entries):
+            if position == index:
+                return entry
+
+
+class PathTrie:
+    """Reduce the paths into the minimal set of covering prefixes.
+
+    Each path is a sequence of parts such as bucket and folder names. A path under another inserted path is
+    dropped, so the remaining prefixes cover every inserted path exactly once.
+    """
+
+    # the node marks the end of an inserted path
+    _END = ''
+
+    def __init__(self) -> None:
+        self._root = {}
+
+    def add(self, parts: List[str]) -> None:
+        '''
+        Summary:
+            the function will add the path. If the path is under another
+            path, nothing is changed. If other paths are under the path,
+            they are dropped
+
+        Parameter:
+            - parts(list): the parts of path
+        '''
+
+        node = self._root
+        for part in parts:
+            if self._END in node:
+                return
+            node = node.setdefault(part, {})
+
+        node.clear()
+        node[self._END] = {}
+
+    def covers(self, parts: List[str]) -> bool:
+        '''
+        Summary:
+            the function will check if the path is same as or under one
+            of the added paths
+
+        Parameter:
+            - parts(list): the parts of path
+
+        Return:
+            - bool: True if the path is covered
+        '''
+
+        node = self._root
+        for part in parts:
+            if self._END in node:
+                return True
+            node = node.get(part)
+            if node is None:
+                return False
+
+        return self._END in node
+
+    def get_prefixes(self) -> List[List[str]]:
+        '''
+        Summary:
+            the function will return the minimal set of covering prefixes
+
+        Return:
+            - list: the parts of each prefix
+        '''
+
+        prefixes = []
+        stack = [(self._root, [])]
+        while stack:
+            node, parts = stack.pop()
+            if self._END in node:
+                prefixes.append(parts)
+                continue
+            for part, child in node.items():
+                stack.append((child, parts + [part]))
+
+        return sorted(prefixes)
+
+
+def get_folder_path(folder: dict) -> str:
+    '''
+    Summary:
+        the function will return the full path of folder which is used
+        as parent_path of the files under it
+
+    Parameter:
+        - folder(dict): the folder object from metadata service
+
+    Return:
+        - str: the folder path
+    '''
+
+    # conner case: some of first level folder dont have any parent path(None)
+    if folder.get('parent_path'):
+        return folder.get('parent_path') + '.' + folder.get('name')
+
+    return folder.get('name')
+
+
+def _get_scope(item: dict) -> Tuple[str, int, str]:
+    # the folder listing is filtered by container, zone and owner
+    return item.get('container_code'), item.get('zone'), item.get('owner')
+
+
+def get_folder_key(folder: dict) -> Tuple[str, int, str, str]:
+    '''
+    Summary:
+        the function will return the key of folder which identifies the
+        subtree listed by the folder
+
+    Parameter:
+        - folder(dict): the folder object from metadata service
+
+    Return:
+        - tuple: container_code, zone, owner and folder path
+    '''
+
+    return _get_scope(folder) + (get_folder_path(folder),)
+
+
+def is_under_folders(item: dict, folder_keys: Set[Tuple[str, int, str, str]]) -> bool:
+    '''
+    Summary:
+        the function will check if the file/folder is in the subtree of
+        any folder by checking every ancestor of the item
+
+    Parameter:
+        - item(dict): the file/folder object from metadata service
+        - folder_keys(set): the keys of folders from get_folder_key
+
+    Return:
+        - bool: True if item is under one of the folders
+    '''
+
+    parent_path = item.get('parent_path') or ''
+    ancestors = parent_path.split('.') if parent_path else []
+    for depth in range(1, len(ancestors) + 1):
+        if _get_scope(item) + ('.'.join(ancestors[:depth]),) in folder_keys:
+            return True
+
+    return False
+
+
+def remove_nested_selections(items: List[dict]) -> List[dict]:
+    '''
+    Summary:
+        the function will remove the selected file/folder which is under
+        another selected folder, and the repeated selections. Since the
+        folder will be listed recursively, the removed ones will still be
+        downloaded but the subtree will never be listed twice.
+
+    Parameter:
+        - items(list): the selected file/folder objects from metadata service
+
+    Return:
+        - list: the selections which are not covered by other folders
+    '''
+
+    selected_folders = {get_folder_key(item) for item in items if item.get('type') == 'folder'}
+
+    selections = []
+    selected_ids = set()
+    for item in items:
+        if item.get('id') in selected_ids:
+            continue
+        selected_ids.add(item.get('id'))
+
+        if not is_under_folders(item, selected_folders):
+            selections.append(item)
+
+    return selections
@@ -14,15 +14,58 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import io
 import os
+from typing import List, Tuple
 
 from aiokafka import AIOKafkaProducer
 from common import LoggerFactory
 from fastavro import schema, schemaless_writer
 
+from app.commons.metrics import metrics
 from app.config import ConfigClass
 
+_buffered = metrics.gauge('activity_log_buffered', 'Activity logs waiting in process to be sent to kafka')
+_dropped = metrics.counter('activity_log_dropped', 'Activity logs dropped since the buffer is full')
+_sent = metrics.counter('activity_log_sent', 'Activity logs sent to kafka')
+_failed = metrics.counter('activity_log_failed', 'Activity logs failed to be sent to kafka')
+
+
+class ActivityLogBufferFull(Exception):
+    pass
+
+
+class AvroSerializer:
+    """Serialize the messages of one avro schema.
+
+    The schema is parsed once and the buffer is reused by every message. The serialization does not await, so
+    the buffer is never shared by two messages at the same time.
+    """
+
+    def __init__(self, schema_file: str) -> None:
+        self.schema = schema.load_schema(schema_file)
+        self.buffer = io.BytesIO()
+
+    def serialize(self, message: dict) -> bytes:
+        '''
+        Summary:
+            the function will validate the dict message with the schema
+            and return the byte message
+
+        Parameter:
+            - message(dict): the message generated by service logic
+
+        Return:
+            - byte message
+        '''
+
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        schemaless_writer(self.buffer, self.schema, message)
+
+        return self.buffer.getvalue()
+
 
 class KakfaProducer:
 
@@ -30,6 +73,11 @@ class KakfaProducer:
     schema_path = 'app/commons'
     logger = LoggerFactory('KakfaProducer').get_logger()
     connected = False
+    # the serializers of schema files under schema_path
+    serializers = None
+    # the bounded buffer of (topic, byte message) and the task sending it
+    buffer = None
+    flush_task = None
 
     async def init_connection(self) -> None:
         '''
@@ -39,7 +87,11 @@ class KakfaProducer:
 
         if self.producer is None:
             self.logger.info('Initializing the kafka producer')
-            self.producer = AIOKafkaProducer(bootstrap_servers=ConfigClass.KAFKA_URL)
+            self.producer = AIOKafkaProducer(
+                bootstrap_servers=ConfigClass.KAFKA_URL,
+                compression_type=ConfigClass.KAFKA_COMPRESSION_TYPE,
+                linger_ms=ConfigClass.KAFKA_LINGER_MS,
+            )
             try:
                 # Get cluster layout and initial topic/partition leadership information
                 await self.producer.start()
@@ -53,27 +105,138 @@ class KakfaProducer:
         '''
         Summary:
             the function for producer to close the kafka connection.
+            The buffered activity logs are sent before closing within
+            ACTIVITY_LOG_DRAIN_TIMEOUT, the rest of them are dropped.
         '''
+
+        if self.flush_task is not None:
+            try:
+                await asyncio.wait_for(self.flush_task, ConfigClass.ACTIVITY_LOG_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.logger.error('Fail to send %d buffered activity logs before closing', self.buffer.qsize())
+                _dropped.inc(self.buffer.qsize())
+
         # Wait for all pending messages to be delivered or expire.
         if self.producer is not None:
             self.logger.info('Closing the kafka producer')
             await self.producer.stop()
 
-    async def _send_message(self, topic: str, content: bytes) -> None:
+    def load_schemas(self) -> None:
+        '''
+        Summary:
+            the function will parse all the avro schemas under schema_path
+            and prepare their serializers
+        '''
+
+        serializers = {}
+        for schema_name in sorted(os.listdir(self.schema_path)):
+            if schema_name.endswith('.avsc'):
+                serializers[schema_name] = AvroSerializer(os.path.join(self.schema_path, schema_name))
+
+        self.logger.info('Loaded %d avro schemas', len(serializers))
+        self.serializers = serializers
+
+    def _get_serializer(self, schema_name: str) -> AvroSerializer:
+        if self.serializers is None:
+            self.load_schemas()
+
+        serializer = self.serializers.get(schema_name)
+        if serializer is None:
+            serializer = AvroSerializer(os.path.join(self.schema_path, schema_name))
+            self.serializers[schema_name] = serializer
+
+        return serializer
+
+    async def _buffer_message(self, topic: str, content: bytes) -> bool:
         '''
         Summary:
-            the function will send the byte message to kafka topic
+            the function will put the byte message into the buffer and start
+            the background task to send it. If the buffer is full, the function
+            waits for the space up to ACTIVITY_LOG_BUFFER_TIMEOUT and raises
+            ActivityLogBufferFull after that. The message is dropped without
+            waiting only if ACTIVITY_LOG_DROP_WHEN_FULL is enabled
 
         Parameter:
             - topic(str): the name of kafka topic
             - content(bytes): the byte message that will be sent to topic
+
+        Return:
+            - bool: if the message is buffered
         '''
 
+        if self.buffer is None:
+            self.buffer = asyncio.Queue(maxsize=ConfigClass.ACTIVITY_LOG_BUFFER_SIZE)
+
+        try:
+            self.buffer.put_nowait((topic, content))
+        except asyncio.QueueFull:
+            if ConfigClass.ACTIVITY_LOG_DROP_WHEN_FULL:
+                self.logger.error('Activity log buffer is full, drop the message to topic: %s', topic)
+                _dropped.inc()
+                return False
+
+            # the worker must be running to drain the buffer while waiting
+            if self.flush_task is None:
+                self.flush_task = asyncio.ensure_future(self._flush_worker())
+            try:
+                await asyncio.wait_for(self.buffer.put((topic, content)), ConfigClass.ACTIVITY_LOG_BUFFER_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.logger.error('Activity log buffer stays full, drop the message to topic: %s', topic)
+                _dropped.inc()
+                raise ActivityLogBufferFull(f'Fail to buffer the activity log to topic: {topic}')
+
+        _buffered.set(self.buffer.qsize())
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_worker())
+
+        return True
+
+    async def _flush_worker(self) -> None:
+        # the worker stops once the buffer is empty and is started again
+        # by the next message
         try:
-            await self.producer.send_and_wait(topic, content)
-        except Exception as e:
-            self.logger.error('Fail to send message:%s' % (str(e)))
-            raise e
+            await self.init_connection()
+            while not self.buffer.empty():
+                batch = []
+                while not self.buffer.empty() and len(batch) < ConfigClass.ACTIVITY_LOG_BATCH_SIZE:
+                    batch.append(self.buffer.get_nowait())
+                _buffered.set(self.buffer.qsize())
+                await self._send_batch(batch)
+        finally:
+            self.flush_task = None
+
+    async def _send_batch(self, batch: List[Tuple[str, bytes]]) -> None:
+        '''
+        Summary:
+            the function will send the byte messages to kafka and wait for
+            all of them to be delivered. The producer waits for linger_ms to
+            compress the messages of same partition together. The send will
+            wait if the producer has too many messages in flight, so the
+            buffer is filled up when kafka is slow
+
+        Parameter:
+            - batch(list): the (topic, byte message) pairs
+        '''
+
+        if not self.connected:
+            self.logger.error('Fail to send %d messages: kafka producer is not connected' % len(batch))
+            _failed.inc(len(batch))
+            return
+
+        futures = []
+        for topic, content in batch:
+            try:
+                futures.append(await self.producer.send(topic, content))
+            except Exception as e:
+                self.logger.error('Fail to send message:%s' % (str(e)))
+                _failed.inc()
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            self.logger.error('Fail to deliver %d messages:%s' % (len(errors), str(errors[0])))
+            _failed.inc(len(errors))
+        _sent.inc(len(results) - len(errors))
 
     async def _validate_message(self, schema_name: str, message: dict) -> bytes:
         '''
@@ -89,19 +252,15 @@ class KakfaProducer:
             - byte message
         '''
 
-        bio = io.BytesIO()
-        SCHEMA = schema.load_schema(os.path.join(self.schema_path, schema_name))
-        schemaless_writer(bio, SCHEMA, message)
-
-        message = bio.getvalue()  # give this message to producer
-
-        return message
+        return self._get_serializer(schema_name).serialize(message)
 
     async def create_activity_log(self, message: dict, schema_name: str, topic: str):
         '''
         Summary:
             the function will validate the dict message with specified schema
-            and return the byte message to caller
+            and buffer the byte message. The message is sent to kafka in
+            background so the caller waits for the broker only when
+            the buffer is full
 
         Parameter:
             - message(dict): the message will send to kafka
@@ -112,11 +271,12 @@ class KakfaProducer:
             - byte message
         '''
 
-        self.logger.info('Create activity log to topic: %s' % (topic))
+        self.logger.info('Create activity log to topic: %s', topic)
 
         byte_message = await self._validate_message(schema_name, message)
-        self.logger.info('byte message is: %s' % str(byte_message))
-        await self._send_message(topic, byte_message)
+        # the payload itself is not logged
+        self.logger.debug('Encoded activity log of %d bytes', len(byte_message))
+        await self._buffer_message(topic, byte_message)
 
         return
 
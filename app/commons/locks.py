@@ -14,10 +14,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+from typing import List, Optional
+
 import httpx
+from common import LoggerFactory
 
+from app.commons.metrics import metrics
 from app.config import ConfigClass
 
+_logger = LoggerFactory('locks').get_logger()
+
+_shared = metrics.counter('read_lock_shared', 'Read locks served by the lock already held in process')
+_requests = metrics.counter('read_lock_requests', 'Bulk lock and unlock requests sent to lock service')
+_unlock_failed = metrics.counter('read_lock_unlock_failed', 'Read locks failed to be unlocked')
+
 
 class ResourceAlreadyInUsed(Exception):
     pass
@@ -46,8 +57,177 @@ async def bulk_lock_operation(resource_key: list, operation: str, lock: bool = T
     url = ConfigClass.DATAOPS_SERVICE_V2 + 'resource/lock/bulk'
     post_json = {'resource_keys': resource_key, 'operation': operation}
     async with httpx.AsyncClient() as client:
-        response = await client.request(method, url, json=post_json, timeout=3600)
+        response = await client.request(method, url, json=post_json, timeout=ConfigClass.LOCK_REQUEST_TIMEOUT)
     if response.status_code != 200:
         raise ResourceAlreadyInUsed('resource %s already in used' % resource_key)
 
     return response.json()
+
+
+class ReadLockManager:
+    """Share the read locks of files among the jobs in process.
+
+    The read locks are counted per key. Only the first holder of a key locks it in the lock service and only the
+    last holder unlocks it. The lock and unlock requests in LOCK_BATCH_WINDOW are sent together by bulk calls
+    of LOCK_CHUNK_SIZE keys. The unlock of a key is skipped if the key is locked again before it is sent.
+    """
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        '''
+        Summary:
+            the function will forget all the read locks in process
+        '''
+
+        # the number of holders, the keys locked in lock service and the
+        # futures of the keys being locked
+        self._counts = {}
+        self._held = set()
+        self._locking = {}
+        self._pending_locks = []
+        self._pending_unlocks = set()
+        self._flushed = None
+        self._flush_task = None
+
+    async def lock(self, keys: List[str]) -> None:
+        '''
+        Summary:
+            the function will read lock the keys. The keys already locked in
+            process are shared. If any key fails to be locked, all the keys
+            are released and the error is raised
+
+        Parameter:
+            - keys(list): the lock keys formatting as <bucket>/path/to/file
+        '''
+
+        waiting = []
+        for key in keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if key in self._locking:
+                waiting.append(self._locking[key])
+            elif key in self._held:
+                # the key is not unlocked since it has holder again
+                self._pending_unlocks.discard(key)
+                _shared.inc()
+            else:
+                self._locking[key] = asyncio.get_event_loop().create_future()
+                self._pending_locks.append(key)
+                waiting.append(self._locking[key])
+
+        if not waiting:
+            return
+
+        self._schedule()
+        results = await asyncio.gather(*[asyncio.shield(future) for future in waiting], return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            await self.unlock(keys)
+            raise errors[0]
+
+    async def unlock(self, keys: List[str]) -> None:
+        '''
+        Summary:
+            the function will release the read locks of the keys. The key
+            is unlocked in lock service once it has no holder. The error
+            of unlock is logged and not raised
+
+        Parameter:
+            - keys(list): the lock keys formatting as <bucket>/path/to/file
+        '''
+
+        for key in keys:
+            count = self._counts.get(key, 0) - 1
+            if count > 0:
+                self._counts[key] = count
+                continue
+
+            self._counts.pop(key, None)
+            if key in self._held:
+                self._pending_unlocks.add(key)
+
+        if self._pending_unlocks:
+            await asyncio.shield(self._schedule())
+
+    def _schedule(self) -> asyncio.Future:
+        if self._flushed is None:
+            self._flushed = asyncio.get_event_loop().create_future()
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+        return self._flushed
+
+    async def _flush(self) -> None:
+        # only one flush runs at the same time, so the unlock of a key
+        # always finishes before it is locked again
+        try:
+            while self._pending_locks or self._pending_unlocks:
+                await asyncio.sleep(ConfigClass.LOCK_BATCH_WINDOW)
+                locks, self._pending_locks = self._pending_locks, []
+                unlocks, self._pending_unlocks = sorted(self._pending_unlocks), set()
+                flushed, self._flushed = self._flushed, None
+                try:
+                    await asyncio.gather(
+                        *[self._lock_chunk(chunk) for chunk in self._get_chunks(locks)],
+                        *[self._unlock_chunk(chunk) for chunk in self._get_chunks(unlocks)],
+                    )
+                finally:
+                    if flushed is not None and not flushed.done():
+                        flushed.set_result(None)
+        finally:
+            # the pending keys can be taken back by lock before the flush
+            # starts, the waiters are released as nothing is left to send
+            flushed, self._flushed = self._flushed, None
+            if flushed is not None and not flushed.done():
+                flushed.set_result(None)
+            self._flush_task = None
+
+    @staticmethod
+    def _get_chunks(keys: List[str]) -> List[List[str]]:
+        chunks = []
+        for start in range(0, len(keys), ConfigClass.LOCK_CHUNK_SIZE):
+            end = start + ConfigClass.LOCK_CHUNK_SIZE
+            chunks.append(keys[start:end])
+
+        return chunks
+
+    async def _lock_chunk(self, keys: List[str]) -> None:
+        _requests.inc()
+        try:
+            await bulk_lock_operation(keys, 'read')
+        except Exception as e:
+            # the chunk has keys of other jobs, so the keys are locked one
+            # by one to find the ones in use
+            if len(keys) > 1:
+                await asyncio.gather(*[self._lock_chunk([key]) for key in keys])
+                return
+            self._set_locked(keys, e)
+            return
+
+        self._set_locked(keys, None)
+
+    def _set_locked(self, keys: List[str], error: Optional[Exception]) -> None:
+        for key in keys:
+            future = self._locking.pop(key)
+            if error is not None:
+                future.set_exception(error)
+                continue
+
+            self._held.add(key)
+            future.set_result(None)
+            # all the holders have gone while locking
+            if not self._counts.get(key):
+                self._pending_unlocks.add(key)
+
+    async def _unlock_chunk(self, keys: List[str]) -> None:
+        _requests.inc()
+        self._held.difference_update(keys)
+        try:
+            await bulk_lock_operation(keys, 'read', lock=False)
+        except Exception as e:
+            _logger.error(f'Fail to unlock {len(keys)} read locks: {e}')
+            _unlock_failed.inc(len(keys))
+
+
+read_lock_manager = ReadLockManager()
@@ -0,0 +1,106 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Union
+
+
+class Counter:
+    """Monotonic counter of events happened in current process."""
+
+    def __init__(self, name: str, description: str = '') -> None:
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    """Value which can go up and down, e.g. size of a buffer."""
+
+    def __init__(self, name: str, description: str = '') -> None:
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value: Union[int, float]) -> None:
+        self.value = value
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: Union[int, float] = 1) -> None:
+        self.value -= amount
+
+
+class MetricsRegistry:
+    """Keep the counters and gauges of current process by name."""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+
+    def counter(self, name: str, description: str = '') -> Counter:
+        '''
+        Summary:
+            the function will return the counter with the name. the
+            counter will be created if it does not exist
+
+        Parameter:
+            - name(str): the unique name of metric
+            - description(str): the description of metric
+
+        Return:
+            - Counter
+        '''
+
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, description)
+
+        return self._metrics[name]
+
+    def gauge(self, name: str, description: str = '') -> Gauge:
+        '''
+        Summary:
+            the function will return the gauge with the name. the
+            gauge will be created if it does not exist
+
+        Parameter:
+            - name(str): the unique name of metric
+            - description(str): the description of metric
+
+        Return:
+            - Gauge
+        '''
+
+        if name not in self._metrics:
+            self._metrics[name] = Gauge(name, description)
+
+        return self._metrics[name]
+
+    def snapshot(self) -> Dict[str, Union[int, float]]:
+        '''
+        Summary:
+            the function will return current values of all metrics
+
+        Return:
+            - dict: metric name and value pairs
+        '''
+
+        return {name: metric.value for name, metric in sorted(self._metrics.items())}
+
+
+metrics = MetricsRegistry()
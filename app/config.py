@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from common import VaultClient
 from pydantic import BaseSettings, Extra
@@ -55,6 +55,69 @@ class Settings(BaseSettings):
     METADATA_SERVICE: str
     PROJECT_SERVICE: str
 
+    # the number of items fetched per page when listing folder tree
+    METADATA_PAGE_SIZE: int = 1000
+    # lookup the items by the batch api of metadata service. The max
+    # number of concurrent api calls is limited by METADATA_CONCURRENCY
+    METADATA_BATCH_LOOKUP: bool = True
+    METADATA_BATCH_SIZE: int = 100
+    METADATA_CONCURRENCY: int = 10
+    # cache the metadata items and listings in process and in redis.
+    # the cache is invalidated by the item activities from kafka
+    METADATA_CACHE_ENABLED: bool = True
+    METADATA_CACHE_TTL: int = 30
+    METADATA_CACHE_LOCAL_BYTES: int = 64 * 1024 * 1024
+    # the manifest of download job will be moved to disk if number of
+    # files or estimated memory in bytes is over the limit
+    MANIFEST_SPILL_THRESHOLD: int = 100000
+    MANIFEST_MEMORY_LIMIT: int = 32 * 1024 * 1024
+    # the approved files are fetched by ids instead of listing the folders
+    # if folders have this times more files than the approval request
+    APPROVAL_DIRECT_FETCH_RATIO: int = 10
+    # the approval entity ids are cached by request id and review version.
+    # The ids of outdated version expire after the ttl
+    APPROVAL_CACHE_TTL: int = 3600
+    # the max number of listed files waiting to be downloaded
+    DOWNLOAD_QUEUE_SIZE: int = 1000
+    # the max number of files in one lock or unlock request
+    LOCK_CHUNK_SIZE: int = 100
+    # the seconds to wait for one lock or unlock request
+    LOCK_REQUEST_TIMEOUT: int = 3600
+    # the read locks requested in the window are sent together
+    LOCK_BATCH_WINDOW: float = 0.01
+    # lock the selected folders by <bucket>/<folder_path> instead of each
+    # file under them. Only enable it if the lock service treats the key as
+    # the lock of all files under the folder
+    LOCK_FOLDER_PREFIX: bool = False
+    # the files of published dataset in core zone are immutable, so they
+    # are downloaded without read locks
+    LOCK_SKIP_DATASET_FILES: bool = True
+
+    # the legacy dataaction:* status keys are moved into job hashes at startup
+    JOB_STATUS_MIGRATE_LEGACY: bool = True
+    JOB_STATUS_MIGRATION_LOCK_TTL: int = 600
+    # the job status saved without ttl gets the retention policy at startup.
+    # It runs once in the interval in seconds whatever the number of workers
+    JOB_STATUS_APPLY_RETENTION: bool = True
+    JOB_STATUS_RETENTION_INTERVAL: int = 86400
+    # the finished job status expires after the ttl in seconds. Other status
+    # expires together with the download token
+    JOB_STATUS_SUCCEED_TTL: int = 3600
+    JOB_STATUS_CANCELLED_TTL: int = 3600
+    # the seconds between keep-alive comments of status stream and the
+    # max seconds of status long polling
+    STATUS_STREAM_KEEPALIVE: int = 15
+    STATUS_LONG_POLL_TIMEOUT: int = 30
+    # the max number of hash codes in one batch status request
+    STATUS_BATCH_LIMIT: int = 100
+    # the status updates in the window are written together and only the
+    # last update of same job is written
+    STATUS_WRITE_WINDOW: float = 0.01
+    # the number of job status cached in each process. 0 to disable
+    STATUS_CACHE_SIZE: int = 10000
+    # the max seconds of job status in process cache
+    STATUS_CACHE_TTL: int = 300
+
     # minio
     # this endpoint is internal communication
     S3_INTERNAL: str
@@ -77,6 +140,10 @@ class Settings(BaseSettings):
     REDIS_USER: str = 'default'
     REDIS_DB: int
     REDIS_PASSWORD: str
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: int = 5
+    # connect to redis cluster by the node of REDIS_HOST and REDIS_PORT
+    REDIS_CLUSTER: bool = False
 
     # Postgres
     # TODO remove it after add approval service
@@ -86,12 +153,27 @@ class Settings(BaseSettings):
     RDS_USER: str
     RDS_DBNAME: str
     RDS_SCHEMA_DEFAULT: str
+    RDS_POOL_SIZE: int = 5
+    RDS_MAX_OVERFLOW: int = 10
 
     # kafka
     # NOTE: KAFKA URL cannot start with http://
     KAFKA_URL: str
     KAFKA_ITEM_ACTIVITY_TOPIC: str = 'metadata.items.activity'
     KAFKA_DATASET_ACTIVITY_TOPIC: str = 'dataset.activity'
+    # the producer compresses the batch of messages waiting for linger_ms
+    KAFKA_COMPRESSION_TYPE: Optional[str] = 'gzip'
+    KAFKA_LINGER_MS: int = 50
+    # the activity logs are buffered in process and sent in background by
+    # batches. Once the buffer is full, the caller waits for the space up to
+    # ACTIVITY_LOG_BUFFER_TIMEOUT seconds and fails after that. The logs are
+    # dropped without waiting only if ACTIVITY_LOG_DROP_WHEN_FULL is enabled
+    ACTIVITY_LOG_BUFFER_SIZE: int = 10000
+    ACTIVITY_LOG_BATCH_SIZE: int = 500
+    ACTIVITY_LOG_BUFFER_TIMEOUT: int = 10
+    ACTIVITY_LOG_DROP_WHEN_FULL: bool = False
+    # the seconds to send the buffered logs at shutdown
+    ACTIVITY_LOG_DRAIN_TIMEOUT: int = 5
 
     OPEN_TELEMETRY_ENABLED: bool = False
     OPEN_TELEMETRY_HOST: str = '127.0.0.1'
@@ -40,6 +40,12 @@ class DatasetPrePOST(BaseModel):
     operator: str
 
 
+class DownloadStatusBatchPOST(BaseModel):
+    """Batch download status payload model."""
+
+    hash_codes: List[str] = []
+
+
 class PreSignedDownload(BaseModel):
     """Pre signed download url payload for minio."""
 
@@ -115,31 +121,40 @@ class GetDataDownloadStatusResponse(APIResponse):
 class DownloadStatusListResponse(APIResponse):
     """List data download status."""
 
-    result: dict = Field(
-        {},
+    result: list = Field(
+        [],
         example=[
             {
-                'session_id': 'unique_session_id',
-                'job_id': 'data-download-1613507376',
-                'source': './test_project/workdir/test_project_zipped_1613507376.zip',
-                'action': 'data_download',
-                'status': 'READY_FOR_DOWNLOADING',
-                'project_code': 'test_project',
-                'operator': 'zhengyang',
-                'progress': 0,
-                'payload': {
-                    'hash_code': (
-                        'eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJmdWxsX3BhdGgiOiIuL3Rlc3'
-                        'RfcHJvamVjdC93b3JrZGlyL3Rlc3RfcHJvamVjdF96aXBwZWRfMTYxMzUwNzM3N'
-                        'i56aXAiLCJpc3N1ZXIiOiJTRVJWSUNFIERBVEEgRE9XTkxPQUQgIiwib3BlcmF0'
-                        'b3IiOiJ6aGVuZ3lhbmciLCJzZXNzaW9uX2lkIjoidW5pcXVlX3Nlc3Npb25faWQ'
-                        'iLCJqb2JfaWQiOiJkYXRhLWRvd25sb2FkLTE2MTM1MDczNzYiLCJwcm9qZWN0X2'
-                        'NvZGUiOiJ0ZXN0X3Byb2plY3QiLCJpYXQiOjE2MTM1MDczNzYsImV4cCI6MTYxM'
-                        'zUwNzY3Nn0.ipzWy6y79QxRGhQQ_VWIk-Lz8Iv8zU7JHGF3ZBoNt-g'
-                    )
+                'hash_code': (
+                    'eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJmdWxsX3BhdGgiOiIuL3Rlc3'
+                    'RfcHJvamVjdC93b3JrZGlyL3Rlc3RfcHJvamVjdF96aXBwZWRfMTYxMzUwNzM3N'
+                    'i56aXAiLCJpc3N1ZXIiOiJTRVJWSUNFIERBVEEgRE9XTkxPQUQgIiwib3BlcmF0'
+                    'b3IiOiJ6aGVuZ3lhbmciLCJzZXNzaW9uX2lkIjoidW5pcXVlX3Nlc3Npb25faWQ'
+                    'iLCJqb2JfaWQiOiJkYXRhLWRvd25sb2FkLTE2MTM1MDczNzYiLCJwcm9qZWN0X2'
+                    'NvZGUiOiJ0ZXN0X3Byb2plY3QiLCJpYXQiOjE2MTM1MDczNzYsImV4cCI6MTYxM'
+                    'zUwNzY3Nn0.ipzWy6y79QxRGhQQ_VWIk-Lz8Iv8zU7JHGF3ZBoNt-g'
+                ),
+                'code': 200,
+                'error_msg': '',
+                'result': {
+                    'session_id': 'unique_session_id',
+                    'job_id': 'data-download-1613507376',
+                    'source': './test_project/workdir/test_project_zipped_1613507376.zip',
+                    'action': 'data_download',
+                    'status': 'READY_FOR_DOWNLOADING',
+                    'project_code': 'test_project',
+                    'operator': 'zhengyang',
+                    'progress': 0,
+                    'payload': {},
+                    'update_timestamp': '1613507385',
                 },
-                'update_timestamp': '1613507385',
-            }
+            },
+            {
+                'hash_code': 'expired_hash_code',
+                'code': 401,
+                'error_msg': 'Signature has expired',
+                'result': {},
+            },
         ],
     )
 
@@ -15,9 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import httpx
-from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import text
 
+from app.commons.data_providers.database import database
 from app.commons.data_providers.redis import SrvRedisSingleton
 from app.commons.kafka_producer import get_kafka_producer
 from app.config import ConfigClass
@@ -79,10 +79,9 @@ async def check_RDS():
     """
 
     try:
-        engine = create_async_engine(ConfigClass.RDS_DB_URI)
-        metadata = MetaData(schema=ConfigClass.RDS_SCHEMA_DEFAULT)
-        async with engine.connect() as conn:
-            await conn.run_sync(metadata.reflect, only=['approval_entity'])
+        async with database.get_engine().connect() as conn:
+            await conn.execute(text('SELECT 1'))
+        metadata = await database.get_metadata()
 
         if metadata.tables:
             return {'RDS': 'Online'}
@@ -14,14 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import json
 import time
-from typing import List
+from typing import AsyncIterator, List, Optional
 from uuid import UUID
 
 import httpx
 
-from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.data_providers.job_status import job_status_writer
+from app.commons.data_providers.job_status_cache import job_status_cache
+from app.commons.data_providers.metadata_cache import metadata_cache
 from app.config import ConfigClass
 from app.models.base_models import EAPIResponseCode
 from app.models.models_data_download import EDataDownloadStatus
@@ -31,13 +34,34 @@ class ResourceNotFound(Exception):
     pass
 
 
+def _get_folder_search_payload(
+    container_code: str, container_type: str, owner: str, zone: int, parent_path: str, page_size: int
+) -> dict:
+    return {
+        'container_code': container_code,
+        'container_type': container_type,
+        'zone': zone,
+        'recursive': True,
+        'archived': False,
+        'parent_path': parent_path,
+        'owner': owner,
+        'type': 'file',
+        'page': 0,
+        'page_size': page_size,
+    }
+
+
 async def get_files_folder_recursive(
     container_code: str, container_type: str, owner: str, zone: int = 0, parent_path: str = ''
-) -> List[dict]:
+) -> AsyncIterator[dict]:
     '''
     Summary:
         The function will call the api into metadata service and fetch
-        the file/folder object match the parameters recursively.
+        the file/folder object match the parameters recursively. The
+        result is fetched page by page so only one page of items is
+        parsed and kept in memory at any time. The pages are always read
+        from metadata service, since the pages cached at different times
+        can skip or repeat the files changed in between.
 
     Parameter:
         - container_code(str): the code of container
@@ -47,34 +71,74 @@ async def get_files_folder_recursive(
         - parent_path(str) default='': the parent folder path of target file/folder
 
     Return:
-        - list: the list of file/folder meatch the searching parameter
+        - async iterator: the file/folder match the searching parameter
     '''
 
-    payload = {
-        'container_code': container_code,
-        'container_type': container_type,
-        'zone': zone,
-        'recursive': True,
-        'archived': False,
-        'parent_path': parent_path,
-        'owner': owner,
-        'type': 'file',
-    }
+    page_size = ConfigClass.METADATA_PAGE_SIZE
+    payload = _get_folder_search_payload(container_code, container_type, owner, zone, parent_path, page_size)
 
     url = ConfigClass.METADATA_SERVICE + 'items/search/'
     async with httpx.AsyncClient() as client:
-        res = await client.get(url, params=payload)
+        while True:
+            res = await client.get(url, params=payload)
+            if res.status_code != 200:
+                raise Exception('Error when query the folder tree %s' % (str(res.text)))
+
+            response = res.json()
+            items = response.get('result', [])
+            for item in items:
+                yield item
+
+            # stop at the last page. The short page check is a fallback
+            # in case metadata service does not return the page count
+            payload['page'] += 1
+            if len(items) < page_size or payload['page'] >= response.get('num_of_pages', payload['page'] + 1):
+                break
+
+
+async def get_files_folder_count(
+    container_code: str, container_type: str, owner: str, zone: int = 0, parent_path: str = ''
+) -> int:
+    '''
+    Summary:
+        The function will estimate the number of files under the folder
+        recursively. Only one item is fetched and the total is read from
+        the pagination of search api. The count is cached by
+        metadata_cache.
+
+    Parameter:
+        - container_code(str): the code of container
+        - container_type(string): the type can project or dataset
+        - owner(str): the owner of file/object
+        - zone(int) default=0: 0 for greenroom, 1 for core
+        - parent_path(str) default='': the parent folder path of target file/folder
+
+    Return:
+        - int: the number of files
+    '''
+
+    payload = _get_folder_search_payload(container_code, container_type, owner, zone, parent_path, 1)
+
+    url = ConfigClass.METADATA_SERVICE + 'items/search/'
+
+    async def _fetch_count() -> int:
+        async with httpx.AsyncClient() as client:
+            res = await client.get(url, params=payload)
         if res.status_code != 200:
             raise Exception('Error when query the folder tree %s' % (str(res.text)))
 
-    return res.json().get('result', [])
+        response = res.json()
+        return response.get('total', len(response.get('result', [])))
+
+    cache_key = 'count:' + json.dumps(payload, sort_keys=True)
+    return await metadata_cache.get(cache_key, _fetch_count, container_code=container_code)
 
 
 async def get_files_folder_by_id(_id: UUID) -> dict:
     '''
     Summary:
         The function will call the api into metadata service and fetch
-        the file/folder object by item.
+        the file/folder object by item. The item is cached by metadata_cache.
 
     Parameter:
         - _id(str): uuid of the file/folder
@@ -83,18 +147,99 @@ async def get_files_folder_by_id(_id: UUID) -> dict:
         - dict: the detail info of item with target id
     '''
 
-    url = ConfigClass.METADATA_SERVICE + f'item/{_id}/'
-    async with httpx.AsyncClient() as client:
-        res = await client.get(url)
-    file_folder_object = res.json().get('result', {})
+    async def _fetch_item() -> dict:
+        url = ConfigClass.METADATA_SERVICE + f'item/{_id}/'
+        async with httpx.AsyncClient() as client:
+            res = await client.get(url)
+        file_folder_object = res.json().get('result', {})
+
+        # raise not found if the resource not exist
+        if len(file_folder_object) == 0 or res.status_code == EAPIResponseCode.not_found:
+            raise ResourceNotFound('resource %s does not exist' % _id)
+        elif res.status_code != 200:
+            raise Exception('Error when get resource: %s' % res.text)
+
+        return file_folder_object
+
+    return await metadata_cache.get(f'item:{_id}', _fetch_item)
+
 
-    # raise not found if the resource not exist
-    if len(file_folder_object) == 0 or res.status_code == EAPIResponseCode.not_found:
-        raise ResourceNotFound('resource %s does not exist' % _id)
-    elif res.status_code != 200:
-        raise Exception('Error when get resource: %s' % res.text)
+async def get_files_folder_by_ids(ids: List[str], ignore_missing: bool = False) -> List[dict]:
+    '''
+    Summary:
+        The function will fetch the file/folder objects by a list of ids.
+        If metadata service supports the batch lookup, the ids will be
+        split into chunks and each chunk is fetched by one api call.
+        Otherwise, each id is fetched by single item api. In both cases
+        the api calls are made concurrently with bounded concurrency. The
+        cached items will not be fetched again.
+
+    Parameter:
+        - ids(list): uuid of the files/folders
+        - ignore_missing(bool) default=False: skip the ids not found instead
+            of raising ResourceNotFound
+
+    Return:
+        - list: the detail info of items in same order as ids
+    '''
+
+    semaphore = asyncio.Semaphore(ConfigClass.METADATA_CONCURRENCY)
+
+    async def _get_by_id(_id: str) -> List[dict]:
+        async with semaphore:
+            try:
+                return [await get_files_folder_by_id(_id)]
+            except ResourceNotFound:
+                if ignore_missing:
+                    return []
+                raise
+
+    async def _get_by_batch(batch: List[str]) -> List[dict]:
+        url = ConfigClass.METADATA_SERVICE + 'items/batch/'
+        async with semaphore:
+            async with httpx.AsyncClient() as client:
+                res = await client.get(url, params={'ids': batch})
+        if res.status_code != 200:
+            raise Exception('Error when get resources: %s' % res.text)
+
+        return res.json().get('result', [])
 
-    return file_folder_object
+    items = {}
+    missing_ids = ids
+    if ConfigClass.METADATA_CACHE_ENABLED and len(ids) > 1:
+        cached = await metadata_cache.lookup_many([f'item:{_id}' for _id in ids])
+        for _id in ids:
+            item = cached.get(f'item:{_id}')
+            if item is not None:
+                items[_id] = item
+        missing_ids = [_id for _id in ids if _id not in items]
+
+    # the single item api gives better error for one item
+    if len(missing_ids) == 1 or not ConfigClass.METADATA_BATCH_LOOKUP:
+        lookups = [_get_by_id(_id) for _id in missing_ids]
+    else:
+        lookups = []
+        for start in range(0, len(missing_ids), ConfigClass.METADATA_BATCH_SIZE):
+            end = start + ConfigClass.METADATA_BATCH_SIZE
+            lookups.append(_get_by_batch(missing_ids[start:end]))
+
+    fetched = {}
+    for result in await asyncio.gather(*lookups):
+        for item in result:
+            items[item['id']] = item
+            fetched[f'item:{item["id"]}'] = item
+    # the single item api caches the items by itself
+    if ConfigClass.METADATA_CACHE_ENABLED and ConfigClass.METADATA_BATCH_LOOKUP and len(missing_ids) > 1 and fetched:
+        await metadata_cache.store_many(fetched)
+
+    if ignore_missing:
+        return [items[_id] for _id in ids if _id in items]
+
+    for _id in ids:
+        if _id not in items:
+            raise ResourceNotFound('resource %s does not exist' % _id)
+
+    return [items[_id] for _id in ids]
 
 
 async def set_status(
@@ -129,8 +274,6 @@ async def set_status(
         - dict: the detail job info
     '''
 
-    srv_redis = SrvRedisSingleton()
-    my_key = 'dataaction:{}:Container:{}:{}:{}:{}:{}'.format(session_id, job_id, action, project_code, operator, source)
     payload = payload if payload else {}
     record = {
         'session_id': session_id,
@@ -143,16 +286,17 @@ async def set_status(
         'payload': payload,
         'update_timestamp': str(round(time.time())),
     }
-    my_value = json.dumps(record)
-    await srv_redis.set_by_key(my_key, my_value)
+    await job_status_writer.write(record)
     return record
 
 
 async def get_status(session_id: str, job_id: str, project_code: str, action: str, operator: str = None) -> List[dict]:
     '''
     Summary:
-        The function will fetch the existing job from redis by the input.
-        Return empty list if job does not exist
+        The function will fetch the existing job from the status cache or
+        redis by the input. The job is read by session id and job id, then
+        checked against the rest of the input. Return empty list if job
+        does not exist
 
     Parameter:
         - session_id(str): the session id for current user
@@ -165,9 +309,57 @@ async def get_status(session_id: str, job_id: str, project_code: str, action: st
         - dict: the detail job info
     '''
 
-    srv_redis = SrvRedisSingleton()
-    my_key = 'dataaction:{}:Container:{}:{}:{}'.format(session_id, job_id, action, project_code)
-    if operator:
-        my_key = 'dataaction:{}:Container:{}:{}:{}:{}'.format(session_id, job_id, action, project_code, operator)
-    res_binary = await srv_redis.mget_by_prefix(my_key)
-    return [json.loads(record.decode('utf-8')) for record in res_binary] if res_binary else []
+    record = await job_status_cache.get(session_id, job_id)
+    if record is None or not is_job_matched(record, project_code, action, operator):
+        return []
+
+    return [record]
+
+
+async def get_status_response(
+    session_id: str, job_id: str, project_code: str, action: str, operator: str = None
+) -> Optional[bytes]:
+    '''
+    Summary:
+        The function will fetch the rendered response of the existing job
+        by the input, so the response can be sent as it is. The job is
+        checked in the same way as get_status
+
+    Parameter:
+        - session_id(str): the session id for current user
+        - job_id(str): the job identifier for running action
+        - project_code(str): the unique code of project
+        - action(str): in download service this will be marked as data_download
+        - operator(str) default=None: the user who takes current action
+
+    Return:
+        - bytes: the response body. None if job does not exist
+    '''
+
+    entry = await job_status_cache.get_response(session_id, job_id)
+    if entry is None or not is_job_matched(entry[0], project_code, action, operator):
+        return None
+
+    return entry[1]
+
+
+def is_job_matched(record: dict, project_code: str, action: str, operator: str = None) -> bool:
+    '''
+    Summary:
+        The function will check if the job status belongs to the container,
+        action and operator
+
+    Parameter:
+        - record(dict): the job status
+        - project_code(str): the unique code of project
+        - action(str): in download service this will be marked as data_download
+        - operator(str) default=None: the user who takes current action
+
+    Return:
+        - bool: True if the job matches
+    '''
+
+    if record.get('action') != action or record.get('project_code') != project_code:
+        return False
+
+    return not operator or record.get('operator') == operator
@@ -16,7 +16,12 @@
 
 from fastapi import APIRouter
 
-from app.commons.kafka_producer import get_kafka_producer
+from app.commons.data_providers.database import database
+from app.commons.data_providers.job_status import job_status_store
+from app.commons.data_providers.job_status_listener import job_status_listener
+from app.commons.data_providers.metadata_cache import metadata_cache_invalidator
+from app.commons.kafka_producer import get_kafka_producer, kakfa_producer
+from app.commons.metrics import metrics
 from app.config import ConfigClass
 
 router = APIRouter()
@@ -33,15 +38,58 @@ async def root():
     }
 
 
+@router.get('/v1/metrics')
+async def get_metrics():
+    """Return the metrics of current process."""
+
+    await job_status_store.update_metrics()
+    return metrics.snapshot()
+
+
+@router.on_event('startup')
+async def startup_event():
+    '''
+    Summary:
+        the startup event to start consuming the item
+        activities for metadata cache invalidation,
+        create the database connection pool, move the
+        legacy job status keys, apply the retention,
+        subscribe the job status for the status cache
+        and parse the avro schemas of activity logs.
+    '''
+
+    database.get_engine()
+    kakfa_producer.load_schemas()
+
+    if ConfigClass.JOB_STATUS_MIGRATE_LEGACY:
+        await job_status_store.migrate_legacy()
+
+    if ConfigClass.JOB_STATUS_APPLY_RETENTION:
+        await job_status_store.apply_retention()
+
+    if ConfigClass.METADATA_CACHE_ENABLED:
+        await metadata_cache_invalidator.start()
+
+    # the job status cache is kept up to date by the subscription
+    if ConfigClass.STATUS_CACHE_SIZE:
+        await job_status_listener.start()
+
+    return
+
+
 @router.on_event('shutdown')
 async def shutdown_event():
     '''
     Summary:
         the shutdown event to gracefully close the
-        kafka producer.
+        kafka producer, consumer, database pool and
+        job status subscription.
     '''
 
     kp = await get_kafka_producer()
     await kp.close_connection()
+    await metadata_cache_invalidator.stop()
+    await database.dispose()
+    await job_status_listener.stop()
 
     return
@@ -15,17 +15,30 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import time
+from typing import AsyncIterator, List, Optional, Tuple
 
+import orjson
 from common import LoggerFactory
 from fastapi import APIRouter
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi_utils import cbv
 from jwt import ExpiredSignatureError
 from jwt.exceptions import DecodeError
 
+from app.commons.data_providers.job_status import job_status_store
+from app.commons.data_providers.job_status_listener import job_status_listener
 from app.config import ConfigClass
 from app.models.base_models import APIResponse, EAPIResponseCode
 from app.models.models_data_download import (
+    DownloadStatusBatchPOST,
+    DownloadStatusListResponse,
     EDataDownloadStatus,
     GetDataDownloadStatusResponse,
 )
@@ -35,13 +48,25 @@ from app.resources.error_handler import (
     catch_internal,
     customized_error_template,
 )
-from app.resources.helpers import get_status, set_status
+from app.resources.helpers import (
+    get_status,
+    get_status_response,
+    is_job_matched,
+    set_status,
+)
 
 router = APIRouter()
 
 _API_TAG = 'v1/data-download'
 _API_NAMESPACE = 'api_data_download'
 
+# the status stream ends once the job reaches one of them
+_FINISHED_STATUS = {
+    str(EDataDownloadStatus.READY_FOR_DOWNLOADING),
+    str(EDataDownloadStatus.SUCCEED),
+    str(EDataDownloadStatus.CANCELLED),
+}
+
 
 @cbv.cbv(router)
 class APIDataDownload:
@@ -69,36 +94,214 @@ class APIDataDownload:
             - 200
         '''
 
-        response = APIResponse()
-
         self.__logger.info('Recieving request on /download/status/{hash_code}')
         # verify hash code
+        res_verify_token, response = await self._verify_hash_code(hash_code)
+        if res_verify_token is None:
+            return response.json_response()
+
+        # use retrieved the payload to get the rendered job status
+        body = await get_status_response(
+            res_verify_token.get('session_id'),
+            res_verify_token.get('job_id'),
+            res_verify_token.get('container_code'),
+            'data_download',
+            res_verify_token.get('operator'),
+        )
+        if body is None:
+            return self._job_status_response(res_verify_token, None)
+
+        return Response(content=body, media_type='application/json')
+
+    @router.get(
+        '/download/status/{hash_code}/stream',
+        tags=[_API_TAG],
+        summary='Stream download status as server-sent events',
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def data_download_status_stream(self, hash_code: str):
+        '''
+        Summary:
+            The API is to stream the download status by the hashcode as
+            server-sent events. The current status is sent first and then
+            every update of the job. The stream ends once the job is ready,
+            succeed or cancelled. If the job does not exist or expires, an
+            error event with code 404 is sent and the stream ends
+
+        Parameter:
+            - hash_code(str): hashcode return from /v1/download/pre
+
+        Return:
+            - 200 with text/event-stream
+        '''
+
+        self.__logger.info('Recieving request on /download/status/{hash_code}/stream')
+        res_verify_token, response = await self._verify_hash_code(hash_code)
+        if res_verify_token is None:
+            return response.json_response()
+
+        return StreamingResponse(
+            self._stream_job_status(res_verify_token),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    @router.get(
+        '/download/status/{hash_code}/poll',
+        tags=[_API_TAG],
+        response_model=GetDataDownloadStatusResponse,
+        summary='Wait for download status change',
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def data_download_status_poll(self, hash_code: str, last_status: Optional[str] = None, timeout: int = 30):
+        '''
+        Summary:
+            The API is the long polling of download status for the clients
+            without server-sent events. It returns once the job status is
+            different from last_status or the timeout is reached
+
+        Parameter:
+            - hash_code(str): hashcode return from /v1/download/pre
+            - last_status(str): the status known by client
+            - timeout(int): the max seconds to wait, up to STATUS_LONG_POLL_TIMEOUT
+
+        Return:
+            - 200
+        '''
+
+        self.__logger.info('Recieving request on /download/status/{hash_code}/poll')
+        res_verify_token, response = await self._verify_hash_code(hash_code)
+        if res_verify_token is None:
+            return response.json_response()
+
+        timeout = min(max(timeout, 0), ConfigClass.STATUS_LONG_POLL_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        session_id, job_id = res_verify_token.get('session_id'), res_verify_token.get('job_id')
+        async with job_status_listener.subscribe(session_id, job_id) as updates:
+            job_fatched = await self._get_job_status(res_verify_token)
+            record = job_fatched[0] if job_fatched else None
+            while last_status and (record is None or record.get('status') == last_status):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                update = await job_status_listener.wait(updates, remaining)
+                if update is not None and self._is_token_job(res_verify_token, update):
+                    record = update
+
+        return self._job_status_response(res_verify_token, record)
+
+    @router.post(
+        '/download/status/batch',
+        tags=[_API_TAG],
+        response_model=DownloadStatusListResponse,
+        summary='Check download status of many jobs',
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def data_download_status_batch(self, data: DownloadStatusBatchPOST):
+        '''
+        Summary:
+            The API is to return the status of many jobs in one call. The
+            jobs are given by the hashcodes and each hashcode is verified
+            as the download token. Each item has its own code and error
+            message so the expired or invalid hashcode will not fail the
+            whole request
+
+        Payload:
+            - hash_codes(list): hashcodes return from /v1/download/pre
+
+        Return:
+            - 200
+        '''
+
+        self.__logger.info('Recieving request on /download/status/batch')
+        response = APIResponse()
+        if len(data.hash_codes) > ConfigClass.STATUS_BATCH_LIMIT:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = f'The number of hash codes is over the limit {ConfigClass.STATUS_BATCH_LIMIT}'
+            return response.json_response()
+
+        if not data.hash_codes:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = 'hash_codes is required'
+            return response.json_response()
+
+        items, tokens = [], []
+        for hash_code in data.hash_codes:
+            res_verify_token, item_response = await self._verify_hash_code(hash_code)
+            items.append(
+                {
+                    'hash_code': hash_code,
+                    'code': item_response.code.value,
+                    'error_msg': item_response.error_msg,
+                    'result': {},
+                }
+            )
+            if res_verify_token is not None:
+                tokens.append((items[-1], res_verify_token))
+
+        # all the valid jobs are fetched in one round trip
+        records = await job_status_store.get_many(
+            [(token.get('session_id'), token.get('job_id')) for _, token in tokens]
+        )
+        for (item, token), record in zip(tokens, records):
+            if record is not None and self._is_token_job(token, record):
+                item['result'] = record
+            else:
+                item['code'] = EAPIResponseCode.not_found.value
+                item['error_msg'] = customized_error_template(ECustomizedError.JOB_NOT_FOUND)
+
+        response.result = items
+        response.total = len(items)
+        return response.json_response()
+
+    async def _verify_hash_code(self, hash_code: str) -> Tuple[Optional[dict], APIResponse]:
+        '''
+        Summary:
+            The function will verify the hashcode. If the hashcode is not
+            valid, the error will be set into the response
+
+        Parameter:
+            - hash_code(str): hashcode return from /v1/download/pre
+
+        Return:
+            - dict: the payload of token. None if not valid
+            - APIResponse: the response with error
+        '''
+
+        response = APIResponse()
         try:
-            res_verify_token = await verify_download_token(hash_code)
+            return await verify_download_token(hash_code), response
         except ExpiredSignatureError as e:
             response.code = EAPIResponseCode.unauthorized
             response.error_msg = str(e)
-            return response.json_response()
         except (DecodeError, InvalidToken) as e:
             response.code = EAPIResponseCode.bad_request
             response.error_msg = str(e)
-            return response.json_response()
         except Exception as e:
             response.code = EAPIResponseCode.internal_error
             response.error_msg = str(e)
-            return response.json_response()
 
-        # use retrieved the payload to get the job status
-        session_id = res_verify_token.get('session_id')
-        job_id = res_verify_token.get('job_id')
-        project_code = res_verify_token.get('container_code')
-        operator = res_verify_token.get('operator')
-        job_fatched = await get_status(session_id, job_id, project_code, 'data_download', operator)
-        self.__logger.info('job_fatched list: ' + str(job_fatched))
+        return None, response
 
-        if len(job_fatched):
+    async def _get_job_status(self, res_verify_token: dict) -> List[dict]:
+        return await get_status(
+            res_verify_token.get('session_id'),
+            res_verify_token.get('job_id'),
+            res_verify_token.get('container_code'),
+            'data_download',
+            res_verify_token.get('operator'),
+        )
+
+    def _is_token_job(self, res_verify_token: dict, record: dict) -> bool:
+        return is_job_matched(
+            record, res_verify_token.get('container_code'), 'data_download', res_verify_token.get('operator')
+        )
+
+    def _job_status_response(self, res_verify_token: dict, record: Optional[dict]) -> JSONResponse:
+        response = APIResponse()
+        if record is not None:
             response.code = EAPIResponseCode.success
-            response.result = job_fatched[0]
+            response.result = record
         else:
             self.__logger.error(f'Status not found {res_verify_token} in namespace {ConfigClass.namespace}')
             response.code = EAPIResponseCode.not_found
@@ -106,6 +309,38 @@ class APIDataDownload:
 
         return response.json_response()
 
+    async def _stream_job_status(self, res_verify_token: dict) -> AsyncIterator[str]:
+        session_id, job_id = res_verify_token.get('session_id'), res_verify_token.get('job_id')
+        async with job_status_listener.subscribe(session_id, job_id) as updates:
+            # subscribe before reading so no update is missed in between
+            job_fatched = await self._get_job_status(res_verify_token)
+            record = job_fatched[0] if job_fatched else None
+            while record is not None:
+                yield f'data: {orjson.dumps(record).decode()}\n\n'
+                if record.get('status') in _FINISHED_STATUS:
+                    return
+
+                record = None
+                while record is None:
+                    update = await job_status_listener.wait(updates, ConfigClass.STATUS_STREAM_KEEPALIVE)
+                    if update is not None:
+                        if self._is_token_job(res_verify_token, update):
+                            record = update
+                        continue
+
+                    # the job can expire without any update, so it is
+                    # checked again before each keep-alive
+                    if not await self._get_job_status(res_verify_token):
+                        break
+                    yield ': keep-alive\n\n'
+
+        self.__logger.error(f'Status not found {res_verify_token} in namespace {ConfigClass.namespace}')
+        error = {
+            'code': EAPIResponseCode.not_found.value,
+            'error_msg': customized_error_template(ECustomizedError.JOB_NOT_FOUND),
+        }
+        yield f'event: error\ndata: {orjson.dumps(error).decode()}\n\n'
+
     @router.get(
         '/download/{hash_code}',
         tags=[_API_TAG],
@@ -170,7 +405,7 @@ class APIDataDownload:
             file_path,
             'data_download',
             EDataDownloadStatus.SUCCEED,
-            res_verify_token.get('contianer_type'),
+            res_verify_token.get('container_code'),
             res_verify_token.get('operator'),
             res_verify_token.get('payload', {}),
         )
@@ -27,9 +27,8 @@ from common import (
 from fastapi import APIRouter, BackgroundTasks, Cookie, Header
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi_utils import cbv
-from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import create_async_engine
 
+from app.commons.data_providers.database import database
 from app.commons.download_manager.dataset_download_manager import (
     create_dataset_download_client,
 )
@@ -47,6 +46,7 @@ from app.models.models_data_download import (
 from app.resources.download_token_manager import verify_dataset_version_token
 from app.resources.error_handler import catch_internal
 from app.resources.helpers import ResourceNotFound
+from app.services.approval.cache import ApprovalCache
 from app.services.approval.client import ApprovalServiceClient
 
 router = APIRouter()
@@ -172,19 +172,15 @@ class APIDataDownload:
         if data.approval_request_id:
             self.__logger.info(f'download from approval request: {data.approval_request_id}')
 
-            engine = create_async_engine(ConfigClass.RDS_DB_URI)
-            metadata = MetaData(schema=ConfigClass.RDS_SCHEMA_DEFAULT)
-            async with engine.connect() as conn:
-                await conn.run_sync(metadata.reflect, only=['approval_entity'])
+            engine = database.get_engine()
+            metadata = await database.get_metadata()
 
             # get the set of approved files
             approval_service_client = ApprovalServiceClient(engine, metadata)
-            request_approval_entities = await approval_service_client.get_approval_entities(
-                str(data.approval_request_id)
-            )
-            file_geids_to_include = set(request_approval_entities.keys())
+            approval_cache = ApprovalCache(approval_service_client)
+            file_geids_to_include = await approval_cache.get_entity_ids(str(data.approval_request_id))
 
-            self.__logger.info(f'File included in approval request: {file_geids_to_include}')
+            self.__logger.info(f'Number of files included in approval request: {len(file_geids_to_include)}')
 
         try:
             self.__logger.info('Initialize the data download client')
@@ -198,13 +194,18 @@ class APIDataDownload:
                 file_geids_to_include,
             )
 
-            download_client.logger.info('generate hash token')
-            hash_code = await download_client.generate_hash_code()
+            try:
+                download_client.logger.info('generate hash token')
+                hash_code = await download_client.generate_hash_code()
 
-            download_client.logger.info('Init the download job status')
-            status_result = await download_client.set_status(
-                EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code}
-            )
+                download_client.logger.info('Init the download job status')
+                status_result = await download_client.set_status(
+                    EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code}
+                )
+            except Exception:
+                # the background job will not start to finish the listing
+                await download_client.close()
+                raise
 
             download_client.logger.info(
                 f'Starting background job for: {data.container_code}.'
@@ -274,8 +275,15 @@ class APIDataDownload:
             'dataset',
             sessionId,
         )
-        hash_code = await download_client.generate_hash_code()
-        status_result = await download_client.set_status(EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code})
+        try:
+            hash_code = await download_client.generate_hash_code()
+            status_result = await download_client.set_status(
+                EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code}
+            )
+        except Exception:
+            # the spilled manifest is removed by the background job only
+            await download_client.close()
+            raise
         download_client.logger.info(
             f'Starting background job for: {data.dataset_code}.' f'number of files {len(download_client.files_to_zip)}'
         )
@@ -0,0 +1,89 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+from typing import Set
+
+from common import LoggerFactory
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+from app.services.approval.client import ApprovalServiceClient
+
+_logger = LoggerFactory('ApprovalCache').get_logger()
+
+_hits = metrics.counter('approval_cache_hits', 'Approval entity ids served from redis')
+_misses = metrics.counter('approval_cache_misses', 'Approval entity ids loaded from database')
+
+
+class ApprovalCache:
+    """Cache the approval entity ids per request id and review state in redis.
+
+    The ids are stored as one zlib compressed blob of sorted ids under the key with the review version of the
+    request. The version is counted cheaply in database, so the ids are loaded again once the review of request
+    changes and the blob of outdated version expires by APPROVAL_CACHE_TTL.
+    """
+
+    prefix = 'approval:entity_ids:'
+
+    def __init__(self, client: ApprovalServiceClient) -> None:
+        self.client = client
+        self.redis = SrvRedisSingleton()
+
+    @staticmethod
+    def encode(entity_ids: Set[str]) -> bytes:
+        return zlib.compress('\n'.join(sorted(entity_ids)).encode())
+
+    @staticmethod
+    def decode(blob: bytes) -> Set[str]:
+        content = zlib.decompress(blob).decode()
+        return set(content.split('\n')) if content else set()
+
+    async def get_entity_ids(self, request_id: str) -> Set[str]:
+        '''
+        Summary:
+            the function will return the entity ids of approval request
+            from redis by the current review version. The ids are loaded
+            from database if not cached
+
+        Parameter:
+            - request_id(str): the approval request id
+
+        Return:
+            - set: the entity ids
+        '''
+
+        version = await self.client.get_review_version(request_id)
+        key = f'{self.prefix}{request_id}:{version}'
+
+        try:
+            blob = await self.redis.get_by_key(key)
+        except Exception as e:
+            _logger.error('Fail to read approval cache: %s', str(e))
+            blob = None
+        if blob is not None:
+            _hits.inc()
+            return self.decode(blob)
+
+        _misses.inc()
+        entity_ids = await self.client.get_approval_entity_ids(request_id)
+        try:
+            await self.redis.set_by_key(key, self.encode(entity_ids), expire=ConfigClass.APPROVAL_CACHE_TTL)
+        except Exception as e:
+            _logger.error('Fail to write approval cache: %s', str(e))
+
+        return entity_ids
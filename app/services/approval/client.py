@@ -14,13 +14,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from typing import Optional, Set
 from uuid import uuid4
 
-from sqlalchemy import Column, MetaData, Table, select
+from sqlalchemy import Column, MetaData, Table, func, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.future import Engine
 
-from app.services.approval.models import ApprovalEntities
+from app.services.approval.models import ApprovalEntities, ReviewStatus
 
 
 class ApprovalServiceClient:
@@ -45,3 +46,41 @@ class ApprovalServiceClient:
         request_approval_entities = ApprovalEntities.from_cursor(cursor)
 
         return request_approval_entities
+
+    async def get_approval_entity_ids(
+        self, request_id: str, review_status: Optional[ReviewStatus] = None, fetch_size: int = 1000
+    ) -> Set[str]:
+        """Return the entity ids related to request id, optionally only the ones with review status.
+
+        Only the entity_id column is selected and rows are streamed with server-side cursor by fetch_size.
+        """
+        statement = select(self.approval_entity.c.entity_id).filter_by(request_id=request_id)
+        if review_status is not None:
+            statement = statement.filter_by(review_status=review_status.value)
+
+        entity_ids = set()
+        async with self.engine.connect() as conn:
+            result = await conn.stream(statement)
+            async for partition in result.scalars().partitions(fetch_size):
+                entity_ids.update(partition)
+
+        return entity_ids
+
+    async def get_review_version(self, request_id: str) -> str:
+        """Return the version of review state of request id.
+
+        The version is the number of entities and the numbers of approved and denied ones. They are counted in
+        database by the index of request id without reading the entities, and change once any entity is added,
+        removed or reviewed.
+        """
+        entity = self.approval_entity.c
+        statement = select(
+            func.count(),
+            func.count().filter(entity.review_status == ReviewStatus.APPROVED.value),
+            func.count().filter(entity.review_status == ReviewStatus.DENIED.value),
+        ).where(entity.request_id == request_id)
+        async with self.engine.connect() as conn:
+            cursor = await conn.execute(statement)
+            total, approved, denied = cursor.one()
+
+        return f'{total}:{approved}:{denied}'
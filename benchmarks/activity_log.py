@@ -0,0 +1,128 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare the activity logs per second on one core through create_activity_log
+when the schema is loaded from disk, the encoded bytes are logged and the
+message is sent inline for every message against the prepared serializers
+and the buffered background sending. The broker is replaced by a fake one
+answering each request after --latency seconds and the log records are
+written to devnull. For the buffered sending, the time until all messages
+are delivered is reported as well.
+
+Usage:
+    poetry run python -m benchmarks.activity_log --messages 20000
+'''
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from fastavro import schema, schemaless_writer
+
+from app.commons.kafka_producer import KakfaProducer
+from app.config import ConfigClass
+
+SCHEMA_NAME = 'metadata_items_activity.avsc'
+MESSAGE = {
+    'activity_type': 'download',
+    'activity_time': datetime(2022, 1, 1),
+    'item_id': 'e3fb0f2a-5ec1-4bd6-9d6e-42b1a1d4c9f0',
+    'item_type': 'file',
+    'item_name': 'file.txt',
+    'item_parent_path': 'admin.folder',
+    'container_code': 'project',
+    'container_type': 'project',
+    'zone': 0,
+    'user': 'admin',
+    'imported_from': '',
+    'changes': [],
+}
+
+
+class FakeKafkaProducer:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+
+    async def send_and_wait(self, topic: str, value: bytes) -> None:
+        await asyncio.sleep(self.latency)
+
+    async def send(self, topic: str, value: bytes) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        loop.call_later(self.latency, future.set_result, None)
+        return future
+
+
+class LegacyKakfaProducer(KakfaProducer):
+    async def _validate_message(self, schema_name: str, message: dict) -> bytes:
+        bio = io.BytesIO()
+        SCHEMA = schema.load_schema(os.path.join(self.schema_path, schema_name))
+        schemaless_writer(bio, SCHEMA, message)
+
+        return bio.getvalue()
+
+    async def create_activity_log(self, message: dict, schema_name: str, topic: str):
+        self.logger.info('Create activity log to topic: %s' % (topic))
+
+        byte_message = await self._validate_message(schema_name, message)
+        self.logger.info('byte message is: %s' % str(byte_message))
+        await self.producer.send_and_wait(topic, byte_message)
+
+
+async def main(messages: int, rounds: int, latency: float) -> None:
+    logger = KakfaProducer.logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.FileHandler(os.devnull))
+    ConfigClass.ACTIVITY_LOG_BUFFER_SIZE = messages
+
+    before, after = LegacyKakfaProducer(), KakfaProducer()
+    after.load_schemas()
+    for producer in (before, after):
+        producer.producer = FakeKafkaProducer(latency)
+        producer.connected = True
+    assert await before._validate_message(SCHEMA_NAME, MESSAGE) == await after._validate_message(SCHEMA_NAME, MESSAGE)
+
+    for name, producer in (('before', before), ('after', after)):
+        rates, delivered_rates = [], []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(messages):
+                await producer.create_activity_log(MESSAGE, SCHEMA_NAME, 'topic')
+            rates.append(messages / (time.perf_counter() - start))
+            if producer.flush_task is not None:
+                await producer.flush_task
+            delivered_rates.append(messages / (time.perf_counter() - start))
+        sys.stdout.write(
+            f'{name:<7} best {max(rates):.0f} msg/s avg {sum(rates) / len(rates):.0f} msg/s, '
+            f'delivered avg {sum(delivered_rates) / len(delivered_rates):.0f} msg/s\n'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.001)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.messages, args.rounds, args.latency))
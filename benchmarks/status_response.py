@@ -0,0 +1,93 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare the requests per second on one core of the status response
+decoded from the job hash and re-encoded by APIResponse against the
+response rendered when the job status is written.
+
+Usage:
+    poetry run python -m benchmarks.status_response --requests 20000
+'''
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+import orjson
+from fastapi import FastAPI
+from fastapi.responses import Response
+
+from app.commons.data_providers.job_status import JobStatusStore
+from app.models.base_models import APIResponse, EAPIResponseCode
+
+RECORD = {
+    'session_id': 'session',
+    'job_id': 'data-download-1660000000',
+    'source': 'project/folder/file.zip',
+    'action': 'data_download',
+    'status': 'READY_FOR_DOWNLOADING',
+    'project_code': 'project',
+    'operator': 'admin',
+    'payload': {'hash_code': 'x' * 400, 'zone': 'greenroom', 'frontend_zone': 'Green Room'},
+    'update_timestamp': '1660000000',
+}
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    # the job hash as it is saved before the response is rendered
+    mapping = {field.encode(): json.dumps(value).encode() for field, value in RECORD.items()}
+    body = JobStatusStore.render_response(orjson.dumps(RECORD))
+
+    @app.get('/before')
+    async def before():
+        response = APIResponse()
+        response.code = EAPIResponseCode.success
+        response.result = {field.decode(): json.loads(value) for field, value in mapping.items()}
+        return response.json_response()
+
+    @app.get('/after')
+    async def after():
+        return Response(content=body, media_type='application/json')
+
+    return app
+
+
+async def main(requests: int, rounds: int) -> None:
+    async with httpx.AsyncClient(app=create_app(), base_url='http://benchmark') as client:
+        assert (await client.get('/before')).json() == (await client.get('/after')).json()
+
+        for path in ('/before', '/after'):
+            rates = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(requests):
+                    await client.get(path)
+                rates.append(requests / (time.perf_counter() - start))
+            sys.stdout.write(f'{path:<8} best {max(rates):.0f} req/s avg {sum(rates) / len(rates):.0f} req/s\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.requests, args.rounds))
@@ -0,0 +1,52 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from app.commons.data_providers.database import Database
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestDatabase:
+    async def test_get_engine_returns_same_engine(self):
+        database = Database()
+
+        engine = database.get_engine()
+
+        assert database.get_engine() is engine
+        await database.dispose()
+
+    async def test_dispose_drops_engine_and_metadata(self):
+        database = Database()
+        engine = database.get_engine()
+
+        await database.dispose()
+
+        assert database.get_engine() is not engine
+        await database.dispose()
+
+    async def test_get_metadata_reflects_table_once(self, engine, metadata, monkeypatch):
+        from app.config import ConfigClass
+
+        monkeypatch.setattr(ConfigClass, 'RDS_SCHEMA_DEFAULT', 'INDOC_TEST')
+        database = Database()
+        database._engine = engine
+
+        reflected = await database.get_metadata()
+
+        assert 'INDOC_TEST.approval_entity' in reflected.tables
+        assert await database.get_metadata() is reflected
@@ -0,0 +1,254 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.commons.data_providers.job_status import JobStatusStore, JobStatusWriter
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.config import ConfigClass
+from app.models.base_models import APIResponse
+from app.resources.helpers import get_status, set_status
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def store():
+    yield JobStatusStore()
+
+
+def make_record(session_id='session', job_id='job_1', project_code='any_code', status='ZIPPING', timestamp=None):
+    timestamp = timestamp or str(int(time.time()))
+    return {
+        'session_id': session_id,
+        'job_id': job_id,
+        'source': 'file.zip',
+        'action': 'data_download',
+        'status': status,
+        'project_code': project_code,
+        'operator': 'me',
+        'payload': {'hash_code': 'any'},
+        'update_timestamp': timestamp,
+    }
+
+
+def render_response(record):
+    response = APIResponse()
+    response.result = record
+    return response.json_response().body
+
+
+async def test_get_returns_saved_record(store):
+    await store.set(make_record())
+
+    assert await store.get('session', 'job_1') == make_record()
+    assert await store.get('session', 'job_2') is None
+
+
+async def test_get_many_returns_records_in_order(store):
+    await store.set(make_record(job_id='job_1'))
+    await store.set(make_record(job_id='job_2'))
+
+    records = await store.get_many([('session', 'job_2'), ('session', 'job_3'), ('session', 'job_1')])
+
+    assert [record and record['job_id'] for record in records] == ['job_2', None, 'job_1']
+
+
+async def test_list_jobs_by_session(store):
+    await store.set(make_record(job_id='job_1'))
+    await store.set(make_record(job_id='job_2', project_code='other_code'))
+    await store.set(make_record(session_id='other_session', job_id='job_3'))
+
+    assert [record['job_id'] for record in await store.list_by_session('session')] == ['job_1', 'job_2']
+
+
+async def test_get_response_returns_rendered_response(store):
+    await store.set(make_record())
+
+    summary, body = await store.get_response('session', 'job_1')
+
+    assert body == render_response(make_record())
+    assert summary == {
+        'action': 'data_download',
+        'project_code': 'any_code',
+        'operator': 'me',
+        'status': 'ZIPPING',
+        'update_timestamp': make_record()['update_timestamp'],
+    }
+    assert await store.get_response('session', 'job_2') is None
+
+
+async def test_get_response_renders_job_status_saved_without_response(store):
+    job_key = store.get_job_key('session', 'job_1')
+    await store.redis.REDIS.hset(job_key, mapping=store.encode(make_record()))
+
+    _, body = await store.get_response('session', 'job_1')
+
+    assert body == render_response(make_record())
+
+
+async def test_writer_coalesces_updates_of_same_job(store, mocker):
+    writer = JobStatusWriter(store)
+    write_many = mocker.spy(store, 'write_many')
+
+    await asyncio.gather(
+        writer.write(make_record(status='ZIPPING')),
+        writer.write(make_record(status='READY_FOR_DOWNLOADING')),
+        writer.write(make_record(job_id='job_2')),
+    )
+
+    assert write_many.call_count == 1
+    assert len(write_many.call_args.args[0]) == 2
+    assert (await store.get('session', 'job_1'))['status'] == 'READY_FOR_DOWNLOADING'
+    assert (await store.get('session', 'job_2'))['status'] == 'ZIPPING'
+
+
+async def test_writer_writes_only_changed_fields(store, mocker):
+    writer = JobStatusWriter(store)
+    await writer.write(make_record())
+    write_many = mocker.spy(store, 'write_many')
+
+    await writer.write(make_record(status='READY_FOR_DOWNLOADING', timestamp='1'))
+
+    [(record, fields, add_index)] = write_many.call_args.args[0]
+    assert fields == {'status': 'READY_FOR_DOWNLOADING', 'update_timestamp': '1'}
+    assert add_index is False
+    assert await store.get('session', 'job_1') == make_record(status='READY_FOR_DOWNLOADING', timestamp='1')
+
+
+async def test_writer_writes_full_status_when_job_hash_is_missing(store):
+    writer = JobStatusWriter(store)
+    await writer.write(make_record())
+    await store.redis.REDIS.delete(store.get_job_key('session', 'job_1'))
+
+    await writer.write(make_record(status='READY_FOR_DOWNLOADING', timestamp='1'))
+
+    assert await store.get('session', 'job_1') == make_record(status='READY_FOR_DOWNLOADING', timestamp='1')
+    assert await store.redis.REDIS.ttl(store.get_job_key('session', 'job_1')) > 0
+    assert await store.redis.REDIS.sismember(store.get_session_key('session'), 'session:job_1')
+
+
+async def test_redis_pool_is_sized_by_config():
+    pool = SrvRedisSingleton.REDIS.connection_pool
+
+    assert pool.max_connections == ConfigClass.REDIS_MAX_CONNECTIONS
+
+
+async def test_migrate_legacy_keeps_latest_record_of_job(store):
+    redis = store.redis.REDIS
+    now = int(time.time())
+    await redis.set('dataaction:session:Container:job_1:a', json.dumps(make_record(timestamp=str(now - 20))))
+    await redis.set(
+        'dataaction:session:Container:job_1:b', json.dumps(make_record(status='SUCCEED', timestamp=str(now - 10)))
+    )
+    await redis.set('dataaction:session:Container:job_2:a', json.dumps(make_record(job_id='job_2')))
+    await redis.set(
+        'dataaction:session:Container:job_3:a',
+        json.dumps(make_record(job_id='job_3', status='SUCCEED', timestamp=str(now - 7200))),
+    )
+
+    assert await store.migrate_legacy() == 4
+
+    assert (await store.get('session', 'job_1'))['status'] == 'SUCCEED'
+    assert (await store.get('session', 'job_2'))['job_id'] == 'job_2'
+    assert await store.get('session', 'job_3') is None
+    assert await redis.keys('dataaction:*') == []
+
+
+async def test_migrate_legacy_does_not_overwrite_newer_status(store):
+    now = int(time.time())
+    await store.set(make_record(status='SUCCEED', timestamp=str(now)))
+    await store.redis.REDIS.set(
+        'dataaction:session:Container:job_1:a', json.dumps(make_record(timestamp=str(now - 10)))
+    )
+
+    await store.migrate_legacy()
+
+    assert (await store.get('session', 'job_1'))['status'] == 'SUCCEED'
+
+
+async def test_set_applies_ttl_of_status(store):
+    redis = store.redis.REDIS
+    await store.set(make_record(status='ZIPPING'))
+    zipping_ttl = await redis.ttl(store.get_job_key('session', 'job_1'))
+    await store.set(make_record(status='SUCCEED'))
+
+    assert zipping_ttl == ConfigClass.DOWNLOAD_TOKEN_EXPIRE_AT * 60
+    assert await redis.ttl(store.get_job_key('session', 'job_1')) == ConfigClass.JOB_STATUS_SUCCEED_TTL
+    assert await redis.ttl(store.get_session_key('session')) == ConfigClass.DOWNLOAD_TOKEN_EXPIRE_AT * 60
+
+
+async def test_list_removes_expired_job_from_index(store):
+    await store.set(make_record(job_id='job_1'))
+    await store.set(make_record(job_id='job_2'))
+    await store.redis.REDIS.delete(store.get_job_key('session', 'job_1'))
+
+    assert [record['job_id'] for record in await store.list_by_session('session')] == ['job_2']
+    assert await store.redis.REDIS.smembers(store.get_session_key('session')) == {b'session:job_2'}
+
+
+async def test_apply_retention_purges_expired_keys_without_ttl(store):
+    redis = store.redis.REDIS
+    now = int(time.time())
+    expired_key = store.get_job_key('session', 'job_1')
+    active_key = store.get_job_key('session', 'job_2')
+    await redis.hset(expired_key, mapping=store.encode(make_record(status='SUCCEED', timestamp=str(now - 7200))))
+    await redis.hset(active_key, mapping=store.encode(make_record(job_id='job_2', status='SUCCEED')))
+    await redis.sadd(store.get_session_key('session'), 'session:job_2')
+
+    assert await store.apply_retention() == 1
+
+    assert await redis.exists(expired_key) == 0
+    assert 0 < await redis.ttl(active_key) <= 3600
+    assert await redis.ttl(store.get_session_key('session')) > 0
+
+
+async def test_apply_retention_runs_once_in_interval(store, mocker):
+    redis = store.redis.REDIS
+    now = int(time.time())
+    assert await store.apply_retention() == 0
+    await redis.hset(
+        store.get_job_key('session', 'job_1'),
+        mapping=store.encode(make_record(status='SUCCEED', timestamp=str(now - 7200))),
+    )
+    scan_iter = mocker.spy(redis, 'scan_iter')
+
+    assert await store.apply_retention() == 0
+
+    scan_iter.assert_not_called()
+    assert 0 < await redis.ttl(store.prefix + 'retention') <= ConfigClass.JOB_STATUS_RETENTION_INTERVAL
+
+
+async def test_mdelete_by_prefix_removes_all_matching_keys(store):
+    redis = store.redis.REDIS
+    for index in range(30):
+        await redis.set(f'prefix:{index}', 'value')
+    await redis.set('other:1', 'value')
+
+    assert await store.redis.mdelete_by_prefix('prefix', chunk_size=4) == 30
+    assert await redis.keys('*') == [b'other:1']
+
+
+async def test_get_status_returns_empty_list_when_job_does_not_match():
+    await set_status('session', 'job_1', 'file.zip', 'data_download', 'ZIPPING', 'any_code', 'me')
+
+    assert len(await get_status('session', 'job_1', 'any_code', 'data_download', 'me')) == 1
+    assert await get_status('session', 'job_1', 'other_code', 'data_download', 'me') == []
+    assert await get_status('session', 'job_1', 'any_code', 'data_download', 'other') == []
@@ -0,0 +1,102 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from app.commons.data_providers.job_status import JobStatusStore
+from app.commons.data_providers.job_status_cache import JobStatusCache
+from app.commons.data_providers.job_status_listener import JobStatusListener
+from tests.commons.data_providers.test_job_status import make_record
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def listener():
+    listener = JobStatusListener()
+    await listener.start()
+    yield listener
+    await listener.stop()
+
+
+@pytest.fixture
+def store():
+    yield JobStatusStore()
+
+
+@pytest.fixture
+def cache(store, listener):
+    yield JobStatusCache(store, listener)
+
+
+async def test_get_reads_redis_once(cache, store, mocker):
+    await store.set(make_record())
+    get = mocker.spy(store, 'get_response')
+
+    assert await cache.get('session', 'job_1') == make_record()
+    assert await cache.get('session', 'job_1') == make_record()
+    assert get.call_count == 1
+
+
+async def test_get_returns_published_status(cache, store, listener, mocker):
+    await store.set(make_record())
+    await cache.get('session', 'job_1')
+    get = mocker.spy(store, 'get_response')
+
+    async with listener.subscribe('session', 'job_1') as updates:
+        await store.set(make_record(status='READY_FOR_DOWNLOADING'))
+        await listener.wait(updates, timeout=5)
+
+    assert (await cache.get('session', 'job_1'))['status'] == 'READY_FOR_DOWNLOADING'
+    assert get.call_count == 0
+
+
+async def test_get_does_not_cache_status_changed_during_read(cache, store, listener):
+    await store.set(make_record())
+    read = store.get_response
+
+    async def get_and_update(session_id, job_id):
+        record = await read(session_id, job_id)
+        async with listener.subscribe(session_id, job_id) as updates:
+            await store.set(make_record(status='READY_FOR_DOWNLOADING'))
+            await listener.wait(updates, timeout=5)
+        return record
+
+    store.get_response = get_and_update
+    assert (await cache.get('session', 'job_1'))['status'] == 'ZIPPING'
+    store.get_response = read
+
+    assert (await cache.get('session', 'job_1'))['status'] == 'READY_FOR_DOWNLOADING'
+
+
+async def test_get_bypasses_cache_when_subscription_is_broken(cache, store, listener, mocker):
+    await store.set(make_record())
+    await cache.get('session', 'job_1')
+    get = mocker.spy(store, 'get_response')
+
+    await listener.stop()
+    await cache.get('session', 'job_1')
+    await cache.get('session', 'job_1')
+
+    assert get.call_count == 2
+
+
+async def test_get_returns_copy_of_cached_status(cache, store):
+    await store.set(make_record())
+    record = await cache.get('session', 'job_1')
+    record['status'] = 'CANCELLED'
+
+    assert (await cache.get('session', 'job_1'))['status'] == 'ZIPPING'
@@ -0,0 +1,59 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from app.commons.data_providers.job_status_listener import JobStatusListener
+from app.resources.helpers import set_status
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def listener():
+    listener = JobStatusListener()
+    yield listener
+    await listener.stop()
+
+
+async def test_subscribe_receives_status_of_job(listener):
+    async with listener.subscribe('session', 'job_1') as updates:
+        await set_status('session', 'job_2', 'file.zip', 'data_download', 'ZIPPING', 'any_code', 'me')
+        await set_status('session', 'job_1', 'file.zip', 'data_download', 'ZIPPING', 'any_code', 'me')
+
+        record = await listener.wait(updates, timeout=5)
+
+    assert record['job_id'] == 'job_1'
+    assert record['status'] == 'ZIPPING'
+    assert updates.empty()
+
+
+async def test_wait_returns_none_when_no_update(listener):
+    async with listener.subscribe('session', 'job_1') as updates:
+        assert await listener.wait(updates, timeout=0.1) is None
+
+
+async def test_concurrent_subscribers_share_one_subscription(listener):
+    async def _subscribe():
+        async with listener.subscribe('session', 'job_1'):
+            return listener._pubsub
+
+    first, second = await asyncio.gather(_subscribe(), _subscribe())
+
+    assert first is second
+    assert listener._waiters == {}
@@ -0,0 +1,173 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import os
+from datetime import datetime
+
+import pytest
+from fastavro import schema, schemaless_writer
+
+from app.commons.data_providers.metadata_cache import (
+    MetadataCache,
+    MetadataCacheInvalidator,
+)
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def cache():
+    yield MetadataCache()
+
+
+class FakeFetch:
+    def __init__(self, result, delay=0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.result
+
+
+async def test_get_returns_copy_of_cached_object_without_fetching_again(cache):
+    fetch = FakeFetch({'id': 'geid_1', 'name': 'file'})
+
+    first = await cache.get('item:geid_1', fetch)
+    first['name'] = 'changed'
+    second = await cache.get('item:geid_1', fetch)
+
+    assert fetch.calls == 1
+    assert second == {'id': 'geid_1', 'name': 'file'}
+
+
+async def test_get_reads_redis_when_process_cache_is_empty(cache):
+    fetch = FakeFetch({'id': 'geid_1'})
+    await cache.get('item:geid_1', fetch)
+    cache.clear()
+
+    result = await cache.get('item:geid_1', fetch)
+
+    assert fetch.calls == 1
+    assert result == {'id': 'geid_1'}
+
+
+async def test_lookup_many_reads_process_cache_and_redis_in_one_call(cache, mocker):
+    await cache.store_many({'item:geid_1': {'id': 'geid_1'}, 'item:geid_2': {'id': 'geid_2'}})
+    cache._pop_local('item:geid_2')
+    mget = mocker.spy(cache.redis, 'mget_by_keys')
+
+    result = await cache.lookup_many(['item:geid_1', 'item:geid_2', 'item:geid_3'])
+
+    assert result == {'item:geid_1': {'id': 'geid_1'}, 'item:geid_2': {'id': 'geid_2'}}
+    mget.assert_called_once_with(['metadata:v2:item:geid_2', 'metadata:v2:item:geid_3'])
+
+
+async def test_concurrent_get_with_same_key_are_coalesced(cache):
+    fetch = FakeFetch({'id': 'geid_1'}, delay=0.05)
+
+    results = await asyncio.gather(*[cache.get('item:geid_1', fetch) for _ in range(5)])
+
+    assert fetch.calls == 1
+    assert results == [{'id': 'geid_1'}] * 5
+
+
+async def test_concurrent_get_share_the_exception_of_fetch(cache):
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise ValueError('fail to fetch')
+
+    results = await asyncio.gather(*[cache.get('item:geid_1', fetch) for _ in range(3)], return_exceptions=True)
+
+    assert [str(result) for result in results] == ['fail to fetch'] * 3
+
+
+async def test_invalidate_removes_item_and_listings_of_container(cache):
+    item_fetch = FakeFetch({'id': 'geid_1'})
+    listing_fetch = FakeFetch({'result': [{'id': 'geid_1'}]})
+    await cache.get('item:geid_1', item_fetch)
+    await cache.get('items:listing', listing_fetch, container_code='any_code')
+
+    await cache.invalidate('geid_1', 'any_code')
+    await cache.get('item:geid_1', item_fetch)
+    await cache.get('items:listing', listing_fetch, container_code='any_code')
+
+    assert item_fetch.calls == 2
+    assert listing_fetch.calls == 2
+
+
+async def test_invalidate_removes_object_read_from_redis_by_its_container(cache):
+    fetch = FakeFetch(3)
+    await cache.get('count:folder', fetch, container_code='any_code')
+    # other process reads the count from redis
+    other_cache = MetadataCache()
+    await other_cache.get('count:folder', fetch)
+
+    await other_cache.invalidate(container_code='any_code')
+    await other_cache.get('count:folder', fetch)
+
+    assert fetch.calls == 2
+
+
+async def test_evicted_keys_are_removed_from_their_container(cache, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'METADATA_CACHE_LOCAL_BYTES', 1)
+    for index in range(5):
+        await cache.get(f'count:folder_{index}', FakeFetch(index), container_code=f'code_{index}')
+
+    assert set(cache._container_keys) == {'code_4'}
+    assert cache._container_keys['code_4'] == {'count:folder_4'}
+
+
+async def test_get_updates_hit_ratio_metric(cache):
+    fetch = FakeFetch({'id': 'geid_1'})
+
+    await cache.get('item:geid_1', fetch)
+    await cache.get('item:geid_1', fetch)
+
+    assert 0 < metrics.snapshot()['metadata_cache_hit_ratio'] < 1
+
+
+async def test_invalidator_invalidates_changed_item(cache):
+    fetch = FakeFetch({'id': '0b4a6c5e-2ad3-4b4c-8b36-4e7d0d2c1f11'})
+    await cache.get('item:0b4a6c5e-2ad3-4b4c-8b36-4e7d0d2c1f11', fetch)
+
+    activity = {
+        'item_id': '0b4a6c5e-2ad3-4b4c-8b36-4e7d0d2c1f11',
+        'item_name': 'file',
+        'item_type': 'file',
+        'item_parent_path': 'admin',
+        'container_code': 'any_code',
+        'container_type': 'project',
+        'zone': 0,
+        'user': 'me',
+        'imported_from': '',
+        'activity_type': 'update',
+        'activity_time': datetime.utcnow(),
+        'changes': [],
+    }
+    bio = io.BytesIO()
+    schemaless_writer(bio, schema.load_schema(os.path.join('app/commons', 'metadata_items_activity.avsc')), activity)
+
+    await MetadataCacheInvalidator(cache).handle_message(bio.getvalue())
+    await cache.get('item:0b4a6c5e-2ad3-4b4c-8b36-4e7d0d2c1f11', fetch)
+
+    assert fetch.calls == 2
@@ -0,0 +1,71 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from os import environ
+
+import pytest
+from redis.crc import key_slot
+
+from app.commons.data_providers.job_status import JobStatusStore
+from app.commons.data_providers.redis import SrvRedisSingleton, create_redis
+from app.config import ConfigClass
+from tests.commons.data_providers.test_job_status import make_record
+
+pytestmark = pytest.mark.asyncio
+
+# the tests of cluster mode run against the redis-cluster service of docker-compose
+REDIS_CLUSTER_PORT = environ.get('REDIS_CLUSTER_PORT')
+
+
+@pytest.fixture
+async def cluster_store(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'REDIS_CLUSTER', True)
+    monkeypatch.setattr(ConfigClass, 'REDIS_PORT', int(REDIS_CLUSTER_PORT))
+    store = JobStatusStore()
+    store.redis = SrvRedisSingleton()
+    store.redis.REDIS = create_redis()
+    await store.redis.REDIS.flushall()
+    yield store
+    await store.redis.REDIS.close()
+
+
+def test_keys_of_session_share_slot():
+    session_key = JobStatusStore.get_session_key('session')
+
+    assert key_slot(JobStatusStore.get_job_key('session', 'job_1').encode()) == key_slot(session_key.encode())
+    assert key_slot(JobStatusStore.get_job_key('session', 'job_2').encode()) == key_slot(session_key.encode())
+
+
+@pytest.mark.skipif(not REDIS_CLUSTER_PORT, reason='redis cluster is not available')
+async def test_job_status_works_in_cluster_mode(cluster_store):
+    await cluster_store.set(make_record(job_id='job_1'))
+    await cluster_store.set(make_record(session_id='other_session', job_id='job_2'))
+
+    assert await cluster_store.get('session', 'job_1') == make_record(job_id='job_1')
+    assert [record['job_id'] for record in await cluster_store.list_by_session('session')] == ['job_1']
+
+
+@pytest.mark.skipif(not REDIS_CLUSTER_PORT, reason='redis cluster is not available')
+async def test_multi_key_operations_work_across_slots_in_cluster_mode(cluster_store):
+    redis = cluster_store.redis
+    keys = [f'any_prefix:{index}' for index in range(10)]
+    for key in keys:
+        await redis.set_by_key(key, key)
+
+    assert await redis.mget_by_keys(keys) == [key.encode() for key in keys]
+    assert await redis.get_keyspace_size() == 10
+    assert await redis.mdelete_by_prefix('any_prefix') == 10
+    assert await redis.get_keyspace_size() == 0
@@ -17,8 +17,11 @@
 import pytest
 
 from app.commons.download_manager.dataset_download_manager import (
+    DatasetDownloadClient,
     create_dataset_download_client,
 )
+from app.commons.download_manager.manifest import ManifestEntry
+from app.config import ConfigClass
 
 pytestmark = pytest.mark.asyncio
 
@@ -28,7 +31,7 @@ async def test_download_client_without_files(httpx_mock, mock_boto3, mock_kafka_
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=any_code'
         '&container_type=dataset&zone=1&recursive=true&archived=false&parent_'
-        'path=&owner=me&type=file',
+        'path=&owner=me&type=file&page=0&page_size=1000',
         json={'result': []},
     )
 
@@ -44,12 +47,35 @@ async def test_download_client_without_files(httpx_mock, mock_boto3, mock_kafka_
     assert len(download_client.files_to_zip) == 0
 
 
+async def test_download_client_is_closed_when_listing_fails(httpx_mock, mock_boto3_clients, mocker):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/search/?container_code=any_code'
+        '&container_type=dataset&zone=1&recursive=true&archived=false&parent_'
+        'path=&owner=me&type=file&page=0&page_size=1000',
+        status_code=500,
+    )
+    close = mocker.patch.object(DatasetDownloadClient, 'close')
+
+    with pytest.raises(Exception, match='Error when query the folder tree'):
+        await create_dataset_download_client(
+            boto3_clients=mock_boto3_clients,
+            operator='me',
+            container_code='any_code',
+            container_id='fake_id',
+            container_type='project',
+            session_id='1234',
+        )
+
+    close.assert_called_once_with()
+
+
 async def test_download_client_add_file(httpx_mock, mock_boto3, mock_kafka_producer, mock_boto3_clients):
     httpx_mock.add_response(
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=any_code'
         '&container_type=dataset&zone=1&recursive=true&archived=false&parent_'
-        'path=&owner=me&type=file',
+        'path=&owner=me&type=file&page=0&page_size=1000',
         json={
             'result': [
                 {
@@ -77,7 +103,7 @@ async def test_download_client_add_file(httpx_mock, mock_boto3, mock_kafka_produ
     )
 
     assert len(download_client.files_to_zip) == 1
-    assert download_client.files_to_zip[0].get('id') == 'geid_1'
+    assert (await download_client.files_to_zip.get(0)).id == 'geid_1'
 
 
 async def test_download_dataset_add_schemas(httpx_mock, mock_boto3, mock_kafka_producer, mock_boto3_clients):
@@ -85,7 +111,7 @@ async def test_download_dataset_add_schemas(httpx_mock, mock_boto3, mock_kafka_p
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=any_code'
         '&container_type=dataset&zone=1&recursive=true&archived=false&parent_'
-        'path=&owner=me&type=file',
+        'path=&owner=me&type=file&page=0&page_size=1000',
         json={'result': []},
     )
 
@@ -113,3 +139,22 @@ async def test_download_dataset_add_schemas(httpx_mock, mock_boto3, mock_kafka_p
     )
 
     await download_client.add_schemas('test_id')
+
+
+@pytest.mark.parametrize('skip_lock,lock_calls', [(True, 0), (False, 2)])
+async def test_dataset_files_are_downloaded_without_lock(
+    mocker, monkeypatch, mock_boto3_clients, skip_lock, lock_calls
+):
+    monkeypatch.setattr(ConfigClass, 'LOCK_SKIP_DATASET_FILES', skip_lock)
+    bulk_lock = mocker.patch('app.commons.locks.bulk_lock_operation')
+    download = mocker.patch.object(mock_boto3_clients['boto3_internal'], 'downlaod_object')
+    download_client = DatasetDownloadClient('me', 'any_code', 'fake_id', 'dataset', '1234')
+    await download_client._set_connection(mock_boto3_clients['boto3_internal'])
+    await download_client.files_to_zip.add(
+        ManifestEntry('geid_1', 'file_1', 'admin', 'any_code', 1, 'http://anything.com/bucket/file_1')
+    )
+
+    await download_client._file_download_worker('hash_code')
+
+    assert download.call_count == 1
+    assert bulk_lock.call_count == lock_calls
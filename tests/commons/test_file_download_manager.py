@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 from unittest import mock
 
 import minio
@@ -23,8 +24,12 @@ from app.commons.download_manager.file_download_manager import (
     FileDownloadClient,
     create_file_download_client,
 )
+from app.commons.download_manager.manifest import ManifestEntry
+from app.commons.locks import ResourceAlreadyInUsed
+from app.config import ConfigClass
 from app.models.models_data_download import EDataDownloadStatus
 from app.resources.error_handler import APIException
+from app.resources.helpers import ResourceNotFound, get_status
 
 pytestmark = pytest.mark.asyncio
 
@@ -70,7 +75,299 @@ async def test_download_client_add_file(httpx_mock, mock_boto3_clients):
     )
 
     assert len(download_client.files_to_zip) == 1
-    assert download_client.files_to_zip[0].get('id') == 'geid_1'
+    assert (await download_client.files_to_zip.get(0)).id == 'geid_1'
+
+
+async def test_download_client_add_files_by_batch(httpx_mock, mock_boto3_clients):
+    files = [
+        {
+            'storage': {'location_uri': f'http://anything.com/bucket/obj/file_{index}'},
+            'id': f'geid_{index}',
+            'parent_path': 'admin',
+            'type': 'file',
+            'container_code': 'any_code',
+            'zone': 0,
+            'name': f'file_{index}',
+        }
+        for index in range(3)
+    ]
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/batch/?ids=geid_2&ids=geid_0&ids=geid_1',
+        json={'result': files},
+    )
+
+    download_client = await create_file_download_client(
+        files=[{'id': 'geid_2'}, {'id': 'geid_0'}, {'id': 'geid_1'}],
+        boto3_clients=mock_boto3_clients,
+        operator='me',
+        container_code='any_code',
+        container_type='project',
+        session_id='1234',
+    )
+
+    assert [file.id async for file in download_client.files_to_zip] == ['geid_2', 'geid_0', 'geid_1']
+    assert download_client.total_files == 3
+
+
+async def test_download_client_add_files_by_batch_raise_not_found_when_item_missing(httpx_mock, mock_boto3_clients):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/batch/?ids=geid_0&ids=geid_1',
+        json={'result': [{'id': 'geid_0', 'type': 'file'}]},
+    )
+
+    with pytest.raises(ResourceNotFound, match='resource geid_1 does not exist'):
+        await create_file_download_client(
+            files=[{'id': 'geid_0'}, {'id': 'geid_1'}],
+            boto3_clients=mock_boto3_clients,
+            operator='me',
+            container_code='any_code',
+            container_type='project',
+            session_id='1234',
+        )
+
+
+async def test_download_client_list_folder_all_pages_while_downloading(
+    httpx_mock, mock_boto3, mock_kafka_producer, mock_boto3_clients, monkeypatch, mocker
+):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'METADATA_PAGE_SIZE', 2)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/folder_geid/',
+        json={
+            'result': {
+                'id': 'folder_geid',
+                'type': 'folder',
+                'owner': 'me',
+                'parent_path': None,
+                'container_code': 'any_code',
+                'zone': 0,
+                'name': 'folder',
+            }
+        },
+    )
+    files = [
+        {
+            'storage': {'location_uri': f'http://anything.com/bucket/folder/file_{index}'},
+            'id': f'geid_{index}',
+            'parent_path': 'folder',
+            'type': 'file',
+            'container_code': 'any_code',
+            'zone': 0,
+            'name': f'file_{index}',
+        }
+        for index in range(3)
+    ]
+    search_url = (
+        'http://metadata_service/v1/items/search/?container_code=any_code&container_type=project'
+        '&zone=0&recursive=true&archived=false&parent_path=folder&owner=me&type=file'
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url=search_url + '&page=0&page_size=2',
+        json={'result': files[:2], 'num_of_pages': 2},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url=search_url + '&page=1&page_size=2',
+        json={'result': files[2:], 'num_of_pages': 2},
+    )
+
+    httpx_mock.add_response(method='POST', url='http://dataops_service/v2/resource/lock/bulk', json={}, status_code=200)
+    httpx_mock.add_response(
+        method='DELETE', url='http://dataops_service/v2/resource/lock/bulk', json={}, status_code=200
+    )
+    mocker.patch('app.commons.download_manager.file_download_manager.FileDownloadClient._zip_worker', return_value={})
+
+    download_client = await create_file_download_client(
+        files=[{'id': 'folder_geid'}],
+        boto3_clients=mock_boto3_clients,
+        operator='me',
+        container_code='any_code',
+        container_type='project',
+        session_id='1234',
+    )
+
+    # only the first file is fetched before the background job
+    assert [file.id async for file in download_client.files_to_zip] == ['geid_0']
+    assert download_client.folder_download is True
+    assert download_client.total_files is None
+
+    with mock.patch.object(FileDownloadClient, 'set_status') as fake_set:
+        await download_client.background_worker('fake_hash')
+
+    assert [file.location async for file in download_client.files_to_zip] == [
+        f'http://anything.com/bucket/folder/file_{index}' for index in range(3)
+    ]
+    assert download_client.total_files == 3
+    fake_set.assert_any_call(EDataDownloadStatus.ZIPPING, payload={'hash_code': 'fake_hash'})
+    fake_set.assert_called_with(EDataDownloadStatus.READY_FOR_DOWNLOADING, payload={'hash_code': 'fake_hash'})
+
+
+async def test_download_client_close_stops_prefetched_listing(mocker):
+    stopped = []
+
+    async def _list_folder(folder):
+        try:
+            yield ManifestEntry(folder['id'] + '_file', 'file', 'admin', 'any_code', 0, 'http://anything.com/b/file')
+            await asyncio.sleep(10)
+        finally:
+            stopped.append(folder['id'])
+
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    download_client.folders_to_list = [{'id': 'folder_1'}, {'id': 'folder_2'}]
+    mocker.patch.object(download_client, '_list_folder', _list_folder)
+    await download_client._prefetch_folder_file()
+
+    await download_client.close()
+    await asyncio.sleep(0)
+
+    assert sorted(stopped) == ['folder_1', 'folder_2']
+    assert download_client.folder_files is None
+
+
+async def test_create_download_client_closes_client_when_preparing_fails(mocker, mock_boto3_clients):
+    mocker.patch.object(FileDownloadClient, 'add_files_to_list', side_effect=ResourceNotFound('geid_1'))
+    close = mocker.patch.object(FileDownloadClient, 'close')
+
+    with pytest.raises(ResourceNotFound):
+        await create_file_download_client(
+            files=[{'id': 'geid_1'}],
+            boto3_clients=mock_boto3_clients,
+            operator='me',
+            container_code='any_code',
+            container_type='project',
+            session_id='1234',
+        )
+
+    close.assert_called_once_with()
+
+
+async def test_download_client_with_empty_folder_should_raise_exception(httpx_mock, mock_boto3_clients):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/folder_geid/',
+        json={
+            'result': {
+                'id': 'folder_geid',
+                'type': 'folder',
+                'owner': 'me',
+                'parent_path': None,
+                'container_code': 'any_code',
+                'zone': 0,
+                'name': 'folder',
+            }
+        },
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/search/?container_code=any_code&container_type=project'
+        '&zone=0&recursive=true&archived=false&parent_path=folder&owner=me&type=file&page=0&page_size=1000',
+        json={'result': []},
+    )
+
+    with pytest.raises(APIException):
+        await create_file_download_client(
+            files=[{'id': 'folder_geid'}],
+            boto3_clients=mock_boto3_clients,
+            operator='me',
+            container_code='any_code',
+            container_type='project',
+            session_id='1234',
+        )
+
+
+def mock_approval_folder(httpx_mock, total):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/folder_geid/',
+        json={
+            'result': {
+                'id': 'folder_geid',
+                'type': 'folder',
+                'owner': 'me',
+                'parent_path': None,
+                'container_code': 'any_code',
+                'zone': 0,
+                'name': 'folder',
+            }
+        },
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/search/?container_code=any_code&container_type=project'
+        '&zone=0&recursive=true&archived=false&parent_path=folder&owner=me&type=file&page=0&page_size=1',
+        json={'result': [], 'total': total},
+    )
+
+
+def make_approval_file(_id, parent_path, owner='me'):
+    return {
+        'storage': {'location_uri': f'http://anything.com/bucket/{parent_path}/{_id}'},
+        'id': _id,
+        'owner': owner,
+        'parent_path': parent_path,
+        'type': 'file',
+        'container_code': 'any_code',
+        'zone': 0,
+        'name': _id,
+    }
+
+
+async def test_download_client_fetch_approved_files_by_ids_when_folder_is_large(httpx_mock, mock_boto3_clients):
+    mock_approval_folder(httpx_mock, total=1000)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/batch/?ids=geid_0&ids=geid_1&ids=geid_2',
+        json={
+            'result': [
+                make_approval_file('geid_0', 'folder.sub'),
+                make_approval_file('geid_1', 'other_folder'),
+            ]
+        },
+    )
+
+    download_client = await create_file_download_client(
+        files=[{'id': 'folder_geid'}],
+        boto3_clients=mock_boto3_clients,
+        operator='me',
+        container_code='any_code',
+        container_type='project',
+        session_id='1234',
+        file_geids_to_include={'geid_0', 'geid_1', 'geid_2'},
+    )
+
+    assert [file.id async for file in download_client.files_to_zip] == ['geid_0']
+    assert download_client.folders_to_list == []
+    assert download_client.folder_download is True
+    assert download_client.total_files == 1
+
+
+async def test_download_client_list_folder_when_most_files_are_approved(httpx_mock, mock_boto3_clients):
+    mock_approval_folder(httpx_mock, total=2)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/search/?container_code=any_code&container_type=project'
+        '&zone=0&recursive=true&archived=false&parent_path=folder&owner=me&type=file&page=0&page_size=1000',
+        json={'result': [make_approval_file('geid_0', 'folder'), make_approval_file('geid_1', 'folder')]},
+    )
+
+    download_client = await create_file_download_client(
+        files=[{'id': 'folder_geid'}],
+        boto3_clients=mock_boto3_clients,
+        operator='me',
+        container_code='any_code',
+        container_type='project',
+        session_id='1234',
+        file_geids_to_include={'geid_1'},
+    )
+
+    assert [file.id async for file in download_client.files_to_zip] == ['geid_1']
+    assert len(download_client.folders_to_list) == 1
+    await download_client.folder_files.aclose()
 
 
 async def test_zip_worker_set_status_READY_FOR_DOWNLOADING_when_success(
@@ -241,3 +538,153 @@ async def test_zip_worker_raise_exception_when_minio_return_error(
         assert str(e) == result['payload']['error_msg']
 
     fake_set.assert_called_once_with(result['status'], payload=result['payload'])
+
+
+async def test_file_download_worker_stops_listing_before_setting_status_cancelled(mocker):
+    statuses = []
+
+    async def _set_status(status, payload):
+        statuses.append(status)
+        # the status write waits for the window of job status writer
+        await asyncio.sleep(0.1)
+
+    async def _list_worker(queue, hash_code):
+        await asyncio.sleep(0.05)
+        await download_client.set_status(EDataDownloadStatus.ZIPPING, payload={'hash_code': hash_code})
+
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    mocker.patch.object(download_client, 'set_status', _set_status)
+    mocker.patch.object(download_client, '_list_worker', _list_worker)
+    mocker.patch.object(download_client, '_transfer_worker', side_effect=Exception('transfer failed'))
+
+    with pytest.raises(Exception, match='transfer failed'):
+        await download_client._file_download_worker('fake_hash')
+    await asyncio.sleep(0.1)
+
+    assert statuses == [EDataDownloadStatus.CANCELLED]
+
+
+async def test_file_download_worker_retrieves_listing_error_when_both_stages_fail(mocker):
+    listing_failed = asyncio.Event()
+
+    async def _list_worker(queue, hash_code):
+        listing_failed.set()
+        raise Exception('listing failed')
+
+    async def _transfer_worker(queue):
+        await listing_failed.wait()
+        await asyncio.sleep(0)
+        raise Exception('transfer failed')
+
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    set_status = mocker.patch.object(download_client, 'set_status')
+    mocker.patch.object(download_client, '_list_worker', _list_worker)
+    mocker.patch.object(download_client, '_transfer_worker', _transfer_worker)
+    logger = mocker.spy(download_client.logger, 'error')
+
+    with pytest.raises(Exception, match='transfer failed'):
+        await download_client._file_download_worker('fake_hash')
+
+    logger.assert_any_call('Error in listing stage: listing failed')
+    set_status.assert_called_once_with(EDataDownloadStatus.CANCELLED, payload={'error_msg': 'transfer failed'})
+
+
+async def test_download_clients_created_in_same_second_keep_their_own_status(mocker):
+    mocker.patch('app.commons.download_manager.file_download_manager.time.time', return_value=1660000000.5)
+    first_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    second_client = FileDownloadClient('me', 'other_code', 'project', '1234')
+
+    await first_client.set_status(EDataDownloadStatus.ZIPPING, payload={})
+    await second_client.set_status(EDataDownloadStatus.CANCELLED, payload={})
+
+    assert first_client.job_id != second_client.job_id
+    [first_status] = await get_status('1234', first_client.job_id, 'any_code', 'data_download', 'me')
+    [second_status] = await get_status('1234', second_client.job_id, 'other_code', 'data_download', 'me')
+    assert first_status['status'] == 'ZIPPING'
+    assert second_status['status'] == 'CANCELLED'
+
+
+async def test_lock_files_locks_chunks_concurrently(mocker, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'LOCK_CHUNK_SIZE', 2)
+    bulk_lock = mocker.patch('app.commons.locks.bulk_lock_operation')
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+
+    await download_client._lock_files(['a', 'b', 'c'])
+
+    assert bulk_lock.call_args_list == [mock.call(['a', 'b'], 'read'), mock.call(['c'], 'read')]
+    assert download_client.locked_keys == {'a', 'b', 'c'}
+
+
+async def test_lock_files_releases_locked_keys_when_other_key_fails(mocker, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'LOCK_CHUNK_SIZE', 2)
+
+    async def fake_lock(lock_keys, operation, lock=True):
+        if lock and 'c' in lock_keys:
+            raise ResourceAlreadyInUsed('resource already in used')
+
+    bulk_lock = mocker.patch('app.commons.locks.bulk_lock_operation', side_effect=fake_lock)
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+
+    with pytest.raises(ResourceAlreadyInUsed):
+        await download_client._lock_files(['a', 'b', 'c'])
+
+    assert download_client.locked_keys == set()
+    assert bulk_lock.call_args_list[-1] == mock.call(['a', 'b'], 'read', lock=False)
+
+
+async def test_transfer_worker_unlocks_each_file_once_downloaded(mocker, mock_boto3_clients):
+    bulk_lock = mocker.patch('app.commons.locks.bulk_lock_operation')
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    download_client.boto3_client = mock_boto3_clients['boto3_internal']
+    locked_when_downloading = []
+
+    async def fake_download(bucket, obj_path, local_path):
+        locked_when_downloading.append(sorted(download_client.locked_keys))
+        await asyncio.sleep(0)
+
+    mocker.patch.object(download_client.boto3_client, 'downlaod_object', side_effect=fake_download)
+    queue = asyncio.Queue()
+    for index in range(2):
+        queue.put_nowait(
+            ManifestEntry(
+                f'geid_{index}', f'file_{index}', 'admin', 'code', 0, f'http://anything.com/bucket/file_{index}'
+            )
+        )
+    queue.put_nowait(None)
+
+    await download_client._transfer_worker(queue)
+    await download_client._unlock_files()
+
+    assert locked_when_downloading == [
+        ['gr-code/admin/file_0', 'gr-code/admin/file_1'],
+        ['gr-code/admin/file_1'],
+    ]
+    unlocked = [key for call in bulk_lock.call_args_list if call.kwargs.get('lock') is False for key in call.args[0]]
+    assert unlocked == ['gr-code/admin/file_0', 'gr-code/admin/file_1']
+    assert download_client.locked_keys == set()
+
+
+async def test_transfer_worker_locks_selected_folders_as_whole(mocker, monkeypatch, mock_boto3_clients):
+    monkeypatch.setattr(ConfigClass, 'LOCK_FOLDER_PREFIX', True)
+    bulk_lock = mocker.patch('app.commons.locks.bulk_lock_operation')
+    mocker.patch.object(mock_boto3_clients['boto3_internal'], 'downlaod_object')
+    download_client = FileDownloadClient('me', 'any_code', 'project', '1234')
+    download_client.boto3_client = mock_boto3_clients['boto3_internal']
+    download_client.folders_to_list = [
+        {'id': 'folder_1', 'type': 'folder', 'parent_path': 'admin', 'name': 'folder', 'container_code': 'code'},
+    ]
+    queue = asyncio.Queue()
+    queue.put_nowait(ManifestEntry('geid_1', 'file_1', 'admin.folder.sub', 'code', 0, 'http://anything.com/b/file_1'))
+    queue.put_nowait(ManifestEntry('geid_2', 'file_2', 'admin', 'code', 0, 'http://anything.com/b/file_2'))
+    queue.put_nowait(None)
+
+    await download_client._lock_folders()
+    await download_client._transfer_worker(queue)
+    await download_client._unlock_files()
+
+    assert bulk_lock.call_args_list == [
+        mock.call(['gr-code/admin.folder'], 'read'),
+        mock.call(['gr-code/admin/file_2'], 'read'),
+        mock.call(['gr-code/admin/file_2'], 'read', lock=False),
+        mock.call(['gr-code/admin.folder'], 'read', lock=False),
+    ]
@@ -0,0 +1,179 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import os
+from datetime import datetime
+
+import pytest
+from fastavro import schema, schemaless_reader, schemaless_writer
+
+from app.commons.kafka_producer import ActivityLogBufferFull, KakfaProducer
+from app.commons.metrics import metrics
+from app.config import ConfigClass
+
+pytestmark = pytest.mark.asyncio
+
+SCHEMA_NAME = 'dataset.activity.avsc'
+
+
+class FakeKafkaProducer:
+    def __init__(self) -> None:
+        self.sent = []
+        self.delivered = asyncio.Event()
+
+        self.stopped = False
+
+    async def send(self, topic: str, value: bytes) -> asyncio.Future:
+        self.sent.append((topic, value))
+        return asyncio.ensure_future(self.delivered.wait())
+
+    async def stop(self) -> None:
+        self.stopped = True
+
+
+@pytest.fixture
+def producer():
+    producer = KakfaProducer()
+    producer.producer = FakeKafkaProducer()
+    producer.connected = True
+    yield producer
+    if producer.flush_task is not None:
+        producer.flush_task.cancel()
+
+
+def get_message(target_name: str) -> dict:
+    return {
+        'activity_type': 'download',
+        'activity_time': datetime(2022, 1, 1),
+        'container_code': 'any_code',
+        'version': None,
+        'target_name': target_name,
+        'user': 'me',
+        'changes': [],
+    }
+
+
+async def test_validate_message_encodes_same_bytes_as_schema_file():
+    producer = KakfaProducer()
+    message = get_message('file.zip')
+    expected = io.BytesIO()
+    schemaless_writer(expected, schema.load_schema(os.path.join('app/commons', SCHEMA_NAME)), message)
+
+    assert await producer._validate_message(SCHEMA_NAME, message) == expected.getvalue()
+
+
+async def test_validate_message_reuses_serializer_and_buffer(mocker):
+    producer = KakfaProducer()
+    producer.load_schemas()
+    load_schema = mocker.spy(schema, 'load_schema')
+
+    long_message = await producer._validate_message(SCHEMA_NAME, get_message('x' * 100))
+    short_message = await producer._validate_message(SCHEMA_NAME, get_message('y'))
+
+    assert load_schema.call_count == 0
+    parsed_schema = producer.serializers[SCHEMA_NAME].schema
+    assert schemaless_reader(io.BytesIO(long_message), parsed_schema)['target_name'] == 'x' * 100
+    assert schemaless_reader(io.BytesIO(short_message), parsed_schema)['target_name'] == 'y'
+
+
+async def test_load_schemas_prepares_all_schema_files():
+    producer = KakfaProducer()
+
+    producer.load_schemas()
+
+    assert sorted(producer.serializers) == ['dataset.activity.avsc', 'metadata_items_activity.avsc']
+
+
+async def test_create_activity_log_does_not_wait_for_broker(producer):
+    await asyncio.wait_for(producer.create_activity_log(get_message('file.zip'), SCHEMA_NAME, 'topic'), 1)
+    await asyncio.sleep(0)
+
+    assert producer.producer.sent == [('topic', await producer._validate_message(SCHEMA_NAME, get_message('file.zip')))]
+    assert producer.flush_task is not None
+
+
+async def test_buffered_messages_are_sent_in_batches(producer, monkeypatch, mocker):
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BATCH_SIZE', 2)
+    send_batch = mocker.spy(producer, '_send_batch')
+    sent = metrics.snapshot()['activity_log_sent']
+    producer.producer.delivered.set()
+
+    for index in range(3):
+        await producer.create_activity_log(get_message(f'file_{index}.zip'), SCHEMA_NAME, 'topic')
+    await producer.flush_task
+
+    assert [len(call.args[0]) for call in send_batch.call_args_list] == [2, 1]
+    assert metrics.snapshot()['activity_log_sent'] == sent + 3
+    assert producer.flush_task is None
+
+
+async def test_create_activity_log_waits_for_space_when_buffer_is_full(producer, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BUFFER_SIZE', 1)
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BATCH_SIZE', 1)
+    dropped = metrics.snapshot()['activity_log_dropped']
+
+    await producer.create_activity_log(get_message('file_1.zip'), SCHEMA_NAME, 'topic')
+    await producer.create_activity_log(get_message('file_2.zip'), SCHEMA_NAME, 'topic')
+    pending = asyncio.ensure_future(producer.create_activity_log(get_message('file_3.zip'), SCHEMA_NAME, 'topic'))
+    await asyncio.sleep(0)
+    assert pending.done() is False
+
+    producer.producer.delivered.set()
+    await asyncio.wait_for(pending, 1)
+    await producer.flush_task
+
+    assert len(producer.producer.sent) == 3
+    assert metrics.snapshot()['activity_log_dropped'] == dropped
+
+
+async def test_create_activity_log_raises_when_buffer_stays_full(producer, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BUFFER_SIZE', 1)
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BATCH_SIZE', 1)
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BUFFER_TIMEOUT', 0.01)
+    dropped = metrics.snapshot()['activity_log_dropped']
+
+    await producer.create_activity_log(get_message('file_1.zip'), SCHEMA_NAME, 'topic')
+    await producer.create_activity_log(get_message('file_2.zip'), SCHEMA_NAME, 'topic')
+    with pytest.raises(ActivityLogBufferFull):
+        await producer.create_activity_log(get_message('file_3.zip'), SCHEMA_NAME, 'topic')
+
+    assert producer.buffer.qsize() == 1
+    assert metrics.snapshot()['activity_log_dropped'] == dropped + 1
+
+
+async def test_message_is_dropped_when_buffer_is_full_and_drop_is_enabled(producer, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_BUFFER_SIZE', 1)
+    monkeypatch.setattr(ConfigClass, 'ACTIVITY_LOG_DROP_WHEN_FULL', True)
+    dropped = metrics.snapshot()['activity_log_dropped']
+
+    await producer.create_activity_log(get_message('file_1.zip'), SCHEMA_NAME, 'topic')
+    await producer.create_activity_log(get_message('file_2.zip'), SCHEMA_NAME, 'topic')
+
+    assert producer.buffer.qsize() == 1
+    assert metrics.snapshot()['activity_log_dropped'] == dropped + 1
+
+
+async def test_close_connection_sends_buffered_messages(producer):
+    producer.producer.delivered.set()
+    await producer.create_activity_log(get_message('file.zip'), SCHEMA_NAME, 'topic')
+
+    await producer.close_connection()
+
+    assert len(producer.producer.sent) == 1
+    assert producer.flush_task is None
+    assert producer.producer.stopped is True
@@ -0,0 +1,72 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.commons.locks import ReadLockManager, ResourceAlreadyInUsed
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def manager():
+    yield ReadLockManager()
+
+
+@pytest.fixture
+def bulk_lock(mocker):
+    yield mocker.patch('app.commons.locks.bulk_lock_operation')
+
+
+async def test_lock_requests_in_window_are_sent_together(manager, bulk_lock):
+    await asyncio.gather(manager.lock(['a', 'b']), manager.lock(['b', 'c']))
+
+    assert bulk_lock.call_args_list == [mock.call(['a', 'b', 'c'], 'read')]
+
+
+async def test_key_is_unlocked_by_last_holder(manager, bulk_lock):
+    await manager.lock(['a'])
+    await manager.lock(['a'])
+
+    await manager.unlock(['a'])
+    assert bulk_lock.call_count == 1
+
+    await manager.unlock(['a'])
+    assert bulk_lock.call_args_list == [mock.call(['a'], 'read'), mock.call(['a'], 'read', lock=False)]
+
+
+async def test_unlock_is_skipped_when_key_is_locked_again(manager, bulk_lock):
+    await manager.lock(['a'])
+
+    await asyncio.gather(manager.unlock(['a']), manager.lock(['a']))
+
+    assert bulk_lock.call_args_list == [mock.call(['a'], 'read')]
+
+
+async def test_key_in_use_does_not_fail_other_keys_in_same_request(manager, mocker):
+    async def fake_lock(lock_keys, operation, lock=True):
+        if 'b' in lock_keys:
+            raise ResourceAlreadyInUsed('resource already in used')
+
+    mocker.patch('app.commons.locks.bulk_lock_operation', side_effect=fake_lock)
+
+    results = await asyncio.gather(manager.lock(['a']), manager.lock(['b']), return_exceptions=True)
+
+    assert results[0] is None
+    assert isinstance(results[1], ResourceAlreadyInUsed)
@@ -0,0 +1,182 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from app.commons.download_manager.manifest import (
+    DownloadManifest,
+    ManifestEntry,
+    PathTrie,
+    remove_nested_selections,
+)
+from app.config import ConfigClass
+
+
+def make_item(_id, item_type, parent_path, name, owner='me'):
+    return {
+        'id': _id,
+        'type': item_type,
+        'parent_path': parent_path,
+        'name': name,
+        'owner': owner,
+        'container_code': 'any_code',
+        'zone': 0,
+        'storage': {'location_uri': f'http://anything.com/bucket/{parent_path}/{name}'},
+    }
+
+
+class TestManifestEntry:
+    def test_entry_keeps_location_and_shares_prefix(self):
+        first = ManifestEntry.from_item(make_item('geid_1', 'file', 'admin', 'file_1'))
+        second = ManifestEntry.from_item(make_item('geid_2', 'file', 'admin', 'file_2'))
+
+        assert first.location == 'http://anything.com/bucket/admin/file_1'
+        assert first.location_name is None
+        assert first.location_prefix is second.location_prefix
+        assert first.parent_path is second.parent_path
+
+    def test_entry_keeps_object_name_different_from_item_name(self):
+        item = make_item('geid_1', 'file', 'admin', 'file_1')
+        item['storage']['location_uri'] = 'http://anything.com/bucket/admin/file_1_1660000000'
+
+        entry = ManifestEntry.from_item(item)
+
+        assert entry.location == 'http://anything.com/bucket/admin/file_1_1660000000'
+        assert entry.name == 'file_1'
+
+
+@pytest.mark.asyncio
+class TestDownloadManifest:
+    async def test_add_collapses_duplicated_file(self):
+        manifest = DownloadManifest()
+        file = make_item('geid_1', 'file', 'admin', 'file_1')
+
+        assert await manifest.add(ManifestEntry.from_item(file)) is True
+        assert await manifest.add(ManifestEntry.from_item(file)) is False
+        assert len(manifest) == 1
+
+    async def test_manifest_keeps_the_order_of_files(self):
+        manifest = DownloadManifest()
+        for index in range(3):
+            await manifest.add(ManifestEntry.from_item(make_item(f'geid_{index}', 'file', 'admin', f'file_{index}')))
+
+        assert [entry.id async for entry in manifest] == ['geid_0', 'geid_1', 'geid_2']
+        assert (await manifest.get(0)).id == 'geid_0'
+        assert (await manifest.get(-1)).id == 'geid_2'
+
+    async def test_manifest_spills_to_disk_over_threshold(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'MANIFEST_SPILL_THRESHOLD', 2)
+        spill_path = str(tmp_path / 'job.manifest')
+        manifest = DownloadManifest(spill_path=spill_path)
+        for index in range(4):
+            await manifest.add(ManifestEntry.from_item(make_item(f'geid_{index}', 'file', 'admin', f'file_{index}')))
+
+        assert manifest.spilled is True
+        assert manifest.memory_usage == 0
+        assert os.path.exists(spill_path)
+        assert await manifest.add(ManifestEntry.from_item(make_item('geid_1', 'file', 'admin', 'file_1'))) is False
+        assert len(manifest) == 4
+        assert [entry.location async for entry in manifest] == [
+            f'http://anything.com/bucket/admin/file_{index}' for index in range(4)
+        ]
+        assert (await manifest.get(2)).id == 'geid_2'
+
+        await manifest.close()
+
+        assert not os.path.exists(spill_path)
+        assert len(manifest) == 4
+        assert (await manifest.get(0)).id == 'geid_0'
+
+    async def test_manifest_spills_to_disk_over_memory_limit(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'MANIFEST_MEMORY_LIMIT', 1)
+        manifest = DownloadManifest(spill_path=str(tmp_path / 'job.manifest'))
+        await manifest.add(ManifestEntry.from_item(make_item('geid_0', 'file', 'admin', 'file_0')))
+
+        assert manifest.spilled is True
+        await manifest.close()
+
+    async def test_manifest_accesses_spill_file_off_event_loop(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'MANIFEST_SPILL_THRESHOLD', 0)
+        threads = []
+        connect = sqlite3.connect
+
+        def _connect(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return connect(*args, **kwargs)
+
+        monkeypatch.setattr(sqlite3, 'connect', _connect)
+        spill_path = str(tmp_path / 'job.manifest')
+        manifest = DownloadManifest(spill_path=spill_path)
+        await manifest.add(ManifestEntry.from_item(make_item('geid_0', 'file', 'admin', 'file_0')))
+
+        assert manifest.spilled is True
+        assert threads and threading.get_ident() not in threads
+
+        await manifest.close()
+
+        assert not os.path.exists(spill_path)
+
+    async def test_manifest_without_spill_path_stays_in_memory(self, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'MANIFEST_SPILL_THRESHOLD', 0)
+        manifest = DownloadManifest()
+        await manifest.add(ManifestEntry.from_item(make_item('geid_0', 'file', 'admin', 'file_0')))
+
+        assert manifest.spilled is False
+        assert manifest.memory_usage > 0
+
+
+class TestRemoveNestedSelections:
+    def test_selections_under_selected_folder_are_removed(self):
+        folder = make_item('folder_1', 'folder', 'admin', 'folder_1')
+        sub_folder = make_item('folder_2', 'folder', 'admin.folder_1', 'folder_2')
+        nested_file = make_item('geid_1', 'file', 'admin.folder_1.folder_2', 'file_1')
+        other_file = make_item('geid_2', 'file', 'admin', 'file_2')
+
+        result = remove_nested_selections([nested_file, sub_folder, folder, other_file, folder])
+
+        assert [item['id'] for item in result] == ['folder_1', 'geid_2']
+
+    def test_selections_of_other_owner_are_kept(self):
+        folder = make_item('folder_1', 'folder', None, 'folder_1')
+        file = make_item('geid_1', 'file', 'folder_1', 'file_1', owner='other')
+
+        result = remove_nested_selections([folder, file])
+
+        assert [item['id'] for item in result] == ['folder_1', 'geid_1']
+
+
+class TestPathTrie:
+    def test_prefixes_are_reduced_to_covering_ones(self):
+        trie = PathTrie()
+        trie.add(['bucket', 'admin', 'folder', 'sub'])
+        trie.add(['bucket', 'admin', 'folder'])
+        trie.add(['bucket', 'admin', 'folder', 'other'])
+        trie.add(['bucket', 'admin', 'folder_2'])
+
+        assert trie.get_prefixes() == [['bucket', 'admin', 'folder'], ['bucket', 'admin', 'folder_2']]
+
+    def test_covers_paths_under_prefixes_only(self):
+        trie = PathTrie()
+        trie.add(['bucket', 'admin', 'folder'])
+
+        assert trie.covers(['bucket', 'admin', 'folder'])
+        assert trie.covers(['bucket', 'admin', 'folder', 'sub'])
+        assert not trie.covers(['bucket', 'admin'])
+        assert not trie.covers(['bucket', 'admin', 'folder_2'])
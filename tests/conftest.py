@@ -25,9 +25,9 @@ import jwt
 import pytest
 import pytest_asyncio
 import sqlalchemy
-from aioredis import StrictRedis
 from async_asgi_testclient import TestClient
 from httpx import Response
+from redis.asyncio import Redis
 from sqlalchemy import Column, MetaData, String, Table
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -85,10 +85,38 @@ def event_loop(request):
 
 @pytest.fixture(autouse=True)
 async def clean_up_redis():
-    cache = StrictRedis(host=environ.get('REDIS_HOST'))
+    cache = Redis(host=environ.get('REDIS_HOST'))
     await cache.flushall()
 
 
+@pytest.fixture(autouse=True)
+def clean_up_metadata_cache():
+    from app.commons.data_providers.metadata_cache import metadata_cache
+
+    metadata_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clean_up_read_locks():
+    from app.commons.locks import read_lock_manager
+
+    read_lock_manager.clear()
+
+
+@pytest.fixture(autouse=True)
+def clean_up_job_status_writer():
+    from app.commons.data_providers.job_status import job_status_writer
+
+    job_status_writer.clear()
+
+
+@pytest.fixture(autouse=True)
+def clean_up_job_status_cache():
+    from app.commons.data_providers.job_status_cache import job_status_cache
+
+    job_status_cache.clear()
+
+
 @pytest.fixture(scope='session', autouse=True)
 def create_folders():
     folder_path = './tests/tmp/'
@@ -242,9 +270,6 @@ def mock_kafka_producer(monkeypatch):
     async def fake_init_connection():
         pass
 
-    async def fake_send_message(x, y, z):
-        pass
-
     async def fake_validate_message(x, y, z):
         pass
 
@@ -252,7 +277,6 @@ def mock_kafka_producer(monkeypatch):
         pass
 
     monkeypatch.setattr(KakfaProducer, 'init_connection', lambda x: fake_init_connection())
-    monkeypatch.setattr(KakfaProducer, '_send_message', lambda x, y, z: fake_send_message(x, y, z))
     monkeypatch.setattr(KakfaProducer, '_validate_message', lambda x, y, z: fake_validate_message(x, y, z))
     monkeypatch.setattr(KakfaProducer, 'create_activity_log', lambda x, y, z, z1: fake_create_activity_log(x, y, z, z1))
 
@@ -0,0 +1,49 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from app.resources.helpers import get_files_folder_count, get_files_folder_recursive
+
+pytestmark = pytest.mark.asyncio
+
+SEARCH_URL = (
+    'http://metadata_service/v1/items/search/?container_code=any_code&container_type=project'
+    '&zone=0&recursive=true&archived=false&parent_path=folder&owner=me&type=file'
+)
+
+
+async def test_get_files_folder_recursive_reads_pages_from_metadata_service_every_time(httpx_mock):
+    httpx_mock.add_response(
+        method='GET', url=SEARCH_URL + '&page=0&page_size=1000', json={'result': [{'id': 'geid_1'}], 'num_of_pages': 1}
+    )
+
+    for _ in range(2):
+        items = [item async for item in get_files_folder_recursive('any_code', 'project', 'me', parent_path='folder')]
+        assert items == [{'id': 'geid_1'}]
+
+    assert len(httpx_mock.get_requests()) == 2
+
+
+async def test_get_files_folder_count_is_cached(httpx_mock):
+    httpx_mock.add_response(
+        method='GET', url=SEARCH_URL + '&page=0&page_size=1', json={'result': [{'id': 'geid_1'}], 'total': 5}
+    )
+
+    for _ in range(2):
+        assert await get_files_folder_count('any_code', 'project', 'me', parent_path='folder') == 5
+
+    assert len(httpx_mock.get_requests()) == 1
@@ -28,3 +28,20 @@ async def test_root_healthcheck_endpoint_returns_body_with_ok_in_status(client):
         'name': ConfigClass.APP_NAME,
         'version': ConfigClass.VERSION,
     }
+
+
+@pytest.mark.asyncio
+async def test_startup_applies_retention_without_legacy_migration(mocker, monkeypatch):
+    from app.routers.api_root import job_status_store, startup_event
+
+    monkeypatch.setattr(ConfigClass, 'JOB_STATUS_MIGRATE_LEGACY', False)
+    monkeypatch.setattr(ConfigClass, 'METADATA_CACHE_ENABLED', False)
+    monkeypatch.setattr(ConfigClass, 'STATUS_CACHE_SIZE', 0)
+    mocker.patch('app.routers.api_root.database')
+    migrate_legacy = mocker.patch.object(job_status_store, 'migrate_legacy')
+    apply_retention = mocker.patch.object(job_status_store, 'apply_retention')
+
+    await startup_event()
+
+    migrate_legacy.assert_not_called()
+    apply_retention.assert_called_once_with()
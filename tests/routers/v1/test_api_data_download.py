@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import json
 import time
 
 import jwt
@@ -191,3 +193,78 @@ async def test_v1_download_should_return_200_when_success(
     )
     assert resp.status_code == 200
     assert resp.text == 'file content\n'
+
+
+async def test_v1_download_status_poll_returns_when_status_changed(client, file_folder_jwt_token, fake_job):
+    resp = await client.get(
+        f'/v1/download/status/{file_folder_jwt_token}/poll',
+        query_string={'last_status': 'ZIPPING', 'timeout': 1},
+    )
+    assert resp.status_code == 200
+    assert resp.json()['result']['status'] == 'PRE_UPLOADED'
+
+
+async def test_v1_download_status_stream_sends_current_status(client, file_folder_jwt_token, fake_job):
+    from app.resources.helpers import set_status
+
+    async def _finish_job():
+        await asyncio.sleep(0.5)
+        await set_status(
+            'test_session_id',
+            'test_job_id',
+            'test/folder/file',
+            'data_download',
+            'SUCCEED',
+            'test_container',
+            'test_user',
+        )
+
+    finish_job = asyncio.ensure_future(_finish_job())
+    resp = await client.get(f'/v1/download/status/{file_folder_jwt_token}/stream')
+    await finish_job
+
+    assert resp.status_code == 200
+    events = [
+        json.loads(line.replace('data: ', '', 1)) for line in resp.text.split('\n\n') if line.startswith('data: ')
+    ]
+    assert [event['status'] for event in events] == ['PRE_UPLOADED', 'SUCCEED']
+
+
+async def test_v1_download_status_stream_sends_not_found_and_ends_for_missing_job(client, file_folder_jwt_token):
+    resp = await client.get(f'/v1/download/status/{file_folder_jwt_token}/stream')
+
+    assert resp.status_code == 200
+    assert resp.text.startswith('event: error\ndata: ')
+    assert json.loads(resp.text.split('data: ', 1)[1])['code'] == 404
+
+
+async def test_v1_download_status_batch_returns_status_and_error_per_hash_code(
+    client, file_folder_jwt_token, file_folder_jwt_token_expired, file_folder_jwt_token_invalid, fake_job
+):
+    resp = await client.post(
+        '/v1/download/status/batch',
+        json={'hash_codes': [file_folder_jwt_token, file_folder_jwt_token_expired, file_folder_jwt_token_invalid]},
+    )
+    assert resp.status_code == 200
+    result = resp.json()['result']
+    assert [item['code'] for item in result] == [200, 401, 400]
+    assert result[0]['result']['status'] == 'PRE_UPLOADED'
+    assert result[1]['error_msg'] == 'Signature has expired'
+    assert result[2]['error_msg'] == 'Invalid download token'
+
+
+async def test_v1_download_status_batch_returns_404_for_missing_job(client, file_folder_jwt_token):
+    resp = await client.post('/v1/download/status/batch', json={'hash_codes': [file_folder_jwt_token]})
+    assert resp.status_code == 200
+    assert resp.json()['result'][0]['code'] == 404
+
+
+async def test_v1_download_status_batch_returns_400_without_hash_codes(client):
+    resp = await client.post('/v1/download/status/batch', json={})
+    assert resp.status_code == 400
+
+
+async def test_v1_download_status_batch_does_not_list_jobs_by_session_cookie(client, fake_job):
+    resp = await client.post('/v1/download/status/batch', json={}, cookies={'sessionId': 'test_session_id'})
+    assert resp.status_code == 400
+    assert not resp.json()['result']
@@ -35,7 +35,7 @@ async def test_v2_dataset_download_pre_return_200_when_success(
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=fake_project_code&'
         'container_type=dataset&zone=1&recursive=true&archived=false&parent_path=&owner'
-        '=me&type=file',
+        '=me&type=file&page=0&page_size=1000',
         json={
             'result': [
                 {
@@ -96,15 +96,10 @@ async def test_v2_dataset_download_pre_empty_dataset_return_200_when_success(
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=fake_project_code'
         '&container_type=dataset&zone=1&recursive=true&archived=false&parent_path=&own'
-        'er=me&type=file',
+        'er=me&type=file&page=0&page_size=1000',
         json={'result': []},
     )
 
-    httpx_mock.add_response(method='POST', url='http://dataops_service/v2/resource/lock/bulk', json={}, status_code=200)
-    httpx_mock.add_response(
-        method='DELETE', url='http://dataops_service/v2/resource/lock/bulk', json={}, status_code=200
-    )
-
     mocker.patch(
         'app.commons.download_manager.dataset_download_manager.DatasetDownloadClient.add_schemas', return_value=[]
     )
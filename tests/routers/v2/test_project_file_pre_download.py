@@ -245,7 +245,7 @@ async def test_v2_download_pre_return_200_when_type_is_Folder(
         method='GET',
         url='http://metadata_service/v1/items/search/?container_code=fake_project_code'
         '&container_type=project&zone=0&recursive=true&archived=false&parent_path=admi'
-        'n.fake_file&owner=me&type=file',
+        'n.fake_file&owner=me&type=file&page=0&page_size=1000',
         json={
             'result': [
                 {
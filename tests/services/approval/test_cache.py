@@ -0,0 +1,63 @@
+# PILOT
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from app.services.approval.cache import ApprovalCache
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeApprovalServiceClient:
+    def __init__(self, entity_ids, version='1:0:0'):
+        self.entity_ids = entity_ids
+        self.version = version
+        self.loaded = 0
+
+    async def get_review_version(self, request_id):
+        return self.version
+
+    async def get_approval_entity_ids(self, request_id):
+        self.loaded += 1
+        return set(self.entity_ids)
+
+
+class TestApprovalCache:
+    def test_encode_and_decode_keep_entity_ids(self):
+        entity_ids = {'geid_2', 'geid_1'}
+
+        assert ApprovalCache.decode(ApprovalCache.encode(entity_ids)) == entity_ids
+        assert ApprovalCache.decode(ApprovalCache.encode(set())) == set()
+
+    async def test_get_entity_ids_loads_from_database_once(self):
+        client = FakeApprovalServiceClient({'geid_1', 'geid_2'})
+
+        first = await ApprovalCache(client).get_entity_ids('request_id')
+        second = await ApprovalCache(client).get_entity_ids('request_id')
+
+        assert first == second == {'geid_1', 'geid_2'}
+        assert client.loaded == 1
+
+    async def test_get_entity_ids_loads_again_when_review_version_changes(self):
+        client = FakeApprovalServiceClient({'geid_1'})
+        cache = ApprovalCache(client)
+        await cache.get_entity_ids('request_id')
+
+        client.entity_ids = {'geid_1', 'geid_2'}
+        client.version = '2:1:0'
+
+        assert await cache.get_entity_ids('request_id') == {'geid_1', 'geid_2'}
+        assert client.loaded == 2
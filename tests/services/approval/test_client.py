@@ -17,7 +17,7 @@
 import pytest
 
 from app.services.approval.client import ApprovalServiceClient
-from app.services.approval.models import ApprovalEntities
+from app.services.approval.models import ApprovalEntities, ReviewStatus
 
 pytestmark = pytest.mark.asyncio
 
@@ -33,3 +33,29 @@ class TestApprovalServiceClient:
 
         result = await approval_service_client.get_approval_entities(request_id)
         assert isinstance(result, ApprovalEntities)
+
+    async def test_get_approval_entity_ids_returns_set_of_entity_ids(self, approval_service_client):
+        result = await approval_service_client.get_approval_entity_ids('67e6bf62-be82-4401-9ec0-7d49ee047fe7')
+
+        assert result == {'fake_geid'}
+
+    async def test_get_approval_entity_ids_filters_by_review_status(self, approval_service_client):
+        result = await approval_service_client.get_approval_entity_ids(
+            '67e6bf62-be82-4401-9ec0-7d49ee047fe7', review_status=ReviewStatus.APPROVED
+        )
+
+        assert result == set()
+
+    async def test_get_review_version_changes_once_entity_is_reviewed(self, approval_service_client, engine):
+        request_id = '67e6bf62-be82-4401-9ec0-7d49ee047fe7'
+        table = approval_service_client.approval_entity
+
+        before = await approval_service_client.get_review_version(request_id)
+        async with engine.begin() as conn:
+            await conn.execute(
+                table.update().where(table.c.request_id == request_id).values(review_status=ReviewStatus.APPROVED.value)
+            )
+        after = await approval_service_client.get_review_version(request_id)
+
+        assert before == '1:0:0'
+        assert after == '1:1:0'